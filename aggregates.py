@@ -0,0 +1,503 @@
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from cube import week_end, week_index
+
+# Лимит памяти кэша агрегатов по умолчанию
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+# --- Ключ состояния фильтров ---
+
+def _canonical(value):
+    """Приводит значения фильтров к JSON-совместимому виду, не зависящему от порядка выбора."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, set)):
+        return sorted((_canonical(v) for v in value), key=lambda v: json.dumps(v, default=str))
+    if isinstance(value, tuple):
+        return [_canonical(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def filter_state_key(dataset_key, filter_spec):
+    """Канонический хэш датасета и активных фильтров - ключ для кэша агрегатов."""
+    payload = json.dumps([dataset_key, _canonical(filter_spec)], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# --- Кэш агрегатов ---
+
+def _estimate_size(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) else int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class AggregateCache:
+    """Потокобезопасный LRU-кэш результатов группировок с ограничением по памяти.
+
+    Ключ - кортеж (ключ состояния фильтров, имя агрегата, параметры).
+    Закэшированные результаты нельзя изменять на месте. Один ключ не считается дважды
+    параллельно: второй запрос ждёт вычисления первого (например, фонового прогрева).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        size = _estimate_size(value)
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            # Вытесняем самые старые записи, но всегда оставляем только что добавленную
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+
+    def get_or_compute(self, key, compute):
+        """Возвращает значение из кэша или вычисляет его через compute() и сохраняет."""
+        while True:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key][0]
+                pending = self._pending.get(key)
+                if pending is None:
+                    self.misses += 1
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Ключ уже считается в другом потоке; если там ошибка или запись сразу вытеснена - считаем сами
+            pending.wait()
+        try:
+            value = compute()
+            self.put(key, value)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+        return value
+
+    def named(self, name):
+        """[(ключ состояния фильтров, значение)] записей агрегата name без параметров."""
+        with self._lock:
+            return [(key[0], value) for key, (value, _) in self._entries.items() if key[1:] == (name,)]
+
+    def copy_states(self, state_keys):
+        """Копирует все записи состояний фильтров под новые ключи ({старый ключ: новый}); значения общие."""
+        with self._lock:
+            copies = [
+                ((state_keys[key[0]], *key[1:]), value)
+                for key, (value, _) in self._entries.items() if key[0] in state_keys
+            ]
+        for key, value in copies:
+            self.put(key, value)
+        return len(copies)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+            }
+
+
+# --- Агрегаты вкладок ---
+# Функции считают полный (без Топ-N) результат; Топ-N вырезается из него через top_n().
+
+def fill_rate_by(shifts, column):
+    """Fill Rate, число смен и выполнений по значениям колонки, по убыванию числа смен."""
+    agg = shifts.groupby(column, observed=True)['job_done'].agg(
+        fill_rate='mean', count='size', done='sum'
+    ).reset_index()
+    return agg.sort_values('count', ascending=False, kind='stable', ignore_index=True)
+
+
+def top_n(agg, n, sort_by='fill_rate'):
+    """Топ-N строк по числу смен из полного агрегата fill_rate_by (без повторной группировки)."""
+    return agg.head(n).sort_values(sort_by, ascending=False)
+
+
+def fill_rate_by_shift_number(shifts):
+    fr_by_shift_num = shifts.groupby('shift_number')['job_done'].agg(
+        fill_rate='mean', booked='size', done='sum'
+    ).reset_index()
+    fr_by_shift_num['shift_number'] = fr_by_shift_num['shift_number'].astype(str)
+    return fr_by_shift_num
+
+
+def weekly_fill_rate(shifts):
+    """Недельная динамика Fill Rate (как resample('W'), но без копии таблицы через set_index)."""
+    return shifts.groupby(pd.Grouper(key='shift_start_time', freq='W'))['job_done'].mean().reset_index()
+
+
+def fill_rate_by_duration(moments, labels):
+    """Fill Rate (job_done), число смен и выполнений по корзинам длительности (моменты Bucketizer.moments)."""
+    size, n, total, _ = moments
+    with np.errstate(divide='ignore', invalid='ignore'):
+        job_done = np.where(n > 0, total / n, np.nan)
+    return pd.DataFrame({
+        'duration_bin': pd.Categorical(labels, categories=labels, ordered=True),
+        'job_done': job_done, 'booked': size.astype('int64'), 'done': total,
+    })
+
+
+def demo_fill_rate_pivot(users):
+    """Средний user_avg_fr в разрезе возраст x доход."""
+    fr_demo = users.groupby(['age', 'income'], observed=True)['user_avg_fr'].mean().reset_index()
+    return fr_demo.pivot(index='age', columns='income', values='user_avg_fr')
+
+
+# Флаги: одна компактная таблица сочетаний значений вместо melt (пользователи x флаги).
+# Значение флага: 0 - нет, 1 - да, 2 - пропуск или другое значение (в разбивки не входит).
+FLAG_MOMENTS = ['size', 'n', 'sum', 'sumsq']
+
+
+def flag_combinations(users, flag_cols):
+    """Уникальные сочетания значений флагов и моменты user_avg_fr по ним.
+
+    Колонки: флаги (0/1/2), size - пользователей, n - с непустым FR, sum и sumsq - сумма
+    FR и его квадратов. Сочетаний не больше 3**len(flag_cols) и на практике - сотни,
+    поэтому все эффекты флагов дальше считаются по этой таблице, а не по пользователям.
+    """
+    codes = np.zeros(len(users), dtype='int64')
+    for col in flag_cols:
+        values = users[col].to_numpy(dtype='float64')
+        codes = codes * 3 + np.where(values == 1, 1, np.where(values == 0, 0, 2))
+    fr = users['user_avg_fr'].to_numpy(dtype='float64')
+    valid = ~np.isnan(fr)
+    fr = np.where(valid, fr, 0.0)
+    unique, inverse = np.unique(codes, return_inverse=True)
+
+    combinations = {}
+    for col in reversed(flag_cols):
+        unique, combinations[col] = np.divmod(unique, 3)
+    combinations = pd.DataFrame({col: combinations[col].astype('uint8') for col in flag_cols})
+    for name, weights in [('size', None), ('n', valid), ('sum', fr), ('sumsq', fr * fr)]:
+        combinations[name] = np.bincount(inverse, weights=weights, minlength=len(combinations))
+    return combinations
+
+
+def flag_effects(combinations, flag_cols):
+    """Моменты FR для значений флагов и их пар: {момент: матрица 2k x 2k}.
+
+    G - индикаторы сочетаний [флаг_1 == Нет .. флаг_k == Нет | флаг_1 == Да .. флаг_k == Да];
+    G^T (G * момент) за одно матричное произведение даёт все пары значений, на диагонали -
+    отдельные флаги.
+    """
+    codes = combinations[flag_cols].to_numpy()
+    indicators = np.hstack([codes == 0, codes == 1]).astype('float64')
+    return {
+        name: indicators.T @ (indicators * combinations[name].to_numpy(dtype='float64')[:, None])
+        for name in FLAG_MOMENTS
+    }
+
+
+def _mean_std(n, total, total_sq):
+    """Среднее и выборочное std по моментам (NaN, если наблюдений не хватает)."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(n > 0, total / n, np.nan)
+        variance = np.where(n > 1, (total_sq - total * mean) / (n - 1), np.nan)
+    return mean, np.sqrt(np.maximum(variance, 0))
+
+
+def fill_rate_by_flags(combinations, flag_cols_map):
+    """Средний user_avg_fr, его std и число пользователей для значений Да/Нет каждого флага."""
+    flag_cols = sorted(col for col in flag_cols_map if col in combinations.columns)
+    if not flag_cols:
+        return pd.DataFrame()
+
+    effects = {name: np.diag(matrix) for name, matrix in flag_effects(combinations, flag_cols).items()}
+    fill_rate, std = _mean_std(effects['n'], effects['sum'], effects['sumsq'])
+    # Порядок как у groupby (флаг, значение): Нет, Да внутри каждого флага
+    order = np.arange(2 * len(flag_cols)).reshape(2, -1).T.ravel()
+    fr_by_flag = pd.DataFrame({
+        'variable': [flag_cols_map[col] for col in flag_cols for _ in range(2)],
+        'value': ['Нет', 'Да'] * len(flag_cols),
+        'fill_rate': fill_rate[order], 'count': effects['size'][order].astype('int64'), 'std': std[order],
+    })
+    return fr_by_flag[fr_by_flag['count'] > 0].reset_index(drop=True)
+
+
+def flag_interactions(combinations, flag_cols_map):
+    """Попарные взаимодействия флагов: FR в четырёх ячейках пары и эффект взаимодействия.
+
+    interaction = FR(да, да) - FR(да, нет) - FR(нет, да) + FR(нет, нет): насколько
+    сочетание флагов меняет FR сверх суммы их отдельных эффектов.
+    """
+    flag_cols = sorted(col for col in flag_cols_map if col in combinations.columns)
+    columns = ['flag_a', 'flag_b', 'count_both', 'fr_both', 'fr_a_only', 'fr_b_only', 'fr_neither', 'interaction']
+    if len(flag_cols) < 2:
+        return pd.DataFrame(columns=columns)
+
+    effects = flag_effects(combinations, flag_cols)
+    fill_rate, _ = _mean_std(effects['n'], effects['sum'], effects['sumsq'])
+    k = len(flag_cols)
+    first, second = np.triu_indices(k, k=1)
+    cell = lambda a, b: fill_rate[a * k + first, b * k + second]
+    interactions = pd.DataFrame({
+        'flag_a': [flag_cols_map[flag_cols[i]] for i in first],
+        'flag_b': [flag_cols_map[flag_cols[j]] for j in second],
+        'count_both': effects['size'][k + first, k + second].astype('int64'),
+        'fr_both': cell(1, 1), 'fr_a_only': cell(1, 0), 'fr_b_only': cell(0, 1), 'fr_neither': cell(0, 0),
+    })
+    interactions['interaction'] = (
+        interactions['fr_both'] - interactions['fr_a_only'] - interactions['fr_b_only'] + interactions['fr_neither']
+    )
+    return interactions[columns]
+
+
+def fill_rate_by_bins(moments, column, labels):
+    """Средний user_avg_fr, число пользователей и std по бакетам колонки (моменты Bucketizer.moments)."""
+    size, n, total, total_sq = moments
+    fill_rate, std = _mean_std(n, total, total_sq)
+    return pd.DataFrame({
+        f'{column}_bin': pd.Categorical(labels, categories=labels, ordered=True),
+        'fill_rate': fill_rate, 'count': size.astype('int64'), 'std': std,
+    })
+
+
+# --- Переходы между сменами (вкладка 3) ---
+# Исход смены: 0 - провал, 1 - успех; исход следующей смены - ещё 2, если брони k+1 нет.
+
+TRANSITION_OUTCOMES = ['Провал', 'Успех', 'Нет брони']
+
+
+def shift_transitions(shifts, max_slot, gap_bins):
+    """Все переходы k -> k+1 за один проход по сменам, отсортированным по (user_id, shift_number).
+
+    Вместо попарных merge слотов соседние строки одного пользователя сравниваются
+    векторно, поэтому число слотов не ограничено. Возвращает счётчики, которые
+    SQL-бэкенд собирает теми же колонками:
+    steps - (step, done, next, count) по всем шагам 1..max_slot-1;
+    paths - (code, users): цепочка исходов слотов 1..max_slot в троичном коде
+            (цифра слота k при 3**(k-1): 0 - нет брони, 1 - провал, 2 - успех);
+    gap_summary, gap_histogram - дни от брони k до брони k+1 по (step, done):
+            число, среднее и квартили; число пар в корзинах gap_bins (right=False).
+    """
+    number = shifts['shift_number'].to_numpy(dtype='int64')
+    user = shifts['user_id'].to_numpy()
+    order = np.lexsort((number, user))
+    number, user = number[order], user[order]
+    done = (shifts['job_done'].to_numpy(dtype='float64')[order] > 0).astype('int64')
+    booked = shifts['shift_booked_time'].to_numpy(dtype='datetime64[ns]')[order]
+
+    # Следующая строка - смена k+1 того же пользователя
+    has_next = np.zeros(len(number), dtype=bool)
+    has_next[:-1] = (user[1:] == user[:-1]) & (number[1:] == number[:-1] + 1)
+    next_done = np.full(len(number), 2)
+    next_done[:-1] = np.where(has_next[:-1], done[1:], 2)
+
+    # После последнего слота выгрузки брони быть не может - такие смены не переходы
+    source = number < max_slot
+    codes = ((number[source] - 1) * 2 + done[source]) * 3 + next_done[source]
+    counts = np.bincount(codes, minlength=max(max_slot - 1, 0) * 6)
+    index = np.arange(len(counts))
+    steps = pd.DataFrame({'step': index // 6 + 1, 'done': index // 3 % 2, 'next': index % 3, 'count': counts})
+
+    starts = np.flatnonzero(np.r_[True, user[1:] != user[:-1]]) if len(user) else np.array([], dtype='int64')
+    user_codes = np.add.reduceat((done + 1) * 3 ** (number - 1), starts) if len(user) else starts
+    path_codes, users = np.unique(user_codes, return_counts=True)
+    paths = pd.DataFrame({'code': path_codes, 'users': users})
+
+    pairs = np.flatnonzero(has_next)
+    days = (booked[pairs + 1] - booked[pairs]) / np.timedelta64(1, 'D')
+    valid = days >= 0  # NaT и брони "раньше предыдущей" не учитываются
+    pairs, days = pairs[valid], days[valid]
+    group = (number[pairs] - 1) * 2 + done[pairs]
+    gap_summary = _group_quantiles(group, days)
+    buckets = np.searchsorted(np.asarray(gap_bins, dtype='float64'), days, side='right') - 1
+    in_bins = (buckets >= 0) & (buckets < len(gap_bins) - 1)
+    bucket_codes, bucket_counts = np.unique(group[in_bins] * (len(gap_bins) - 1) + buckets[in_bins], return_counts=True)
+    gap_group, bucket = np.divmod(bucket_codes, len(gap_bins) - 1)
+    gap_histogram = pd.DataFrame({
+        'step': gap_group // 2 + 1, 'done': gap_group % 2, 'bucket': bucket, 'count': bucket_counts
+    })
+    return steps, paths, gap_summary, gap_histogram
+
+
+def _group_quantiles(group, values):
+    """(step, done, count, mean, p25, median, p75) по группам (step - 1) * 2 + done.
+
+    Квантили - линейная интерполяция, как np.quantile и quantile_cont в DuckDB,
+    для всех групп сразу по одной сортировке.
+    """
+    order = np.lexsort((values, group))
+    group, values = group[order], values[order]
+    groups, first, count = np.unique(group, return_index=True, return_counts=True)
+    summary = pd.DataFrame({
+        'step': groups // 2 + 1, 'done': groups % 2, 'count': count,
+        'mean': np.add.reduceat(values, first) / count if len(values) else np.array([], dtype='float64'),
+    })
+    for name, q in [('p25', 0.25), ('median', 0.5), ('p75', 0.75)]:
+        position = first + q * (count - 1)
+        low, high = np.floor(position).astype('int64'), np.ceil(position).astype('int64')
+        summary[name] = values[low] + (values[high] - values[low]) * (position - low)
+    return summary
+
+
+def transition_table(steps):
+    """Матрица переходов: доля исходов смены k+1 при исходе смены k (в пределах шага и исхода)."""
+    table = steps.copy()
+    totals = table.groupby(['step', 'done'])['count'].transform('sum')
+    table['share'] = table['count'] / totals.where(totals > 0)
+    table['transition'] = table['step'].astype(str) + '→' + (table['step'] + 1).astype(str)
+    table['outcome'] = table['done'].map(dict(enumerate(TRANSITION_OUTCOMES)))
+    table['next_outcome'] = table['next'].map(dict(enumerate(TRANSITION_OUTCOMES)))
+    return table[['step', 'transition', 'outcome', 'next_outcome', 'count', 'share']]
+
+
+def path_table(paths, max_slot):
+    """Цепочки исходов пользователей по слотам (Успех → Провал → Нет брони), по убыванию числа."""
+    digits = {0: '—', 1: 'Провал', 2: 'Успех'}
+    labels, booked = [], []
+    for code in paths['code'].to_numpy(dtype='int64'):
+        slots = [(int(code) // 3**k) % 3 for k in range(max_slot)]
+        last = max(k for k, digit in enumerate(slots) if digit)
+        path = [digits[digit] for digit in slots[:last + 1]]
+        # Пользователь не забронировал следующий слот - цепочка обрывается
+        if last + 1 < max_slot:
+            path.append(TRANSITION_OUTCOMES[2])
+        labels.append(' → '.join(path))
+        booked.append(sum(1 for digit in slots if digit))
+    table = pd.DataFrame({'path': labels, 'shifts': booked, 'users': paths['users'].to_numpy(dtype='int64')})
+    table['share'] = table['users'] / table['users'].sum() if len(table) else table['users']
+    return table.sort_values(['users', 'path'], ascending=[False, True], ignore_index=True)
+
+
+def next_booking_table(gap_summary, gap_histogram, labels):
+    """Дни до следующей брони по шагу и исходу смены: квартили и доли пар в корзинах labels."""
+    table = gap_summary.copy()
+    table['transition'] = table['step'].astype(str) + '→' + (table['step'] + 1).astype(str)
+    table['outcome'] = table['done'].map(dict(enumerate(TRANSITION_OUTCOMES)))
+    counts = np.zeros((len(table), len(labels)), dtype='int64')
+    rows = pd.MultiIndex.from_frame(table[['step', 'done']]).get_indexer(
+        pd.MultiIndex.from_frame(gap_histogram[['step', 'done']])
+    )
+    np.add.at(counts, (rows, gap_histogram['bucket'].to_numpy(dtype='int64')), gap_histogram['count'].to_numpy(dtype='int64'))
+    table[labels] = counts
+    table = table.sort_values(['step', 'done'], ignore_index=True)
+    return table[['step', 'transition', 'outcome', 'count', 'mean', 'p25', 'median', 'p75', *labels]]
+
+
+def experience_effect(steps):
+    """FR на 2-й смене в зависимости от результата 1-й по счётчикам переходов (пусто, если пар 1->2 нет)."""
+    pairs = steps[(steps['step'] == 1) & (steps['next'] < 2)]
+    booked = pairs.groupby('done')['count'].sum()
+    done = pairs[pairs['next'] == 1].groupby('done')['count'].sum().reindex(booked.index, fill_value=0)
+    booked = booked[booked > 0]
+    if booked.empty:
+        return pd.DataFrame()
+    fr_exp = (done[booked.index] / booked).rename('job_done_2').rename_axis('job_done_1').reset_index()
+    fr_exp['job_done_1'] = fr_exp['job_done_1'].map({0: 'Провал 1-й', 1: 'Успех 1-й'})
+    return fr_exp
+
+
+# --- Удержание и когорты (вкладка 4) ---
+
+def _days(series):
+    """Дни от эпохи (float, NaN для NaT) для колонки datetime."""
+    values = series.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    days = values.astype('int64').astype('float64')
+    days[np.isnat(values)] = np.nan
+    return days
+
+
+def format_percent(values, decimals=1):
+    """Векторное форматирование долей в текст "12.3%" (пустая строка для NaN)."""
+    values = np.asarray(values, dtype='float64')
+    text = np.char.mod(f'%.{decimals}f%%', np.nan_to_num(values) * 100)
+    return np.where(np.isnan(values), '', text)
+
+
+def cohort_retention(users, max_cohorts=15, max_weeks=12):
+    """Доля пользователей недельной когорты 1-й брони, забронировавших 2-ю смену через N недель.
+
+    Индекс - неделя 1-й брони ('YYYY-MM-DD/YYYY-MM-DD', как Period('W')), колонки - разница в неделях.
+    Считается целочисленной арифметикой по номерам недель, без Period и apply.
+    """
+    first_days = _days(users['shift_booked_time_1'])
+    has_first = ~np.isnan(first_days)
+    cohort = week_index(first_days[has_first]).astype('int64')
+    second_days = _days(users['shift_booked_time_2'])[has_first]
+    returned = ~np.isnan(second_days)
+    if not cohort.size or not returned.any():
+        return pd.DataFrame()
+
+    week_diff = week_index(second_days[returned]).astype('int64') - cohort[returned]
+    # Уникальные пары (когорта, разница недель) и число вернувшихся в каждой
+    pairs = pd.DataFrame({'cohort': cohort[returned], 'week_diff': week_diff}).value_counts()
+    return cohort_pivot(pairs, pd.Series(cohort).value_counts(), max_cohorts, max_weeks)
+
+
+def cohort_pivot(pairs, cohort_size, max_cohorts=15, max_weeks=12):
+    """Таблица когорт из счётчиков (общая для pandas и SQL-бэкенда).
+
+    pairs - число вернувшихся по (cohort, week_diff), cohort_size - размер когорты по её номеру недели.
+    """
+    table = pairs.unstack('week_diff').sort_index().sort_index(axis=1)
+    table = table.div(cohort_size.reindex(table.index).to_numpy(), axis=0)
+    # Ограничиваем вывод, чтобы не было слишком много данных
+    table = table.iloc[-max_cohorts:, :max_weeks]
+
+    mondays = (week_end(0) - 6 + 7 * table.index.to_numpy()).astype('datetime64[D]')
+    table.index = [f"{monday}/{monday + 6}" for monday in mondays]
+    return table
+
+
+def survival_curve(min_return_days, horizon=90):
+    """Доля пользователей, ещё не вернувшихся к дню 0..horizon (по гистограмме min_return_days).
+
+    min_return_days - дни до 2-й/3-й брони (NaN - не вернулся). Один проход bincount
+    вместо фильтрации всех пользователей на каждый день.
+    """
+    values = np.asarray(min_return_days, dtype='float64')
+    returned = values[~np.isnan(values)]
+    # Корзина 0 - отрицательные дни, d+1 - вернулся на d-й день, horizon+2 - позже горизонта
+    buckets = np.clip(np.ceil(returned), -1, horizon + 1).astype('int64') + 1
+    return survival_from_buckets(np.bincount(buckets, minlength=horizon + 3), values.size, horizon)
+
+
+def survival_from_buckets(bucket_counts, total, horizon=90):
+    """Кривая удержания по числу вернувшихся в корзинах survival_curve (длина horizon + 3)."""
+    returned_by_day = np.cumsum(bucket_counts)[1:horizon + 2]
+    active = total - returned_by_day
+    return pd.DataFrame({
+        'day': np.arange(horizon + 1),
+        'retention_percent': active / total if total > 0 else np.zeros(horizon + 1)
+    })
+
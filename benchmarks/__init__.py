@@ -0,0 +1 @@
+"""Генератор синтетических данных и бенчмарки конвейера дашборда (запуск: python -m benchmarks.<модуль>)."""
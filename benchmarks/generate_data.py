@@ -0,0 +1,200 @@
+"""Генератор синтетических данных в формате выгрузки дашборда ("широкая" таблица, до 3 смен).
+
+Пример:
+    python -m benchmarks.generate_data --users 1000000 --out data/users_1m.csv
+
+Файл пишется частями (по умолчанию 500k строк), поэтому память не растёт с размером выгрузки.
+Результат детерминирован для (users, seed, chunk_size).
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # Без pyarrow пишем через pandas (в несколько раз медленнее)
+    pa = None
+
+DEFAULT_CHUNK_SIZE = 500_000
+DEFAULT_START = '2024-01-01'
+DEFAULT_DAYS = 180
+
+GENDERS = ['M', 'F']
+AGES = ['18-24', '25-34', '35-44', '45-54', '55+']
+AGE_WEIGHTS = [0.22, 0.34, 0.22, 0.14, 0.08]
+INCOMES = ['low', 'middle', 'high']
+INCOME_WEIGHTS = [0.45, 0.4, 0.15]
+PLATFORMS = ['android', 'ios', 'web']
+PLATFORM_WEIGHTS = [0.62, 0.3, 0.08]
+
+# ~85 регионов с распределением, близким к закону Ципфа (крупные города дают большую часть смен)
+REGIONS = ['Москва', 'Санкт-Петербург', 'Московская область', 'Новосибирск', 'Екатеринбург', 'Казань',
+           'Нижний Новгород', 'Краснодар', 'Самара', 'Ростов-на-Дону'] + [f'Регион {i:02d}' for i in range(75)]
+# Группы заданий и вложенные в них типы (33 типа)
+TASK_GROUPS = {
+    'Склад': ['Комплектовщик', 'Грузчик', 'Кладовщик', 'Упаковщик', 'Сортировщик', 'Водитель погрузчика'],
+    'Доставка': ['Курьер пеший', 'Курьер на авто', 'Курьер на велосипеде', 'Экспедитор'],
+    'Ритейл': ['Продавец', 'Кассир', 'Мерчендайзер', 'Выкладка товара', 'Инвентаризация'],
+    'Общепит': ['Повар', 'Официант', 'Бариста', 'Посудомойщик', 'Сборщик заказов'],
+    'Клининг': ['Уборщик', 'Мойщик окон', 'Горничная'],
+    'Производство': ['Оператор линии', 'Фасовщик', 'Маркировщик', 'Контролёр ОТК'],
+    'Промо': ['Промоутер', 'Аниматор', 'Раздача листовок'],
+    'Офис': ['Оператор ввода данных', 'Администратор', 'Курьер документов'],
+}
+TASK_GROUP_WEIGHTS = [0.34, 0.22, 0.16, 0.1, 0.07, 0.06, 0.03, 0.02]
+
+FLAG_COLS = [
+    'started_verification_gu_flg', 'success_verification_gu_flg', 'cv_free_grafik_flg', 'cv_podrabotka_flg',
+    'vac_podrabotka_flg', 'click_internet_adv_flg', 'opened_push_flg', 'watched_stories_in_app_flg',
+    'click_addv_communication_flg', 'has_call_centre_communication_flg'
+]
+FLAG_RATES = [0.55, 0.4, 0.25, 0.3, 0.35, 0.2, 0.45, 0.3, 0.15, 0.1]
+
+
+def _zipf_weights(n, exponent=1.1):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+REGION_WEIGHTS = _zipf_weights(len(REGIONS))
+TASK_TYPES = [(group, task) for group, tasks in TASK_GROUPS.items() for task in tasks]
+
+
+def _with_missing(rng, values, rate):
+    """Заменяет долю rate значений на пропуски (object -> None, числа -> NaN)."""
+    missing = rng.random(len(values)) < rate
+    if values.dtype.kind in 'OU':
+        values = values.astype(object)
+        values[missing] = None
+    else:
+        values = values.astype('float64')
+        values[missing] = np.nan
+    return values
+
+
+def _task_types(rng, n):
+    group_idx = rng.choice(len(TASK_GROUPS), n, p=TASK_GROUP_WEIGHTS)
+    groups = np.array(list(TASK_GROUPS))
+    # Внутри группы типы распределены по Ципфу
+    offsets = np.cumsum([0] + [len(tasks) for tasks in TASK_GROUPS.values()])
+    sizes = np.diff(offsets)
+    within = np.minimum(rng.zipf(1.6, n) - 1, sizes[group_idx] - 1)
+    tasks = np.array([task for _, task in TASK_TYPES])
+    return groups[group_idx], tasks[offsets[group_idx] + within]
+
+
+def generate_chunk(n, rng, start=DEFAULT_START, days=DEFAULT_DAYS):
+    """Одна часть выгрузки на n пользователей."""
+    df = pd.DataFrame({
+        'gender': _with_missing(rng, rng.choice(GENDERS, n, p=[0.52, 0.48]), 0.03),
+        'age': _with_missing(rng, rng.choice(AGES, n, p=AGE_WEIGHTS), 0.05),
+        'income': _with_missing(rng, rng.choice(INCOMES, n, p=INCOME_WEIGHTS), 0.12),
+        'platform': rng.choice(PLATFORMS, n, p=PLATFORM_WEIGHTS),
+        'region': rng.choice(REGIONS, n, p=REGION_WEIGHTS),
+        'serp_frequency': _with_missing(rng, rng.negative_binomial(1, 0.12, n), 0.02),
+        'item_view_frequency': _with_missing(rng, rng.negative_binomial(1, 0.08, n), 0.02),
+        'quantity_responses': rng.negative_binomial(1, 0.15, n),
+    })
+    flags = np.empty((n, len(FLAG_COLS)))
+    for j, (col, rate) in enumerate(zip(FLAG_COLS, FLAG_RATES)):
+        flags[:, j] = rng.random(n) < rate
+        df[col] = _with_missing(rng, flags[:, j], 0.08)
+    # Успешная верификация возможна только после начатой
+    df['success_verification_gu_flg'] = np.where(
+        df['started_verification_gu_flg'] == 0, 0, df['success_verification_gu_flg']
+    )
+
+    # Склонность пользователя выполнять смены зависит от профиля и активности
+    propensity = (
+        -0.2 + 0.5 * flags[:, 1] + 0.3 * flags[:, 3] + 0.15 * flags[:, 6]
+        + 0.02 * np.minimum(df['quantity_responses'].to_numpy(), 30) + rng.normal(0, 0.6, n)
+    )
+    first_booking = (
+        np.datetime64(start, 's')
+        + (rng.random(n) * days * 86400).astype('int64').astype('timedelta64[s]')
+    )
+    booked = first_booking
+    has_prev = np.ones(n, dtype=bool)
+    home_region = df['region'].to_numpy()
+    for i in (1, 2, 3):
+        # Каждая следующая смена - у части вернувшихся пользователей
+        has = has_prev & (rng.random(n) < (1.0 if i == 1 else 0.45 + 0.1 * (i == 3)))
+        if i > 1:
+            gap = rng.exponential(12 * 86400, n).astype('int64').astype('timedelta64[s]')
+            booked = booked + gap
+        lead = (rng.gamma(2, 18 * 3600, n)).astype('int64').astype('timedelta64[s]')
+        groups, tasks = _task_types(rng, n)
+        duration = np.clip(np.round(rng.normal(8, 2.5, n) * 2) / 2, 1, 16)
+        price = np.round(rng.lognormal(np.log(280), 0.25, n) / 5) * 5
+        # Опыт и ставка повышают вероятность выполнения
+        logit = propensity + 0.3 * (i - 1) + 0.004 * (price - 280) - 0.05 * (duration - 8)
+        done = rng.random(n) < 1 / (1 + np.exp(-logit))
+        # Смена обычно в домашнем регионе пользователя
+        shift_region = np.where(rng.random(n) < 0.9, home_region, rng.choice(REGIONS, n, p=REGION_WEIGHTS))
+
+        df[f'shift_booked_time_{i}'] = pd.Series(booked).where(has)
+        start_time = pd.Series(booked + lead).where(has)
+        # Небольшая доля смен без даты старта (сбой выгрузки)
+        df[f'shift_start_time_{i}'] = start_time.where(rng.random(n) >= 0.002)
+        df[f'job_done_{i}'] = np.where(has, done, np.nan)
+        df[f'shift_duration_{i}'] = np.where(has, duration, np.nan)
+        df[f'shift_price_per_hour_{i}'] = np.where(has, price, np.nan)
+        df[f'task_type_{i}'] = np.where(has, tasks, None)
+        df[f'task_group_{i}'] = np.where(has, groups, None)
+        df[f'shift_region_{i}'] = np.where(has, shift_region, None)
+        has_prev = has
+    return df
+
+
+def generate_csv(path, users, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, start=DEFAULT_START, days=DEFAULT_DAYS,
+                 on_progress=None):
+    """Пишет CSV на users пользователей частями по chunk_size строк."""
+    writer, schema = None, None
+    written = 0
+    try:
+        for chunk_index, offset in enumerate(range(0, users, chunk_size)):
+            n = min(chunk_size, users - offset)
+            rng = np.random.default_rng([seed, chunk_index])
+            chunk = generate_chunk(n, rng, start=start, days=days)
+            if pa is None:
+                chunk.to_csv(path, mode='w' if chunk_index == 0 else 'a', header=chunk_index == 0, index=False,
+                             date_format='%Y-%m-%d %H:%M:%S')
+            else:
+                # Схема первой части: в следующих колонка может целиком состоять из пропусков
+                table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if writer is None:
+                    schema = table.schema
+                    writer = pa_csv.CSVWriter(str(path), schema)
+                writer.write_table(table)
+            written += n
+            if on_progress:
+                on_progress(written, users)
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетическая выгрузка для дашборда Fill Rate.")
+    parser.add_argument('--users', type=int, required=True, help="Число пользователей (строк)")
+    parser.add_argument('--out', required=True, help="Путь к CSV")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--start', default=DEFAULT_START, help="Первая дата бронирований")
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help="Период первых бронирований, дней")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    generate_csv(
+        args.out, args.users, seed=args.seed, chunk_size=args.chunk_size, start=args.start, days=args.days,
+        on_progress=lambda done, total: print(f"\r{done:,} / {total:,}", end='', flush=True)
+    )
+    print(f"\nГотово за {time.perf_counter() - started:.1f} с: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Бенчмарки конвейера дашборда: время и пиковая память каждого этапа на синтетических данных.
+
+Пример:
+    python -m benchmarks.run_benchmarks --users 100000 1000000 --out bench.json
+    python -m benchmarks.run_benchmarks --users 100000 --compare bench.json
+
+Данные генерируются один раз и переиспользуются из --data-dir. Время - минимум из --repeat
+запусков; пиковая память (tracemalloc, включая буферы NumPy/pandas) - отдельным запуском.
+Буферы Arrow tracemalloc не видит - для них в отчёт пишется пиковый RSS процесса.
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows: пикового RSS не будет
+    resource = None
+
+from aggregates import AggregateCache
+from benchmarks.generate_data import generate_csv
+from dataset_store import DatasetStore
+from engine import SHIFT_FILTER_COLS, USER_FILTER_COLS, USER_RANGE_COLS, AnalyticsEngine, build_cube
+from filter_index import FilterIndex
+from ingest import DEFAULT_CHUNKSIZE, PIPELINE_VERSION, load_csv
+
+DEFAULT_DATA_DIR = Path('~/.cache/fr_dashboard/bench').expanduser()
+DEFAULT_USERS = [100_000]
+# Сколько случайных наборов фильтров прогоняется в этапах с фильтрами
+DEFAULT_FILTER_SPECS = 20
+
+
+def dataset_path(data_dir, users, seed):
+    path = Path(data_dir) / f'users_{users}_seed{seed}.csv'
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"Генерация {path} ...", file=sys.stderr)
+        generate_csv(path.with_suffix('.tmp'), users, seed=seed)
+        path.with_suffix('.tmp').replace(path)
+    return path
+
+
+def random_specs(engine, count, seed=0):
+    """Случайные наборы фильтров: подмножества значений нескольких колонок и отрезок дат."""
+    rng = np.random.default_rng(seed)
+    default = engine.default_spec()
+    low, high = default['dates'] or (None, None)
+    specs = []
+    for _ in range(count):
+        spec = {section: dict(default[section]) for section in ('users', 'user_ranges', 'shifts')}
+        for section in ('users', 'shifts'):
+            for col in rng.choice(list(spec[section]), size=min(2, len(spec[section])), replace=False):
+                values = spec[section][col]
+                keep = rng.random(len(values)) < 0.6
+                keep[rng.integers(len(values))] = True
+                spec[section][col] = [value for value, kept in zip(values, keep) if kept]
+        spec['dates'] = None
+        if low is not None:
+            days = (high - low).days
+            start = low + pd.Timedelta(days=int(rng.integers(0, max(days // 2, 1))))
+            spec['dates'] = (start, start + pd.Timedelta(days=int(rng.integers(7, max(days // 2, 8)))))
+        specs.append(spec)
+    return specs
+
+
+def measure(stage, run, repeat=1, trace_memory=True):
+    """Минимальное время из repeat запусков run() и пиковая память отдельного запуска, МБ."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            run()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return {'stage': stage, 'seconds': min(timings), 'peak_mb': peak_mb}
+
+
+def bench_dataset(path, repeat=1, trace_memory=True, filter_specs=DEFAULT_FILTER_SPECS):
+    """Все этапы конвейера на одном файле. Возвращает (число смен, список результатов)."""
+    results = []
+
+    def record(stage, run, runs_per_call=1):
+        """Замер этапа; runs_per_call - сколько операций делает run() (время делится на него)."""
+        row = measure(stage, run, repeat, trace_memory)
+        row['seconds'] /= runs_per_call
+        results.append(row)
+        peak = f", пик {row['peak_mb']:.0f} МБ" if row['peak_mb'] is not None else ''
+        print(f"  {stage:<30} {row['seconds']:8.3f} с{peak}", file=sys.stderr)
+
+    def load(chunksize=None):
+        with open(path, 'rb') as file_obj:
+            return load_csv(file_obj, chunksize=chunksize)
+
+    # Загрузка: целиком и потоково
+    record('load_csv', load)
+    record('load_csv_streaming', lambda: load(DEFAULT_CHUNKSIZE))
+    df_users, df_shifts, _ = load()
+
+    # Дисковое хранилище Arrow
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = DatasetStore(store_dir)
+        if store.enabled:
+            record('store_put', lambda: store.put('bench', df_users, df_shifts, {}))
+            record('store_get', lambda: store.get('bench'))
+
+    # Структуры на датасет: индекс фильтров и куб
+    build_index = lambda: FilterIndex(
+        df_users, df_shifts, user_dims=USER_FILTER_COLS, shift_dims=SHIFT_FILTER_COLS, user_range_cols=USER_RANGE_COLS
+    )
+    record('filter_index_build', build_index)
+    record('cube_build', lambda: build_cube(df_users, df_shifts))
+    filter_index, cube = build_index(), build_cube(df_users, df_shifts)
+
+    def fresh_engine():
+        return AnalyticsEngine(df_users, df_shifts, 'bench', filter_index, cube, AggregateCache())
+
+    engine = fresh_engine()
+    specs = random_specs(engine, filter_specs)
+    default_spec = engine.default_spec()
+
+    # Фильтрация (раздел 5): маски по индексу, без агрегатов; время - на один набор фильтров
+    def apply_filters():
+        for spec in specs:
+            view = engine.view(spec)
+            view.filtered.users, view.filtered.shifts
+    record('filter_apply_per_spec', apply_filters, len(specs))
+
+    # Агрегаты всех вкладок: холодный кэш, случайные фильтры и повтор из кэша
+    record('aggregates_default_cold', lambda: fresh_engine().view(default_spec).compute_all())
+
+    def aggregates_filtered():
+        cold = fresh_engine()
+        for spec in specs:
+            cold.view(spec).compute_all()
+    record('aggregates_filtered_per_spec', aggregates_filtered, len(specs))
+
+    engine.view(default_spec).compute_all()
+    record('aggregates_default_warm', lambda: engine.view(default_spec).compute_all())
+    return len(df_shifts), results
+
+
+def max_rss_mb():
+    """Пиковый RSS процесса за всё время работы, МБ (None, если недоступен)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS - байты
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pipeline_version': PIPELINE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline_path):
+    """Печатает отношение времени и памяти к сохранённому прогону (>1 - стало медленнее/больше)."""
+    baseline = json.loads(Path(baseline_path).read_text(encoding='utf-8'))
+    previous = {(row['users'], row['stage']): row for row in baseline['results']}
+    print(f"\nСравнение с {baseline_path} ({baseline['environment']['created']}):")
+    for row in results:
+        old = previous.get((row['users'], row['stage']))
+        if old is None:
+            continue
+        ratio = row['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        memory = ''
+        if row['peak_mb'] is not None and old.get('peak_mb'):
+            memory = f", память x{row['peak_mb'] / old['peak_mb']:.2f}"
+        print(f"  {row['users']:>11,} {row['stage']:<30} время x{ratio:.2f}{memory}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки загрузки, фильтрации и агрегатов дашборда Fill Rate.")
+    parser.add_argument('--users', type=int, nargs='+', default=DEFAULT_USERS, help="Размеры датасетов (пользователей)")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="Каталог сгенерированных CSV")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Запусков на этап (берётся минимум)")
+    parser.add_argument('--filter-specs', type=int, default=DEFAULT_FILTER_SPECS)
+    parser.add_argument('--no-memory', action='store_true', help="Не замерять пиковую память (быстрее)")
+    parser.add_argument('--out', help="JSON с результатами")
+    parser.add_argument('--compare', help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    all_results = []
+    for users in args.users:
+        path = dataset_path(args.data_dir, users, args.seed)
+        print(f"{users:,} пользователей ({path.stat().st_size / 2**20:.0f} МБ CSV):", file=sys.stderr)
+        shifts, results = bench_dataset(path, args.repeat, not args.no_memory, args.filter_specs)
+        all_results += [{'users': users, 'shifts': shifts, **row} for row in results]
+
+    report = {'environment': environment(), 'max_rss_mb': max_rss_mb(), 'results': all_results}
+    print(f"Пиковый RSS процесса: {report['max_rss_mb'] or 0:.0f} МБ", file=sys.stderr)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding='utf-8')
+    if args.compare:
+        compare(all_results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
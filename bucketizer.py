@@ -0,0 +1,119 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import perf
+
+# Код строки вне всех корзин (пропуск или значение за границами); корзин не больше 255
+NO_BUCKET = 255
+# Сколько наборов кодов (колонка x границы) держать на датасет: пользовательские границы добавляют новые
+MAX_CODE_SETS = 32
+
+
+# --- Границы и метки корзин ---
+
+def parse_bins(text):
+    """Границы корзин из строки вида "0, 1, 5, 10, inf"; ValueError, если они некорректны."""
+    try:
+        bins = [float(token) for token in re.split(r'[,;\s]+', text.strip()) if token]
+    except ValueError:
+        raise ValueError("Границы должны быть числами через запятую (можно -inf и inf)") from None
+    if len(bins) < 2 or len(bins) > NO_BUCKET + 1:
+        raise ValueError(f"Нужно от 2 до {NO_BUCKET + 1} границ")
+    if any(np.isnan(bins)) or any(low >= high for low, high in zip(bins[:-1], bins[1:])):
+        raise ValueError("Границы должны строго возрастать")
+    return bins
+
+
+def format_bins(bins):
+    return ', '.join(f'{float(b):g}' for b in bins)
+
+
+def bin_labels(bins):
+    """Метки корзин [a, b): при целых границах '5-9', '20+', '<1', иначе '0.5-1.5'."""
+    integer = all(float(b).is_integer() for b in bins if np.isfinite(b))
+    labels = []
+    for low, high in zip(bins[:-1], bins[1:]):
+        if not np.isfinite(low) and not np.isfinite(high):
+            labels.append('Все')
+        elif not np.isfinite(low):
+            labels.append(f'<{high:g}')
+        elif not np.isfinite(high):
+            labels.append(f'{low:g}+')
+        elif integer and high - low == 1:
+            labels.append(f'{low:g}')
+        elif integer:
+            labels.append(f'{low:g}-{high - 1:g}')
+        else:
+            labels.append(f'{low:g}-{high:g}')
+    return labels
+
+
+def bucket_codes(values, bins):
+    """Коды корзин pd.cut(right=False) бинарным поиском по границам: uint8, NO_BUCKET - вне корзин."""
+    values = np.asarray(values, dtype='float64')
+    codes = np.searchsorted(np.asarray(bins, dtype='float64'), values, side='right') - 1
+    # NaN сортируется в конец и попадает за последнюю границу
+    codes[(codes < 0) | (codes >= len(bins) - 1)] = NO_BUCKET
+    return codes.astype('uint8')
+
+
+# --- Коды корзин датасета ---
+
+class Bucketizer:
+    """Коды корзин (uint8) колонок датасета: один раз на (таблица, колонка, границы).
+
+    Агрегаты по корзинам для любого состояния фильтров - bincount кодов по маске строк,
+    без pd.cut и вырезки отфильтрованных таблиц. Пользовательские границы - просто ещё
+    один набор кодов; старые наборы вытесняются сверх MAX_CODE_SETS.
+    """
+
+    def __init__(self, tables, max_code_sets=MAX_CODE_SETS):
+        self.tables = tables
+        self.max_code_sets = max_code_sets
+        self._codes = OrderedDict()
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def codes(self, table, column, bins):
+        key = (table, column, tuple(float(b) for b in bins))
+        with self._lock:
+            codes = self._codes.get(key)
+            if codes is not None:
+                self._codes.move_to_end(key)
+                return codes
+        with perf.span(f"Коды корзин {column}", 'aggregate'):
+            codes = bucket_codes(self.values(table, column), bins)
+        with self._lock:
+            codes = self._codes.setdefault(key, codes)
+            while len(self._codes) > self.max_code_sets:
+                self._codes.popitem(last=False)
+        return codes
+
+    def values(self, table, column):
+        """Колонка как float64 (пропуски - NaN), один раз на датасет."""
+        values = self._values.get((table, column))
+        if values is None:
+            values = self._values.setdefault(
+                (table, column), self.tables[table][column].to_numpy(dtype='float64', na_value=np.nan)
+            )
+        return values
+
+    def moments(self, table, column, bins, value_column, mask=None):
+        """(size, n, sum, sumsq) value_column по корзинам column для строк маски.
+
+        size - строк в корзине, n - с непустым значением; массивы длины len(bins) - 1.
+        """
+        codes = self.codes(table, column, bins)
+        values = self.values(table, value_column)
+        if mask is not None and not mask.all():
+            codes, values = codes[mask], values[mask]
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0.0)
+        buckets = len(bins) - 1
+        return tuple(
+            np.bincount(codes, weights=weights, minlength=NO_BUCKET + 1)[:buckets]
+            for weights in (None, valid, values, values * values)
+        )
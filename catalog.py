@@ -0,0 +1,140 @@
+import json
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Сколько различных значений колонки хранить со счётчиками (больше - только их число)
+MAX_CATALOG_VALUES = int(os.environ.get('FR_DASHBOARD_CATALOG_VALUES', 500))
+# Версия формата каталога: каталоги другой версии пересчитываются
+CATALOG_VERSION = 2
+
+
+def _plain(value):
+    """Значение для JSON: скаляры numpy - как Python, даты - строкой ISO."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def column_summary(series, max_values=MAX_CATALOG_VALUES):
+    """Сводка колонки: тип, пропуски, min/max, различные значения со счётчиками.
+
+    Значения - в порядке категорий для категориальных колонок (как в индексе фильтров),
+    иначе по возрастанию; для дат хранятся только границы. max_values=None - значения всегда.
+    """
+    rows = len(series)
+    nulls = int(series.isna().sum())
+    summary = {
+        'dtype': str(series.dtype), 'rows': rows, 'nulls': nulls, 'null_ratio': nulls / rows if rows else 0.0,
+        'min': None, 'max': None,
+    }
+    is_datetime = pd.api.types.is_datetime64_any_dtype(series.dtype)
+    if is_datetime or (pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)):
+        if nulls < rows:
+            summary['min'], summary['max'] = _plain(series.min()), _plain(series.max())
+
+    if is_datetime:
+        summary['distinct'] = int(series.nunique())
+        return summary
+    counts = series.value_counts(sort=False)
+    counts = counts[counts > 0]
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        counts = counts.sort_index()
+    summary['distinct'] = len(counts)
+    if max_values is None or len(counts) <= max_values:
+        summary['values'] = [[_plain(value), int(count)] for value, count in counts.items()]
+    return summary
+
+
+def build_catalog(df_users, df_shifts, max_values=MAX_CATALOG_VALUES, keep_values=None):
+    """Каталог метаданных всех колонок обеих таблиц датасета.
+
+    keep_values - {таблица: колонки}, значения которых хранятся при любом их числе
+    (колонки фильтров: из них строятся виджеты и спецификация фильтров по умолчанию).
+    """
+    keep_values = keep_values or {}
+    return DatasetCatalog({
+        table: {
+            col: column_summary(df[col], None if col in keep_values.get(table, ()) else max_values)
+            for col in df.columns
+        }
+        for table, df in [('users', df_users), ('shifts', df_shifts)]
+    })
+
+
+class DatasetCatalog:
+    """Метаданные колонок датасета: пропуски, min/max, различные значения со счётчиками, границы дат.
+
+    Считается один раз при загрузке и хранится вместе с датасетом (meta.json записи
+    хранилища или файл рядом с базой DuckDB), поэтому виджеты боковой панели строятся
+    без проходов по таблицам - и до построения индекса фильтров и куба.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    @classmethod
+    def from_dict(cls, data):
+        """Каталог из сохранённого словаря или None, если его нет или формат устарел."""
+        if not data or data.get('version') != CATALOG_VERSION:
+            return None
+        return cls(data['tables'])
+
+    def to_dict(self):
+        return {'version': CATALOG_VERSION, 'tables': self.tables}
+
+    @classmethod
+    def read(cls, path):
+        try:
+            return cls.from_dict(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError):
+            return None
+
+    def write(self, path):
+        tmp_path = path.with_name(f'.tmp-{path.name}-{os.getpid()}')
+        tmp_path.write_text(json.dumps(self.to_dict(), ensure_ascii=False, default=str), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    def columns(self, table):
+        return list(self.tables[table])
+
+    def rows(self, table):
+        return next(iter(self.tables[table].values()), {}).get('rows', 0)
+
+    def summary(self):
+        """Таблица колонок обеих таблиц: тип, доля пропусков, число различных значений, min/max."""
+        return pd.DataFrame([
+            {
+                'table': table, 'column': col, 'dtype': summary['dtype'], 'null_ratio': summary['null_ratio'],
+                'distinct': summary['distinct'], 'min': summary['min'], 'max': summary['max'],
+            }
+            for table, summaries in self.tables.items() for col, summary in summaries.items()
+        ]).astype({'min': str, 'max': str})
+
+    def filter_values(self, table, columns):
+        """{колонка: (значения по возрастанию, есть ли пропуски)} - как AnalyticsEngine.filter_values."""
+        summaries = self.tables[table]
+        return {
+            col: ([value for value, _ in summaries[col]['values']], summaries[col]['nulls'] > 0)
+            for col in columns if col in summaries and 'values' in summaries[col]
+        }
+
+    def range_bounds(self, columns):
+        """{колонка: (минимум, максимум, нет ли пропусков)} числовых колонок пользователей."""
+        summaries = self.tables['users']
+        return {
+            col: (float(summaries[col]['min']), float(summaries[col]['max']), summaries[col]['nulls'] == 0)
+            for col in columns if col in summaries and summaries[col]['min'] is not None
+        }
+
+    def date_bounds(self, table='shifts', column='shift_start_time'):
+        """(первый день, последний день, у всех ли строк есть дата); (None, None, False) без дат."""
+        summary = self.tables[table].get(column)
+        if summary is None or summary['min'] is None:
+            return None, None, False
+        to_date = lambda value: date.fromisoformat(str(value)[:10])
+        return to_date(summary['min']), to_date(summary['max']), summary['nulls'] == 0
@@ -0,0 +1,117 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# Параметры редукции данных для графиков распределений
+DEFAULT_NBINS = 120
+DEFAULT_MAX_OUTLIERS = 300
+# Бюджет на размер JSON одной фигуры, который уходит в браузер
+DEFAULT_PAYLOAD_BUDGET = 150 * 1024
+
+
+def box_stats(values, max_outliers=DEFAULT_MAX_OUTLIERS, seed=0):
+    """Статистики "ящика с усами" как у plotly (квартили linear, усы 1.5 IQR) и выборка выбросов."""
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    outliers = values[(values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)]
+    if outliers.size > max_outliers:
+        outliers = np.random.default_rng(seed).choice(outliers, max_outliers, replace=False)
+    return {
+        'q1': float(q1), 'median': float(median), 'q3': float(q3),
+        'lowerfence': float(inside.min()), 'upperfence': float(inside.max()),
+        'mean': float(values.mean()), 'outliers': np.sort(outliers),
+    }
+
+
+def distribution_stats(values, groups, nbins=DEFAULT_NBINS, max_outliers=DEFAULT_MAX_OUTLIERS):
+    """Гистограммы (общие границы корзин) и статистики box по группам, посчитанные на сервере.
+
+    Возвращает {'edges': ..., 'groups': {метка: {'counts': ..., 'box': ...}}}; пропуски в values игнорируются.
+    """
+    values = np.asarray(values, dtype='float64')
+    groups = np.asarray(groups)
+    valid = ~np.isnan(values)
+    values, groups = values[valid], groups[valid]
+    if not values.size:
+        return {'edges': np.array([]), 'groups': {}}
+
+    edges = np.histogram_bin_edges(values, bins=nbins)
+    result = {'edges': edges, 'groups': {}}
+    for label in np.unique(groups):
+        group_values = values[groups == label]
+        result['groups'][str(label)] = {
+            'counts': np.histogram(group_values, bins=edges)[0],
+            'box': box_stats(group_values, max_outliers),
+        }
+    return result
+
+
+def coarsen(stats, factor, max_outliers=None):
+    """Укрупняет корзины в factor раз (суммированием соседних) и при необходимости урезает выбросы."""
+    edges = stats['edges']
+    n_bins = len(edges) - 1
+    if factor <= 1 or n_bins <= 1:
+        return stats
+    starts = np.arange(0, n_bins, factor)
+    new_edges = np.append(edges[starts], edges[-1])
+    groups = {}
+    for label, group in stats['groups'].items():
+        box = dict(group['box'])
+        if max_outliers is not None and box['outliers'].size > max_outliers:
+            box['outliers'] = box['outliers'][np.linspace(0, box['outliers'].size - 1, max_outliers).astype(int)]
+        groups[label] = {'counts': np.add.reduceat(group['counts'], starts), 'box': box}
+    return {'edges': new_edges, 'groups': groups}
+
+
+def distribution_figure(stats, x_label, title, group_title='job_done'):
+    """Гистограмма (overlay) с box-маргиналом сверху, как px.histogram(marginal='box'), из агрегатов."""
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.2, 0.8], vertical_spacing=0.02)
+    edges = stats['edges']
+    centers = (edges[:-1] + edges[1:]) / 2
+    widths = np.diff(edges)
+    colors = px.colors.qualitative.Plotly
+
+    for i, (label, group) in enumerate(stats['groups'].items()):
+        color = colors[i % len(colors)]
+        box = group['box']
+        fig.add_trace(go.Box(
+            y=[label], q1=[box['q1']], median=[box['median']], q3=[box['q3']],
+            lowerfence=[box['lowerfence']], upperfence=[box['upperfence']], mean=[box['mean']],
+            orientation='h', name=label, legendgroup=label, showlegend=False,
+            marker_color=color, boxpoints=False
+        ), row=1, col=1)
+        if box['outliers'].size:
+            fig.add_trace(go.Scatter(
+                x=box['outliers'], y=[label] * box['outliers'].size, mode='markers',
+                marker=dict(color=color, size=4), name=label, legendgroup=label,
+                showlegend=False, hoverinfo='x'
+            ), row=1, col=1)
+        fig.add_trace(go.Bar(
+            x=centers, y=group['counts'], width=widths, name=label, legendgroup=label,
+            marker_color=color, opacity=0.6
+        ), row=2, col=1)
+
+    fig.update_layout(
+        title=title, barmode='overlay', bargap=0, template='plotly_white',
+        legend_title_text=group_title
+    )
+    fig.update_xaxes(title_text=x_label, row=2, col=1)
+    fig.update_yaxes(title_text='count', row=2, col=1)
+    return fig
+
+
+def fit_payload(stats, build, budget=DEFAULT_PAYLOAD_BUDGET):
+    """Строит фигуру build(stats) и укрупняет корзины/урезает выбросы, пока JSON не влезет в бюджет.
+
+    Возвращает (фигура, размер JSON в байтах).
+    """
+    factor, max_outliers = 1, DEFAULT_MAX_OUTLIERS
+    while True:
+        fig = build(coarsen(stats, factor, max_outliers))
+        payload = len(fig.to_json())
+        if payload <= budget or (len(stats['edges']) - 1 <= factor and max_outliers == 0):
+            return fig, payload
+        factor *= 2
+        max_outliers //= 2
@@ -0,0 +1,276 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from filter_index import codes_and_values
+
+# Измерения смены, по которым строятся графики вкладок 1-2 (помимо фильтров)
+CUBE_SHIFT_DIMS = ['shift_number', 'shift_region', 'task_group', 'task_type']
+
+# Во сколько раз куб должен быть меньше таблицы смен: иначе он не быстрее сырых смен
+CUBE_MIN_REDUCTION = float(os.environ.get('FR_DASHBOARD_CUBE_MIN_REDUCTION', 4))
+
+_EPOCH_MONDAY_OFFSET = 3  # 1970-01-01 - четверг, сдвиг до понедельника
+
+
+def week_index(days):
+    """Номер недели (понедельник-воскресенье, как resample('W')) по числу дней от эпохи."""
+    return (days + _EPOCH_MONDAY_OFFSET) // 7
+
+
+def week_end(week):
+    """Воскресенье недели - метка, которую ставит resample('W')."""
+    return np.datetime64(int(week * 7 + _EPOCH_MONDAY_OFFSET), 'D')
+
+
+def _start_days(df_shifts):
+    """Дни от эпохи для даты старта смен и маска смен, у которых дата есть."""
+    start_days = df_shifts['shift_start_time'].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    return start_days.astype('int64'), ~np.isnat(start_days)
+
+
+def select_user_dims(df_users, df_shifts, candidates, shift_dims=CUBE_SHIFT_DIMS, min_reduction=CUBE_MIN_REDUCTION):
+    """Измерения пользователя, с которыми куб остаётся в min_reduction раз меньше таблицы смен.
+
+    Каждое измерение пользователя умножает число ячеек куба, поэтому они добавляются по
+    возрастанию числа значений, пока ячеек не больше бюджета; фильтры по остальным
+    считаются по сырым сменам. None - бюджет превышен уже измерениями смены и неделями.
+    """
+    budget = len(df_shifts) / min_reduction
+    start_days, has_date = _start_days(df_shifts)
+    groups, _ = pd.factorize(np.where(has_date, week_index(start_days), -1))
+    for col in shift_dims:
+        if col in df_shifts.columns:
+            codes, values = codes_and_values(df_shifts[col])
+            groups = groups * (len(values) + 1) + codes + 1
+            groups, _ = pd.factorize(groups)
+    if groups.max(initial=-1) + 1 > budget:
+        return None
+
+    shift_user_pos = pd.Index(df_users['user_id']).get_indexer(df_shifts['user_id'])
+    present = [col for col in candidates if col in df_users.columns]
+    chosen = []
+    for col in sorted(present, key=lambda col: df_users[col].nunique(dropna=False)):
+        codes, values = codes_and_values(df_users[col])
+        combined, uniques = pd.factorize(groups * (len(values) + 1) + codes[shift_user_pos] + 1)
+        if len(uniques) > budget:
+            break
+        groups = combined
+        chosen.append(col)
+    return chosen
+
+
+class _Dimension:
+    def __init__(self, name, codes, values):
+        self.name = name
+        self.values = values
+        # Код 0 зарезервирован под пропуск
+        self.size = len(values) + 1
+        self.codes = codes.astype('int64') + 1
+
+    def merged(self, other, keep):
+        """Измерение со строками self[keep] и всеми строками other (словарь значений расширяется)."""
+        values = list(self.values)
+        value_codes = {value: code for code, value in enumerate(values)}
+        for value in other.values:
+            if value not in value_codes:
+                value_codes[value] = len(values)
+                values.append(value)
+        remap = np.array([0] + [value_codes[value] + 1 for value in other.values], dtype='int64')
+        dim = _Dimension(self.name, np.empty(0, dtype='int64'), values)
+        dim.codes = np.concatenate([self.codes[keep], remap[other.codes]])
+        return dim
+
+
+class FillRateCube:
+    """Предагрегированный куб booked/done по измерениям смены, части измерений пользователя и неделям.
+
+    Строится один раз на датасет. Пока фильтры совпадают с измерениями куба
+    (даты - целыми неделями, диапазон quantity_responses - полный, фильтры только по
+    измерениям куба), агрегаты вкладок 1-2 и общие метрики считаются по строкам куба,
+    а не по сменам.
+    """
+
+    def __init__(self, df_users, df_shifts, user_dims, shift_dims=CUBE_SHIFT_DIMS, full_range_cols=('quantity_responses',)):
+        self.config = {'user_dims': user_dims, 'shift_dims': shift_dims, 'full_range_cols': full_range_cols}
+        shift_user_pos = pd.Index(df_users['user_id']).get_indexer(df_shifts['user_id'])
+
+        dims = []
+        for col in shift_dims:
+            if col in df_shifts.columns:
+                dims.append(_Dimension(col, *codes_and_values(df_shifts[col])))
+        for col in user_dims:
+            if col in df_users.columns:
+                codes, values = codes_and_values(df_users[col])
+                dims.append(_Dimension(col, codes[shift_user_pos], values))
+
+        # Недели: код = номер недели от первой, 0 - нет даты старта
+        start_days, has_date = _start_days(df_shifts)
+        weeks = week_index(start_days)
+        self.first_week = int(weeks[has_date].min()) if has_date.any() else 0
+        week_codes = np.where(has_date, weeks - self.first_week, -1)
+        self.week_dim = _Dimension('week', week_codes, list(range(int(week_codes.max(initial=-1)) + 1)))
+        dims.append(self.week_dim)
+        self._set_bounds(df_users, start_days, has_date)
+
+        # Смешанная система счисления: одна int64-метка на комбинацию измерений
+        strides, stride = [], 1
+        for dim in dims:
+            strides.append(stride)
+            stride *= dim.size
+        if stride >= 2**63:
+            raise ValueError("Слишком много комбинаций измерений для куба")
+
+        key = np.zeros(len(df_shifts), dtype='int64')
+        for dim, dim_stride in zip(dims, strides):
+            key += dim.codes * dim_stride
+        keys, inverse = np.unique(key, return_inverse=True)
+        self.booked = np.bincount(inverse, minlength=len(keys)).astype('int64')
+        self.done = np.bincount(inverse, weights=df_shifts['job_done'].to_numpy(dtype='float64'), minlength=len(keys))
+
+        for dim, dim_stride in zip(dims, strides):
+            dim.codes = (keys // dim_stride) % dim.size
+        self.dims = {dim.name: dim for dim in dims}
+
+    def _set_bounds(self, df_users, start_days, has_date):
+        # Границы данных: для проверки, что фильтр по датам не режет неделю внутри
+        self.min_day = int(start_days[has_date].min()) if has_date.any() else None
+        self.max_day = int(start_days[has_date].max()) if has_date.any() else None
+        self.full_ranges = {
+            col: (df_users[col].min(), df_users[col].max())
+            for col in self.config['full_range_cols'] if col in df_users.columns
+        }
+
+    def __len__(self):
+        return len(self.booked)
+
+    def updated(self, df_users, df_shifts, weeks, undated=False):
+        """Куб по обновлённым таблицам, в котором пересчитаны только изменившиеся недели.
+
+        weeks - номера недель (week_index), смены которых изменились, undated - изменились ли
+        смены без даты старта. Строки остальных недель берутся из этого куба как есть.
+        """
+        start_days, has_date = _start_days(df_shifts)
+        changed = has_date & np.isin(week_index(start_days), np.asarray(weeks, dtype='int64'))
+        if undated:
+            changed |= ~has_date
+        part = FillRateCube(df_users, df_shifts[changed], **self.config)
+        if part.dims.keys() != self.dims.keys():
+            # Набор измерений поменялся (другие колонки) - строим куб заново
+            return FillRateCube(df_users, df_shifts, **self.config)
+
+        # Строки этого куба из неизменившихся недель
+        old_weeks = self.week_dim.codes - 1 + self.first_week
+        keep = ~((self.week_dim.codes > 0) & np.isin(old_weeks, weeks))
+        if undated:
+            keep &= self.week_dim.codes > 0
+
+        cube = object.__new__(FillRateCube)
+        cube.config = self.config
+        cube.dims = {
+            name: dim.merged(part.dims[name], keep) for name, dim in self.dims.items() if name != 'week'
+        }
+        # Недели пересчитываются от новой первой недели
+        part_weeks = part.week_dim.codes - 1 + part.first_week
+        week_codes = np.concatenate([self.week_dim.codes[keep], part.week_dim.codes])
+        week_labels = np.concatenate([old_weeks[keep], part_weeks])
+        dated = week_codes > 0
+        cube.first_week = int(week_labels[dated].min()) if dated.any() else 0
+        week_codes = np.where(dated, week_labels - cube.first_week, -1)
+        cube.week_dim = _Dimension('week', week_codes, list(range(int(week_codes.max(initial=-1)) + 1)))
+        cube.dims['week'] = cube.week_dim
+        cube.booked = np.concatenate([self.booked[keep], part.booked])
+        cube.done = np.concatenate([self.done[keep], part.done])
+        cube._set_bounds(df_users, start_days, has_date)
+        return cube
+
+    def covers(self, user_ranges=None, date_range=None, filters=None):
+        """Можно ли ответить по кубу: фильтры - по измерениям куба, диапазоны полные, даты - по границам недель."""
+        if any(col not in self.dims for col in filters or {}):
+            return False
+        for col, (low, high) in (user_ranges or {}).items():
+            full_low, full_high = self.full_ranges.get(col, (None, None))
+            if full_low is None or low > full_low or high < full_high:
+                return False
+        if date_range is not None and self.min_day is not None:
+            start, end = (int(np.datetime64(d, 'D').astype('int64')) for d in date_range)
+            # Понедельник: (day + 3) % 7 == 0, воскресенье: == 6
+            start_ok = start <= self.min_day or (start + _EPOCH_MONDAY_OFFSET) % 7 == 0
+            end_ok = end >= self.max_day or (end + _EPOCH_MONDAY_OFFSET) % 7 == 6
+            if not (start_ok and end_ok):
+                return False
+        return True
+
+    def slice(self, user_filters, shift_filters=None, date_range=None):
+        return CubeSlice(self, {**user_filters, **(shift_filters or {})}, date_range)
+
+
+class CubeSlice:
+    """Строки куба под текущие фильтры; маска считается при первом обращении."""
+
+    def __init__(self, cube, filters, date_range):
+        self.cube = cube
+        self.filters = filters
+        self.date_range = date_range
+        self._rows = None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            cube = self.cube
+            rows = np.ones(len(cube), dtype=bool)
+            for col, selected in self.filters.items():
+                dim = cube.dims[col]
+                lookup = np.zeros(dim.size, dtype=bool)
+                value_codes = {value: code + 1 for code, value in enumerate(dim.values)}
+                lookup[[value_codes[v] for v in selected if v in value_codes]] = True
+                rows &= lookup[dim.codes]
+            if self.date_range is not None:
+                start, end = (int(np.datetime64(d, 'D').astype('int64')) for d in self.date_range)
+                weeks = cube.week_dim.codes - 1 + cube.first_week
+                rows &= (cube.week_dim.codes > 0) & (weeks >= week_index(start)) & (weeks <= week_index(end))
+            self._rows = rows
+        return self._rows
+
+    def _group(self, column):
+        dim = self.cube.dims[column]
+        codes = dim.codes[self.rows]
+        booked = np.bincount(codes, weights=self.cube.booked[self.rows], minlength=dim.size)
+        done = np.bincount(codes, weights=self.cube.done[self.rows], minlength=dim.size)
+        # Как groupby(observed=True): без пропусков и пустых значений
+        present = np.flatnonzero(booked[1:] > 0)
+        return dim, present, booked[1:][present].astype('int64'), done[1:][present].astype('int64')
+
+    def totals(self):
+        return int(self.cube.booked[self.rows].sum()), int(self.cube.done[self.rows].sum())
+
+    def fill_rate_by(self, column):
+        """То же, что aggregates.fill_rate_by по сменам."""
+        dim, present, booked, done = self._group(column)
+        values = pd.Categorical.from_codes(present, categories=dim.values)
+        agg = pd.DataFrame({column: values, 'fill_rate': done / booked, 'count': booked, 'done': done})
+        return agg.sort_values('count', ascending=False, kind='stable', ignore_index=True)
+
+    def fill_rate_by_shift_number(self):
+        """То же, что aggregates.fill_rate_by_shift_number."""
+        dim, present, booked, done = self._group('shift_number')
+        return pd.DataFrame({
+            'shift_number': np.asarray(dim.values)[present].astype(str),
+            'fill_rate': done / booked,
+            'booked': booked,
+            'done': done,
+        })
+
+    def weekly_fill_rate(self):
+        """То же, что aggregates.weekly_fill_rate: все недели от первой до последней."""
+        dim, present, booked, done = self._group('week')
+        if not len(present):
+            return pd.DataFrame({'shift_start_time': pd.DatetimeIndex([]), 'job_done': []})
+        all_weeks = np.arange(present[0], present[-1] + 1)
+        fill_rate = pd.Series(done / booked, index=present).reindex(all_weeks)
+        week_ends = [week_end(self.cube.first_week + w) for w in all_weeks]
+        return pd.DataFrame({
+            'shift_start_time': pd.to_datetime(week_ends),
+            'job_done': fill_rate.to_numpy()
+        })
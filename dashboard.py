@@ -1,9 +1,35 @@
+import argparse
+
 import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
 
+import perf
+from aggregates import TRANSITION_OUTCOMES, AggregateCache, format_percent, top_n
+from bucketizer import Bucketizer, format_bins, parse_bins
+from catalog import DatasetCatalog, build_catalog
+from chart_data import distribution_figure, fit_payload
+from dataset_store import MAX_CACHED_DATASETS, DatasetRegistry, DatasetStore, content_hash, file_key
+from drivers import DriverModels
+from engine import (
+    ACTIVITY_BINS, DRIVER_FACTORS, DURATION_BINS, FILTER_VALUE_COLS, INTERACTION_FLAGS, MARKETING_FLAGS,
+    NEXT_BOOKING_LABELS, PROFILE_FLAGS, SHIFT_FILTER_COLS, USER_FILTER_COLS, USER_RANGE_COLS, AnalyticsEngine,
+    build_cube, dataset_key, preload_reports
+)
+from export import EXPORT_FORMATS, export_file_name, export_frame
+from filter_index import FilterIndex
+from ingest import (
+    DEFAULT_CHUNKSIZE, apply_delta, expand_partitions, load_sources, memory_report, read_partition, source_name
+)
+from sampling import DEFAULT_SAMPLE_SIZE, SAMPLE_SIZES
+from sql_engine import open_dataset, resolve_backend, sql_dataset_key
+from stats import DEFAULT_CONFIDENCE
+from warmup import AggregateWarmer
+
 # --- 1. Настройка страницы ---
 st.set_page_config(
     page_title="Дашборд: Анализ Fill Rate",
@@ -11,156 +37,418 @@ st.set_page_config(
     layout="wide"
 )
 
+# Замеры этапов текущего перезапуска; история перезапусков сессии - для выгрузки трассировки
+st.session_state['perf_reruns'] = st.session_state.get('perf_reruns', 0) + 1
+perf_tracer = perf.start_rerun(
+    st.session_state.setdefault('perf_traces', []), label=f"Перезапуск {st.session_state['perf_reruns']}"
+)
+
 st.title("📊 Дашборд: Анализ факторов Fill Rate")
 st.caption("На основе данных 'Авито Подработки' (Версия 4.0, Комплексный анализ)")
 
+# Бэкенд вычислений выбирается при запуске:
+#   FR_DASHBOARD_BACKEND=duckdb streamlit run dashboard.py  или  streamlit run dashboard.py -- --backend duckdb
+backend_parser = argparse.ArgumentParser(add_help=False)
+backend_parser.add_argument('--backend')
+try:
+    BACKEND = resolve_backend(backend_parser.parse_known_args()[0].backend)
+except ValueError as e:
+    st.warning(f"{e}. Используется бэкенд pandas.")
+    BACKEND = 'pandas'
+
+# Виджеты внутри вкладок и их значения по умолчанию: значения хранятся в состоянии сессии,
+# чтобы в ленивом режиме переживать перезапуски, в которых вкладка скрыта
+TAB_WIDGET_DEFAULTS = {
+    'regions_slider': 15, 'groups_slider': 15, 'tasks_slider': 15, 'retention_horizon': 90,
+    'duration_bins': format_bins(DURATION_BINS),
+    **{f'bins_{col}': format_bins(bins) for col, (bins, _) in ACTIVITY_BINS.items()},
+}
+
 # --- 2. Загрузка и обработка данных (ИСПРАВЛЕННАЯ ЛОГИКА) ---
 
-@st.cache_data
-def load_and_process_data(uploaded_file):
-    """Загружает CSV, преобразует типы и готовит данные для анализа."""
+@st.cache_resource
+def get_dataset_store():
+    """Общее для всех сессий дисковое хранилище обработанных датасетов."""
+    return DatasetStore()
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else 'local'
+
+def session_alive(session_id):
+    return runtime.get_instance().is_active_session(session_id)
+
+@st.cache_resource
+def get_dataset_registry():
+    """Общий для всех сессий реестр обработанных таблиц: одна копия датасета на процесс."""
+    return DatasetRegistry(get_dataset_store(), is_session_alive=session_alive if runtime.exists() else None)
+
+def upload_key(uploaded_file):
+    """Хэш содержимого загруженного файла; считается один раз на загрузку (file_id) в сессии."""
+    hashes = st.session_state.setdefault('upload_hashes', {})
+    if uploaded_file.file_id not in hashes:
+        hashes[uploaded_file.file_id] = content_hash(uploaded_file)
+    return hashes[uploaded_file.file_id]
+
+def load_and_process_data(key, uploaded_files, local_partitions=(), chunksize=None, on_progress=None):
+    """Загружает CSV/Parquet (или готовый результат из дискового хранилища по ключу датасета).
+
+    uploaded_files - загруженные файлы, local_partitions - пары (путь, ключ файла) локальных
+    партиций. Несколько файлов обрабатываются параллельно в пуле процессов;
+    chunksize включает потоковую обработку одного CSV; on_progress(доля, текст) - индикатор.
+    Вызывается реестром датасетов один раз на процесс. Возвращает None при ошибке.
+    """
+    perf.annotate(cache='miss')
+    store = get_dataset_store()
+
+    with perf.span("Чтение из дискового хранилища", 'pipeline'):
+        cached = store.get(key)
+    if cached is not None:
+        perf.annotate(cache='store')
+        df_users, long_shifts_df, meta = cached
+        return df_users, long_shifts_df, {**meta, 'from_cache': True}
+
+    if len(uploaded_files) == 1 and not local_partitions:
+        sources = list(uploaded_files)
+    else:
+        # В процессы пула передаём байты загруженных файлов и пути локальных партиций
+        sources = [(f.name, f.getvalue()) for f in uploaded_files] + [path for path, _ in local_partitions]
+
     try:
-        df_users = pd.read_csv(uploaded_file)
+        df_users, long_shifts_df, memory = load_sources(sources, chunksize=chunksize, on_progress=on_progress)
     except Exception as e:
         st.error(f"Ошибка при чтении файла: {e}")
-        return None, None
-
-    # --- Преобразование типов ---
-    date_cols = [
-        'shift_booked_time_1', 'shift_start_time_1',
-        'shift_booked_time_2', 'shift_start_time_2',
-        'shift_booked_time_3', 'shift_start_time_3'
-    ]
-    for col in date_cols:
-        if col in df_users.columns:
-            df_users[col] = pd.to_datetime(df_users[col], errors='coerce')
-
-    # Добавляем ВСЕ флаги и числовые колонки для корректной обработки
-    numeric_cols = [
-        'job_done_1', 'job_done_2', 'job_done_3',
-        'shift_duration_1', 'shift_price_per_hour_1',
-        'shift_duration_2', 'shift_price_per_hour_2',
-        'shift_duration_3', 'shift_price_per_hour_3',
-        'serp_frequency', 'item_view_frequency',
-        'started_verification_gu_flg', 'success_verification_gu_flg',
-        'cv_free_grafik_flg', 'cv_podrabotka_flg', 'vac_podrabotka_flg',
-        'quantity_responses', 'click_internet_adv_flg', 'opened_push_flg',
-        'watched_stories_in_app_flg', 'click_addv_communication_flg',
-        'has_call_centre_communication_flg'
-    ]
-    
-    for col in numeric_cols:
-        if col in df_users.columns:
-            df_users[col] = pd.to_numeric(df_users[col], errors='coerce')
-            # Важно: заполняем пропуски в флагах и счетчиках нулями
-            if '_flg' in col or 'frequency' in col or 'quantity' in col:
-                 df_users[col] = df_users[col].fillna(0)
-
-            
-    # --- ИСПРАВЛЕНИЕ ЛОГИКИ 1: Создание "длинного" DataFrame ---
-    all_shifts = []
-    df_users['user_id'] = df_users.index
-    
-    for i in [1, 2, 3]:
-        cols_to_pull = [
-            'user_id', 'region', 'platform', 'age', 'income',
-            f'shift_booked_time_{i}', f'shift_start_time_{i}', f'job_done_{i}',
-            f'shift_duration_{i}', f'shift_price_per_hour_{i}',
-            f'task_type_{i}', f'task_group_{i}', f'shift_region_{i}'
-        ]
-        # Убедимся, что все колонки существуют
-        existing_cols = [col for col in cols_to_pull if col in df_users.columns]
-        shift_df = df_users[existing_cols].copy()
-        
-        # КЛЮЧЕВОЙ ШАГ 1: Оставляем только те строки, где есть бронь
-        if f'shift_booked_time_{i}' not in shift_df.columns:
-            continue # Пропускаем, если колонки бронирования нет
-            
-        shift_df = shift_df.dropna(subset=[f'shift_booked_time_{i}'])
-        if shift_df.empty:
-            continue
-            
-        # Переименовываем колонки в общий вид
-        rename_map = {
-            f'shift_booked_time_{i}': 'shift_booked_time',
-            f'shift_start_time_{i}': 'shift_start_time',
-            f'job_done_{i}': 'job_done',
-            f'shift_duration_{i}': 'duration',
-            f'shift_price_per_hour_{i}': 'price_per_hour',
-            f'task_type_{i}': 'task_type',
-            f'task_group_{i}': 'task_group',
-            f'shift_region_{i}': 'shift_region'
-        }
-        # Применяем переименование только для существующих колонок
-        shift_df.rename(columns={k: v for k, v in rename_map.items() if k in shift_df.columns}, inplace=True)
-        
-        shift_df['shift_number'] = i
-        all_shifts.append(shift_df)
+        return None
 
-    if not all_shifts:
+    if long_shifts_df is None:
         st.warning("Не удалось найти данные о сменах в файле.")
-        return None, None
-        
-    long_shifts_df = pd.concat(all_shifts, ignore_index=True)
-    
-    # КЛЮЧЕВОЙ ШАГ 2: .fillna(0) для 'job_done'
-    long_shifts_df['job_done'] = long_shifts_df['job_done'].fillna(0)
-    
-    # --- ИСПРАВЛЕНИЕ ЛОГИКИ 2: Расчет 'user_avg_fr' ---
-    user_fr_calc = long_shifts_df.groupby('user_id')['job_done'].mean().reset_index()
-    user_fr_calc.rename(columns={'job_done': 'user_avg_fr'}, inplace=True)
-    
-    df_users = df_users.merge(user_fr_calc, on='user_id', how='left')
-    df_users['user_avg_fr'] = df_users['user_avg_fr'].fillna(0) 
+        return None
 
-    # --- Доп. поля для user-level анализа (для удержания) ---
-    df_users['delta_1_2'] = (df_users['shift_booked_time_2'] - df_users['shift_booked_time_1']).dt.days
-    df_users['delta_1_3'] = (df_users['shift_booked_time_3'] - df_users['shift_booked_time_1']).dt.days
-    df_users['min_return_days'] = df_users[['delta_1_2', 'delta_1_3']].min(axis=1)
+    with perf.span("Каталог метаданных", 'pipeline'):
+        catalog = build_catalog(df_users, long_shifts_df, keep_values=FILTER_VALUE_COLS)
+    source_names = [source_name(source) for source in sources]
+    meta = {
+        'dataset_key': key, 'source_name': ', '.join(source_names), 'memory': memory, 'catalog': catalog.to_dict()
+    }
+    try:
+        store.put(key, df_users, long_shifts_df, meta)
+    except Exception as e:
+        st.warning(f"Не удалось сохранить обработанные данные в локальный кэш: {e}")
+    return df_users, long_shifts_df, {**meta, 'from_cache': False}
+
+def apply_dataset_delta(key, base_meta, df_users, df_shifts, delta_file, key_column):
+    """Применяет файл дельты к загруженному датасету без полной переобработки.
+
+    Результат сохраняется в дисковое хранилище под ключом key = (датасет, дельта), поэтому
+    дельты можно применять цепочкой. Вызывается реестром датасетов; возвращает None,
+    если дельту применить нельзя.
+    """
+    perf.annotate(cache='miss')
+    store = get_dataset_store()
+    cached = store.get(key)
+    if cached is not None:
+        perf.annotate(cache='store')
+        df_users, long_shifts_df, meta = cached
+        return df_users, long_shifts_df, {**meta, 'from_cache': True}
 
-    return df_users, long_shifts_df
+    try:
+        delta = read_partition((delta_file.name, delta_file.getvalue()))
+        df_users, long_shifts_df, memory, changes = apply_delta(df_users, df_shifts, delta, key=key_column)
+    except Exception as e:
+        st.error(f"Не удалось применить дельту: {e}")
+        return None
+
+    for table, sizes in memory.items():
+        sizes['before'] += base_meta['memory'][table]['before']
+    with perf.span("Каталог метаданных", 'pipeline'):
+        catalog = build_catalog(df_users, long_shifts_df, keep_values=FILTER_VALUE_COLS)
+    meta = {
+        'dataset_key': key,
+        'base_key': base_meta['dataset_key'],
+        'source_name': f"{base_meta['source_name']} + {delta_file.name}",
+        'memory': memory,
+        'changes': changes,
+        'catalog': catalog.to_dict(),
+    }
+    try:
+        store.put(key, df_users, long_shifts_df, meta)
+    except Exception as e:
+        st.warning(f"Не удалось сохранить обработанные данные в локальный кэш: {e}")
+    return df_users, long_shifts_df, {**meta, 'from_cache': False}
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Построение индекса фильтров...")
+def get_filter_index(dataset_key, _df_users, _df_shifts, _base_index=None, _changes=None):
+    """Индекс фильтров строится один раз на датасет и общий для всех сессий.
+
+    Для датасета после дельты индекс исходного датасета обновляется только в строках затронутых пользователей.
+    """
+    perf.annotate(cache='miss')
+    if _base_index is not None and _changes and 'user_ids' in _changes:
+        try:
+            return _base_index.updated(_df_users, _df_shifts, _changes['user_ids'])
+        except ValueError:
+            pass
+    return FilterIndex(
+        _df_users, _df_shifts,
+        user_dims=USER_FILTER_COLS, shift_dims=SHIFT_FILTER_COLS,
+        user_range_cols=USER_RANGE_COLS
+    )
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Построение куба Fill Rate...")
+def get_fill_rate_cube(dataset_key, _df_users, _df_shifts, _base_cube=None, _changes=None):
+    """Куб booked/done по измерениям фильтров и неделям, строится один раз на датасет.
+
+    Для датасета после дельты пересчитываются только изменившиеся недели куба исходного датасета.
+    """
+    perf.annotate(cache='miss')
+    if _base_cube is None:
+        return build_cube(_df_users, _df_shifts)
+    try:
+        return _base_cube.updated(_df_users, _df_shifts, _changes['weeks'], _changes['undated'])
+    except ValueError:
+        # Слишком много комбинаций измерений - работаем только по сырым сменам
+        return None
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS)
+def get_bucketizer(dataset_key, _df_users, _df_shifts):
+    """Коды корзин датасета: движок пересоздаётся на каждом перезапуске, а коды переживают его."""
+    return Bucketizer({'users': _df_users, 'shifts': _df_shifts})
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Перенос агрегатов, не затронутых дельтой...")
+def adopt_delta_aggregates(dataset_key, _engine, _base_dataset, _base_index, _changes):
+    """Один раз на датасет после дельты переносит в него закэшированные агрегаты исходного датасета,
+    фильтры которых не затрагивают пользователей дельты."""
+    perf.annotate(cache='miss')
+    base_key, base_users, base_shifts = _base_dataset
+    base_engine = AnalyticsEngine(base_users, base_shifts, base_key, _base_index, cache=_engine.cache)
+    return _engine.adopt_aggregates(base_engine, _changes['user_ids'])
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Построение каталога метаданных...")
+def get_dataset_catalog(dataset_key, _df_users, _df_shifts):
+    """Каталог для записей хранилища, сохранённых без него (обычно он приходит в meta датасета)."""
+    perf.annotate(cache='miss')
+    return build_catalog(_df_users, _df_shifts, keep_values=FILTER_VALUE_COLS)
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Стратифицированная выборка для предпросмотра...")
+def get_sample_engine(dataset_key, sample_size, _engine):
+    """Движок по выборке пользователей: один на датасет и размер выборки для всех сессий."""
+    perf.annotate(cache='miss')
+    return _engine.sample(sample_size)
+
+@st.cache_resource
+def get_aggregate_cache():
+    """Общий для всех сессий кэш агрегатов, ключ включает хэш датасета и фильтров."""
+    return AggregateCache()
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Загрузка предрасчитанных отчётов...")
+def load_precomputed_reports(reports_dir, dataset_key):
+    """Один раз на каталог и датасет кладёт готовые отчёты в общий кэш агрегатов."""
+    perf.annotate(cache='miss')
+    return preload_reports(reports_dir, dataset_key, get_aggregate_cache())
+
+@st.cache_resource(max_entries=MAX_CACHED_DATASETS, show_spinner="Подготовка датасета DuckDB (один раз на набор файлов)...")
+def get_sql_engine(file_keys, _uploaded_files, local_paths):
+    """Файл DuckDB строится один раз на набор файлов; движок и соединение общие для всех сессий."""
+    perf.annotate(cache='miss')
+    sources = [(f.name, f.getvalue()) for f in _uploaded_files] + list(local_paths)
+    return open_dataset(sources, sql_dataset_key(file_keys), cache=get_aggregate_cache())
+
+@st.cache_resource
+def get_aggregate_warmer():
+    """Общий для всех сессий пул фонового прогрева агрегатов (каждый датасет прогревается один раз)."""
+    return AggregateWarmer()
+
+@st.cache_resource
+def get_driver_models():
+    """Общий для всех сессий пул процессов обучения модели драйверов FR."""
+    return DriverModels()
+
+def rerun_when_done(future, text):
+    """Ждёт фоновую задачу (точный расчёт, обучение модели) и перезапускает страницу, когда она готова."""
+    if future.done():
+        st.rerun()
+    st.caption(text)
+
+def warmup_progress(job):
+    if job.finished:
+        failed = len(job.errors)
+        st.caption(
+            f"✅ Фоновый предрасчёт: готово состояний фильтров - {job.total - failed}"
+            + (f", с ошибкой - {failed}" if failed else "")
+        )
+    else:
+        st.progress(job.completed / job.total, text=f"Фоновый предрасчёт: {job.completed} из {job.total} состояний фильтров")
 
 # --- 3. UI: Загрузчик файла ---
-uploaded_file = st.file_uploader("Загрузите ваш CSV файл с данными", type="csv")
+uploaded_files = st.file_uploader(
+    "Загрузите ваш CSV файл с данными (или несколько файлов-партиций CSV/Parquet)",
+    type=["csv", "parquet"], accept_multiple_files=True
+)
 
-if uploaded_file is None:
+with st.expander("Параметры загрузки"):
+    partition_pattern = st.text_input(
+        "Локальный каталог или glob-шаблон партиций (CSV/Parquet)", key='partition_pattern',
+        placeholder="/data/exports/daily/*.csv",
+        help="Файлы читаются с диска сервера и обрабатываются параллельно в пуле процессов."
+    )
+    streaming_ingest = st.toggle(
+        "Потоковая загрузка по частям (для больших файлов)", value=False, key='streaming_ingest',
+        help="Один CSV читается частями: пиковая память ограничена размером части, а не всего файла.",
+        disabled=BACKEND != 'pandas'
+    )
+    ingest_chunksize = st.number_input(
+        "Размер части (строк)", min_value=10_000, max_value=5_000_000, value=DEFAULT_CHUNKSIZE,
+        step=50_000, key='ingest_chunksize', disabled=not streaming_ingest
+    )
+    background_warmup = st.toggle(
+        "Фоновый предрасчёт агрегатов после загрузки", value=True, key='background_warmup',
+        help="Пул потоков заранее считает все вкладки без фильтров и состояния с одним выбранным значением фильтра."
+    )
+    reports_dir = st.text_input(
+        "Каталог предрасчитанных отчётов (report.py)", key='reports_dir',
+        help="Отчёты, посчитанные для этого датасета, сразу попадают в кэш агрегатов."
+    )
+
+delta_file, delta_key_column = None, ''
+with st.expander("🔄 Дозагрузка изменений (дельта)"):
+    if BACKEND == 'pandas':
+        delta_file = st.file_uploader(
+            "Файл дельты: новые и изменившиеся пользователи (CSV/Parquet)", type=["csv", "parquet"], key='delta_file',
+            help="Строки пользователей в том же формате, что и основной файл. Пересчитываются только они."
+        )
+        delta_key_column = st.text_input(
+            "Колонка стабильного идентификатора пользователя", key='delta_key_column',
+            placeholder="например, external_user_id",
+            help="Колонка выгрузки, по которой строки дельты сопоставляются с загруженными: найденные пользователи "
+                 "заменяются, новые добавляются. user_id не подходит - это номер строки, присвоенный при загрузке."
+        ).strip()
+        if delta_file is not None and not delta_key_column:
+            st.warning("Укажите колонку стабильного идентификатора пользователя - без неё дельта не применяется.")
+    else:
+        st.caption("Дельта применяется к таблицам в памяти и доступна только с бэкендом pandas.")
+
+local_partitions = []
+if partition_pattern:
+    # Ключ локального файла - хэш содержимого (как у загруженного и в report.py), запомненный по сигнатуре файла
+    local_partitions = [(str(path), file_key(path)) for path in expand_partitions(partition_pattern)]
+    if not local_partitions:
+        st.warning(f"По шаблону '{partition_pattern}' не найдено файлов CSV/Parquet.")
+
+if not uploaded_files and not local_partitions:
     st.info("Пожалуйста, загрузите CSV-файл для начала анализа.")
     st.stop()
 
-with st.spinner('Загрузка и обработка данных...'):
-    df_users, df_shifts = load_and_process_data(uploaded_file)
+if BACKEND == 'duckdb':
+    # Таблицы остаются в файле DuckDB, фильтры и группировки выполняются SQL-запросами
+    file_keys = [upload_key(f) for f in uploaded_files] + [key for _, key in local_partitions]
+    with perf.span("Датасет DuckDB", 'pipeline', cache='hit'):
+        try:
+            engine = get_sql_engine(tuple(file_keys), uploaded_files, tuple(path for path, _ in local_partitions))
+        except Exception as e:
+            st.error(f"Не удалось подготовить датасет DuckDB: {e}")
+            st.stop()
+    dataset_meta = {'dataset_key': engine.dataset_key}
+    catalog = engine.catalog
+    st.caption(
+        f"🦆 Бэкенд DuckDB: {engine.rows['users']:,} пользователей, {engine.rows['shifts']:,} смен, "
+        f"файл базы {engine.db_path.stat().st_size / 2**20:,.0f} МБ (в память загружаются только результаты запросов)."
+    )
+else:
+    # Таблицы берутся из общего реестра процесса: сессии с тем же датасетом не копируют их
+    dataset_registry = get_dataset_registry()
+    session_id = current_session_id()
+    main_key = dataset_key(
+        [upload_key(f) for f in uploaded_files] + [key for _, key in local_partitions]
+    )
+    load_progress = st.progress(0.0, text='Загрузка и обработка данных...')
+    with perf.span("Загрузка и обработка данных", 'pipeline', cache='hit'):
+        dataset, _ = dataset_registry.acquire(session_id, main_key, lambda: load_and_process_data(
+            main_key,
+            uploaded_files,
+            tuple(local_partitions),
+            chunksize=int(ingest_chunksize) if streaming_ingest else None,
+            on_progress=lambda fraction, text: load_progress.progress(fraction, text=text)
+        ))
+    load_progress.empty()
 
-if df_users is None or df_shifts is None or df_shifts.empty:
-    st.error("Не удалось обработать файл или в файле нет данных о бронированиях. Проверьте формат данных.")
-    st.stop()
+    if dataset is None or dataset[1] is None or dataset[1].empty:
+        dataset_registry.retain(session_id, [])
+        st.error("Не удалось обработать файл или в файле нет данных о бронированиях. Проверьте формат данных.")
+        st.stop()
+    df_users, df_shifts, dataset_meta = dataset
+    dataset_keys = [main_key]
+
+    if dataset_meta.get('from_cache'):
+        st.caption("⚡ Данные загружены из локального кэша (файл уже обрабатывался ранее).")
+
+    # Исходный датасет, к которому применена дельта: его куб обновляется только по изменившимся неделям
+    base_dataset = None
+    if delta_file is not None and delta_key_column:
+        delta_key = dataset_key([main_key, upload_key(delta_file), delta_key_column])
+        with perf.span("Применение дельты", 'pipeline', cache='hit'), st.spinner("Применение дельты..."):
+            delta_result, _ = dataset_registry.acquire(session_id, delta_key, lambda: apply_dataset_delta(
+                delta_key, dataset_meta, df_users, df_shifts, delta_file, delta_key_column
+            ))
+        if delta_result is not None:
+            dataset_keys.append(delta_key)
+            base_dataset = (dataset_meta['dataset_key'], df_users, df_shifts)
+            df_users, df_shifts, dataset_meta = delta_result
+            changes = dataset_meta['changes']
+            st.caption(
+                f"🔄 Применена дельта: обновлено пользователей - {changes['updated_users']:,}, "
+                f"новых - {changes['new_users']:,}, затронуто недель - {len(changes['weeks'])}."
+            )
+
+    # Датасеты, которые сессия больше не использует, освобождаются, если они не нужны другим сессиям
+    dataset_registry.retain(session_id, dataset_keys)
+    shared_with = dataset_registry.stats()['refs'].get(dataset_meta['dataset_key'], 1) - 1
+    if shared_with:
+        st.caption(f"🤝 Этот датасет открыт ещё в сессиях: {shared_with}. Таблицы в памяти общие, без копий.")
+
+    with st.expander("📦 Память: компактная схема типов (до / после)"):
+        st.dataframe(memory_report(dataset_meta['memory']), hide_index=True, use_container_width=True)
+
+    # Каталог метаданных хранится вместе с датасетом: боковая панель строится по нему, не дожидаясь индекса и куба
+    catalog = DatasetCatalog.from_dict(dataset_meta.get('catalog'))
+    if catalog is None:
+        catalog = get_dataset_catalog(dataset_meta['dataset_key'], df_users, df_shifts)
+
+with st.expander("🗂 Каталог колонок: пропуски, различные значения, границы"):
+    st.dataframe(
+        catalog.summary().rename(columns={
+            'table': 'Таблица', 'column': 'Колонка', 'dtype': 'Тип', 'null_ratio': 'Доля пропусков',
+            'distinct': 'Различных', 'min': 'Минимум', 'max': 'Максимум'
+        }),
+        column_config={'Доля пропусков': st.column_config.NumberColumn(format='percent')},
+        hide_index=True, use_container_width=True
+    )
 
 # --- 4. UI: Глобальные фильтры в боковой панели ---
 st.sidebar.header("Глобальные фильтры")
 
-# Функция для получения уникальных, отсортированных значений
-def get_sorted_unique(df, column):
-    if column in df.columns:
-        return sorted(df[column].dropna().unique())
-    return []
+# Значения фильтров из каталога метаданных датасета (отсортированные, без пропусков)
+def filter_options(section, column):
+    present, _ = catalog.filter_values(section, [column]).get(column, ([], False))
+    return list(present)
 
 # --- Фильтры по демографии ---
 st.sidebar.subheader("Фильтры по демографии")
-selected_genders = st.sidebar.multiselect("Пол (gender)", options=get_sorted_unique(df_users, 'gender'), default=get_sorted_unique(df_users, 'gender'))
-selected_ages = st.sidebar.multiselect("Возраст (age)", options=get_sorted_unique(df_users, 'age'), default=get_sorted_unique(df_users, 'age'))
-selected_incomes = st.sidebar.multiselect("Доход (income)", options=get_sorted_unique(df_users, 'income'), default=get_sorted_unique(df_users, 'income'))
-selected_platforms = st.sidebar.multiselect("Платформа (platform)", options=get_sorted_unique(df_users, 'platform'), default=get_sorted_unique(df_users, 'platform'))
-selected_user_regions = st.sidebar.multiselect("Регион пользователя (region)", options=get_sorted_unique(df_users, 'region'), default=get_sorted_unique(df_users, 'region'))
+selected_genders = st.sidebar.multiselect("Пол (gender)", options=filter_options('users', 'gender'), default=filter_options('users', 'gender'))
+selected_ages = st.sidebar.multiselect("Возраст (age)", options=filter_options('users', 'age'), default=filter_options('users', 'age'))
+selected_incomes = st.sidebar.multiselect("Доход (income)", options=filter_options('users', 'income'), default=filter_options('users', 'income'))
+selected_platforms = st.sidebar.multiselect("Платформа (platform)", options=filter_options('users', 'platform'), default=filter_options('users', 'platform'))
+selected_user_regions = st.sidebar.multiselect("Регион пользователя (region)", options=filter_options('users', 'region'), default=filter_options('users', 'region'))
 
 # --- НОВЫЕ ФИЛЬТРЫ ПО ПОВЕДЕНИЮ ---
 st.sidebar.subheader("Фильтры по поведению")
-selected_verification = st.sidebar.multiselect("Верификация ГУ (success_verification_gu_flg)", options=get_sorted_unique(df_users, 'success_verification_gu_flg'), default=get_sorted_unique(df_users, 'success_verification_gu_flg'))
-selected_cv_podrabotka = st.sidebar.multiselect("Резюме 'Подработка' (cv_podrabotka_flg)", options=get_sorted_unique(df_users, 'cv_podrabotka_flg'), default=get_sorted_unique(df_users, 'cv_podrabotka_flg'))
-selected_cv_free = st.sidebar.multiselect("Резюме 'Своб. график' (cv_free_grafik_flg)", options=get_sorted_unique(df_users, 'cv_free_grafik_flg'), default=get_sorted_unique(df_users, 'cv_free_grafik_flg'))
-selected_vac_podrabotka = st.sidebar.multiselect("Отклик 'Подработка' (vac_podrabotka_flg)", options=get_sorted_unique(df_users, 'vac_podrabotka_flg'), default=get_sorted_unique(df_users, 'vac_podrabotka_flg'))
-
-if 'quantity_responses' in df_users.columns:
-    min_q = int(df_users['quantity_responses'].min())
-    max_q = int(df_users['quantity_responses'].max())
+selected_verification = st.sidebar.multiselect("Верификация ГУ (success_verification_gu_flg)", options=filter_options('users', 'success_verification_gu_flg'), default=filter_options('users', 'success_verification_gu_flg'))
+selected_cv_podrabotka = st.sidebar.multiselect("Резюме 'Подработка' (cv_podrabotka_flg)", options=filter_options('users', 'cv_podrabotka_flg'), default=filter_options('users', 'cv_podrabotka_flg'))
+selected_cv_free = st.sidebar.multiselect("Резюме 'Своб. график' (cv_free_grafik_flg)", options=filter_options('users', 'cv_free_grafik_flg'), default=filter_options('users', 'cv_free_grafik_flg'))
+selected_vac_podrabotka = st.sidebar.multiselect("Отклик 'Подработка' (vac_podrabotka_flg)", options=filter_options('users', 'vac_podrabotka_flg'), default=filter_options('users', 'vac_podrabotka_flg'))
+
+range_bounds = catalog.range_bounds(USER_RANGE_COLS)
+if 'quantity_responses' in range_bounds:
+    min_q, max_q = (int(bound) for bound in range_bounds['quantity_responses'][:2])
     selected_responses = st.sidebar.slider(
         "Кол-во откликов (quantity_responses)",
         min_value=min_q,
@@ -172,15 +460,38 @@ else:
 
 # --- ФИЛЬТРЫ ПО СМЕНАМ ---
 st.sidebar.subheader("Фильтры по сменам")
-min_date = df_shifts['shift_start_time'].min().date()
-max_date = df_shifts['shift_start_time'].max().date()
+min_date, max_date, _ = catalog.date_bounds()
 date_range = st.sidebar.date_input("Диапазон дат старта смены", value=(min_date, max_date), min_value=min_date, max_value=max_date)
-selected_shift_regions = st.sidebar.multiselect("Регион смены (shift_region)", options=get_sorted_unique(df_shifts, 'shift_region'), default=get_sorted_unique(df_shifts, 'shift_region'))
-selected_task_groups = st.sidebar.multiselect("Группа заданий (task_group)", options=get_sorted_unique(df_shifts, 'task_group'), default=get_sorted_unique(df_shifts, 'task_group'))
+selected_shift_regions = st.sidebar.multiselect("Регион смены (shift_region)", options=filter_options('shifts', 'shift_region'), default=filter_options('shifts', 'shift_region'))
+selected_task_groups = st.sidebar.multiselect("Группа заданий (task_group)", options=filter_options('shifts', 'task_group'), default=filter_options('shifts', 'task_group'))
+
+# --- СТАТИСТИЧЕСКАЯ ЗНАЧИМОСТЬ ---
+st.sidebar.subheader("Статистическая значимость")
+CI_METHODS = {'Нет': None, 'Уилсон / нормальный': 'wilson', 'Бутстрэп (доли по сменам)': 'bootstrap'}
+ci_method = CI_METHODS[st.sidebar.selectbox(
+    "Доверительные интервалы", options=list(CI_METHODS), index=1, key='ci_method',
+    help="Доли по сменам - интервал Уилсона или бутстрэп; средний FR пользователей - нормальный интервал."
+)]
+ci_level = st.sidebar.select_slider(
+    "Уровень доверия", options=[0.9, 0.95, 0.99], value=DEFAULT_CONFIDENCE, key='ci_level',
+    format_func=lambda level: f"{level:.0%}", disabled=ci_method is None
+)
+
+# --- РЕЖИМ РАСЧЁТА ---
+st.sidebar.subheader("Режим расчёта")
+approximate_mode = st.sidebar.toggle(
+    "Быстрый предпросмотр по выборке", value=False, key='approximate_mode', disabled=BACKEND == 'duckdb',
+    help="Сначала всё считается по стратифицированной выборке пользователей (регион x группа заданий) "
+         "с интервалами ошибки; точные результаты считаются в фоне и подставляются автоматически."
+)
+sample_size = st.sidebar.select_slider(
+    "Размер выборки (пользователей)", options=SAMPLE_SIZES, value=DEFAULT_SAMPLE_SIZE, key='sample_size',
+    format_func=lambda size: f"{size:,}", disabled=not approximate_mode or BACKEND == 'duckdb'
+)
 
 # --- 5. Применение фильтров (ОБНОВЛЕННАЯ ЛОГИКА) ---
 
-# Шаг 5a: Сначала фильтруем пользователей
+# Шаг 5a: Фильтры пользователей
 user_filters = {
     'gender': selected_genders,
     'age': selected_ages,
@@ -192,441 +503,696 @@ user_filters = {
     'cv_free_grafik_flg': selected_cv_free,
     'vac_podrabotka_flg': selected_vac_podrabotka
 }
+user_ranges = {'quantity_responses': selected_responses} if 'quantity_responses' in range_bounds else {}
 
-filtered_users = df_users.copy()
-for col, values in user_filters.items():
-    if col in filtered_users.columns:
-        filtered_users = filtered_users[filtered_users[col].isin(values)]
-
-# Применяем слайдер
-if 'quantity_responses' in filtered_users.columns:
-    min_resp, max_resp = selected_responses
-    filtered_users = filtered_users[
-        (filtered_users['quantity_responses'] >= min_resp) &
-        (filtered_users['quantity_responses'] <= max_resp)
-    ]
-
-user_ids_to_keep = filtered_users['user_id'].unique()
-
-# Шаг 5b: Фильтруем смены
-start_date, end_date = date_range
-filtered_shifts = df_shifts[
-    (df_shifts['user_id'].isin(user_ids_to_keep)) &
-    (df_shifts['shift_start_time'].dt.date >= start_date) &
-    (df_shifts['shift_start_time'].dt.date <= end_date) &
-    (df_shifts['shift_region'].isin(selected_shift_regions)) &
-    (df_shifts['task_group'].isin(selected_task_groups))
-]
-
-# Шаг 5c: Финальная синхронизация
-final_filtered_user_ids = filtered_shifts['user_id'].unique()
-filtered_users = filtered_users[filtered_users['user_id'].isin(final_filtered_user_ids)]
-
-
-if filtered_shifts.empty or filtered_users.empty:
-    st.warning("По текущим фильтрам данные не найдены. Попробуйте изменить фильтры.")
-    st.stop()
+# Шаг 5b: Фильтры смен
+shift_filters = {
+    'shift_region': selected_shift_regions,
+    'task_group': selected_task_groups
+}
 
-# --- 6. Создание вкладок дашборда ---
-tab1, tab2, tab3, tab4 = st.tabs([
-    "📈 Обзор (Health Check)", 
-    "📋 Анализ Смен", 
-    "👤 Профиль Работника", 
-    "🔄 Удержание и Когорты"
-])
-
-# --- Вкладка 1: Обзор ---
-with tab1:
-    st.header("Обзор: Здоровье платформы")
-    
-    col1, col2, col3 = st.columns(3)
-    total_booked = filtered_shifts.shape[0]
-    total_done = filtered_shifts['job_done'].sum()
-    overall_fr = total_done / total_booked if total_booked > 0 else 0
-    
-    col1.metric("Общий Fill Rate", f"{overall_fr:.1%}")
-    col2.metric("Всего забронировано смен", f"{total_booked:,}")
-    col3.metric("Всего выполнено смен", f"{total_done:,.0f}")
-    
-    st.markdown("---")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("Fill Rate по № смены")
-        fr_by_shift_num = filtered_shifts.groupby('shift_number')['job_done'].agg(
-            fill_rate='mean', booked='size', done='sum'
-        ).reset_index()
-        fr_by_shift_num['shift_number'] = fr_by_shift_num['shift_number'].astype(str)
-
-        fig = px.bar(
-            fr_by_shift_num, x='shift_number', y='fill_rate',
-            title="Fill Rate для 1-й, 2-й и 3-й смены",
-            labels={'shift_number': 'Номер смены', 'fill_rate': 'Fill Rate'},
-            text_auto='.1%', template='plotly_white'
+# Шаг 5c: Битовые карты индекса (или SQL-условия DuckDB) + финальная синхронизация пользователей и смен.
+# Спецификация фильтров (без фильтров, которые ничего не отсекают) - ключ кэша агрегатов.
+filter_spec = {
+    'users': user_filters,
+    'user_ranges': user_ranges,
+    'dates': date_range,
+    'shifts': shift_filters
+}
+# Шаг 5d: Индекс фильтров и куб (pandas) строятся после боковой панели - на время построения она уже видна
+if BACKEND != 'duckdb':
+    with perf.span("Индекс фильтров", 'pipeline', cache='hit'):
+        base_index = get_filter_index(*base_dataset) if base_dataset is not None else None
+        filter_index = get_filter_index(
+            dataset_meta['dataset_key'], df_users, df_shifts,
+            _base_index=base_index, _changes=dataset_meta.get('changes')
         )
-        fig.update_layout(yaxis_title="Fill Rate", xaxis_title="Номер смены", yaxis_tickformat=".0%")
-        st.plotly_chart(fig, use_container_width=True)
-        
-        st.caption("Данные для расчета стат. значимости:")
-        st.dataframe(fr_by_shift_num[['shift_number', 'booked', 'done']], use_container_width=True)
-
-    with col2:
-        st.subheader("Динамика Fill Rate")
-        fr_dynamics = filtered_shifts.set_index('shift_start_time').resample('W')['job_done'].mean().reset_index()
-        
-        fig = px.line(
-            fr_dynamics, x='shift_start_time', y='job_done',
-            title="Динамика Fill Rate по неделям",
-            labels={'shift_start_time': 'Неделя', 'job_done': 'Fill Rate'},
-            template='plotly_white'
+    with perf.span("Куб Fill Rate", 'pipeline', cache='hit'):
+        base_cube = get_fill_rate_cube(*base_dataset) if base_dataset is not None else None
+        fill_rate_cube = get_fill_rate_cube(
+            dataset_meta['dataset_key'], df_users, df_shifts,
+            _base_cube=base_cube, _changes=dataset_meta.get('changes')
         )
-        fig.update_layout(yaxis_tickformat=".0%")
-        fig.update_traces(mode='lines+markers')
-        st.plotly_chart(fig, use_container_width=True)
-
-    st.subheader("Fill Rate по Регионам")
-    top_n_regions = st.slider("Показать Топ-N регионов (по кол-ву смен):", min_value=5, max_value=100, value=15, step=5, key='regions_slider')
-    
-    fr_by_region = filtered_shifts.groupby('shift_region')['job_done'].agg(fill_rate='mean', count='size').reset_index()
-    fr_by_region = fr_by_region.nlargest(top_n_regions, 'count').sort_values('fill_rate', ascending=False)
-    
-    fig_region = px.bar(
-        fr_by_region, x='fill_rate', y='shift_region', orientation='h',
-        title=f"Fill Rate по Топ-{top_n_regions} регионам (по числу смен)",
-        labels={'shift_region': 'Регион', 'fill_rate': 'Fill Rate'},
-        text_auto='.1%', template='plotly_white'
+    engine = AnalyticsEngine(
+        df_users, df_shifts, dataset_meta['dataset_key'],
+        filter_index=filter_index, cube=fill_rate_cube, cache=get_aggregate_cache(), catalog=catalog,
+        bucketizer=get_bucketizer(dataset_meta['dataset_key'], df_users, df_shifts)
     )
-    fig_region.update_layout(yaxis_title="Регион", xaxis_title="Fill Rate", xaxis_tickformat=".0%")
-    st.plotly_chart(fig_region, use_container_width=True)
-
+    if base_index is not None and 'user_ids' in dataset_meta['changes']:
+        with perf.span("Перенос агрегатов после дельты", 'pipeline', cache='hit'):
+            adopt_delta_aggregates(dataset_meta['dataset_key'], engine, base_dataset, base_index, dataset_meta['changes'])
+
+# Фоновый прогрев сразу после загрузки: агрегаты всех вкладок без фильтров, затем вероятные следующие фильтры
+warmup_job = get_aggregate_warmer().warm(engine) if background_warmup else None
+
+aggregate_cache = get_aggregate_cache()
+if reports_dir:
+    with perf.span("Предрасчитанные отчёты", 'pipeline', cache='hit'):
+        load_precomputed_reports(reports_dir, dataset_meta['dataset_key'])
+
+# Шаг 5e: Быстрый предпросмотр - пока точный расчёт идёт в фоне, вкладки строятся по выборке
+refinement = None
+view_engine = engine
+if approximate_mode and BACKEND != 'duckdb':
+    with perf.span("Выборка для предпросмотра", 'pipeline', cache='hit'):
+        sample_engine = get_sample_engine(dataset_meta['dataset_key'], sample_size, engine)
+    if sample_engine.approximate:
+        refinement = get_aggregate_warmer().refine(engine, filter_spec)
+        if not refinement.done():
+            view_engine = sample_engine
+view = view_engine.view(filter_spec)
+if view.empty and view_engine is not engine:
+    # Узкому фильтру могут соответствовать строки, не попавшие в выборку: пустоту решает точный движок
+    view_engine = engine
+    view = engine.view(filter_spec)
+
+if view.empty:
+    st.warning("По текущим фильтрам данные не найдены. Попробуйте изменить фильтры.")
+else:
+    if view_engine.approximate:
+        st.info(
+            f"⚡ Предпросмотр по выборке: {len(view_engine.df_users):,} пользователей "
+            f"({view_engine.sample_fraction:.1%} датасета, страты - регион x группа заданий первой смены). "
+            "Доли и средние - оценки с интервалами, количества на графиках и в таблицах - по выборке. "
+            "Точные результаты подставятся автоматически."
+        )
+        st.fragment(rerun_when_done, run_every=1)(refinement, "⏳ Точные результаты считаются в фоне...")
+        # Интервалы ошибки предпросмотра показываются всегда
+        ci_method = ci_method or 'wilson'
+
+    # Разбивки Fill Rate для столбчатых диаграмм: с доверительными интервалами, если они включены
+    def fill_rate_breakdown(breakdown, *args):
+        if ci_method is None:
+            return getattr(view, breakdown)(*args)
+        return view.fill_rate_intervals(breakdown, *args, method=ci_method, confidence=ci_level)
+
+    def error_bars(agg, value, axis='y'):
+        """Аргументы px.bar для усов доверительного интервала (без интервалов - пусто)."""
+        if 'ci_low' not in agg.columns:
+            return {}
+        return {
+            f'error_{axis}': (agg['ci_high'] - agg[value]).to_numpy(),
+            f'error_{axis}_minus': (agg[value] - agg['ci_low']).to_numpy(),
+        }
 
-# --- Вкладка 2: Анализ Смен ---
-with tab2:
-    st.header("Анализ характеристик смены")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("FR по группам заданий")
-        top_n_groups = st.slider("Показать Топ-N групп заданий (по кол-ву смен):", min_value=5, max_value=50, value=15, step=5, key='groups_slider')
+    def show_pairwise_tests(breakdown, *args, shown=None, **kwargs):
+        """Попарные сравнения групп разбивки (только для показанных на графике групп shown)."""
+        if ci_method is None:
+            return
+        with st.expander("Попарные сравнения (z-тест, поправка Холма)"):
+            tests = view.fill_rate_tests(breakdown, *args, confidence=ci_level, **kwargs)
+            if shown is not None:
+                shown = set(shown.astype(str))
+                tests = tests[tests['group_a'].isin(shown) & tests['group_b'].isin(shown)]
+            st.caption(f"Значимых различий на уровне {ci_level:.0%}: {int(tests['significant'].sum())} из {len(tests)} пар.")
+            st.dataframe(
+                tests.rename(columns={
+                    'variable': 'Признак', 'group_a': 'Группа A', 'group_b': 'Группа B', 'diff': 'Разница FR',
+                    'diff_low': 'Разница: от', 'diff_high': 'Разница: до', 'p_value': 'p', 'p_holm': 'p (Холм)',
+                    'significant': 'Значимо'
+                }),
+                hide_index=True, use_container_width=True
+            )
 
-        fr_by_group = filtered_shifts.groupby('task_group')['job_done'].agg(fill_rate='mean', count='size').reset_index()
-        fr_by_group = fr_by_group.nlargest(top_n_groups, 'count').sort_values('fill_rate', ascending=False)
-        
-        fig = px.bar(
-            fr_by_group, x='fill_rate', y='task_group', orientation='h',
-            title=f"Fill Rate по Топ-{top_n_groups} группам заданий",
-            labels={'task_group': 'Группа задания', 'fill_rate': 'Fill Rate'},
-            text_auto='.1%', template='plotly_white'
+    def custom_bins(widget_key, default_bins, label):
+        """Пользовательские границы корзин из текстового поля; None - стандартные (или ошибка ввода)."""
+        text = st.text_input(label, key=widget_key, help="Числа через запятую, корзины [a, b); можно -inf и inf")
+        try:
+            bins = parse_bins(text)
+        except ValueError as error:
+            st.warning(f"{error}. Используются стандартные границы.")
+            return None
+        return None if bins == [float(b) for b in default_bins] else tuple(bins)
+
+    # Выгрузка: файл собирается только по нажатию кнопки (в отдельном потоке), пачками строк по маске фильтров
+    with st.expander("📥 Выгрузка отфильтрованных данных"):
+        export_format = st.radio("Формат файла", options=list(EXPORT_FORMATS), horizontal=True, key='export_format')
+        st.caption(
+            "Строки пишутся в файл пачками прямо по маске фильтров, без копии отфильтрованных таблиц в памяти. "
+            "Выгрузка всегда точная - и в режиме предпросмотра по выборке."
         )
-        st.plotly_chart(fig, use_container_width=True)
-
-    with col2:
-        st.subheader("FR по длительности смены (в часах)")
-        bins = [0, 2, 4, 6, 8, 10, 12, 24]
-        labels = ['0-2ч', '2-4ч', '4-6ч', '6-8ч', '8-10ч', '10-12ч', '12+ч']
-        plot_df = filtered_shifts.copy()
-        if 'duration' in plot_df.columns:
-            plot_df['duration_bin'] = pd.cut(plot_df['duration'], bins=bins, labels=labels, right=False)
-            fr_by_duration = plot_df.groupby('duration_bin')['job_done'].mean().reset_index()
-
-            fig = px.bar(
-                fr_by_duration, x='duration_bin', y='job_done',
-                title="Fill Rate по длительности смены",
-                labels={'duration_bin': 'Длительность (часы)', 'job_done': 'Fill Rate'},
-                text_auto='.1%', template='plotly_white'
+        col1, col2 = st.columns(2)
+        for column, table, name, label in [
+            (col1, 'users', 'filtered_users', "Пользователи"), (col2, 'shifts', 'filtered_shifts', "Смены")
+        ]:
+            column.download_button(
+                f"📥 {label}: {export_file_name(name, export_format)}",
+                data=lambda table=table, fmt=export_format: engine.view(filter_spec).export_rows(table, fmt),
+                file_name=export_file_name(name, export_format), mime=EXPORT_FORMATS[export_format][1],
+                key=f'export_{name}', on_click='ignore', use_container_width=True
             )
-            fig.update_layout(yaxis_tickformat=".0%")
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.warning("Колонка 'duration' отсутствует.")
 
-    st.subheader("FR по типам заданий")
-    top_n_tasks = st.slider("Показать Топ-N типов заданий (по кол-ву смен):", min_value=5, max_value=50, value=15, step=5, key='tasks_slider')
+    def download_table(agg, name):
+        """Кнопка выгрузки таблицы агрегата в формате из блока выгрузки."""
+        st.download_button(
+            f"📥 Таблица: {export_file_name(name, export_format)}",
+            data=lambda fmt=export_format: export_frame(agg, fmt),
+            file_name=export_file_name(name, export_format), mime=EXPORT_FORMATS[export_format][1],
+            key=f'export_{name}', on_click='ignore'
+        )
 
-    fr_by_task = filtered_shifts.groupby('task_type')['job_done'].agg(fill_rate='mean', count='size').reset_index()
-    fr_by_task = fr_by_task.nlargest(top_n_tasks, 'count').sort_values('fill_rate', ascending=False)
-        
-    fig = px.bar(
-        fr_by_task, x='fill_rate', y='task_type', orientation='h',
-        title=f"Fill Rate по Топ-{top_n_tasks} типам заданий",
-        labels={'task_type': 'Тип задания', 'fill_rate': 'Fill Rate'},
-        text_auto='.1%', template='plotly_white'
+    # --- 6. Создание вкладок дашборда ---
+    # Ленивый режим: выполняется только открытая вкладка, остальные считаются при переключении
+    # (агрегаты при неизменных фильтрах берутся из кэша). Без него вкладка.open = None и считаются все.
+    lazy_tabs = st.sidebar.toggle(
+        "Считать только открытую вкладку", value=True, key='lazy_tabs',
+        help="Переключение вкладки перезапускает скрипт, но не пересчитывает скрытые вкладки на каждом изменении фильтров."
     )
-    st.plotly_chart(fig, use_container_width=True)
+    # Streamlit удаляет состояние виджетов, не отрисованных в перезапуске - переприсваиваем его для скрытых вкладок
+    for widget_key, default in TAB_WIDGET_DEFAULTS.items():
+        st.session_state[widget_key] = st.session_state.get(widget_key, default)
+
+    tab1, tab2, tab3, tab4 = st.tabs([
+        "📈 Обзор (Health Check)",
+        "📋 Анализ Смен",
+        "👤 Профиль Работника",
+        "🔄 Удержание и Когорты"
+    ], key='active_tab' if lazy_tabs else None, on_change='rerun' if lazy_tabs else 'ignore')
+
+    # --- Вкладка 1: Обзор ---
+    if tab1.open is not False:
+        with tab1, perf.span("Вкладка 1: Обзор", 'tab'):
+            st.header("Обзор: Здоровье платформы")
     
-    col1, col2 = st.columns(2)
+            col1, col2, col3 = st.columns(3)
+            if view_engine.approximate:
+                estimates = view.total_estimates(ci_level)
+                col1.metric("Общий Fill Rate", f"≈ {estimates['fill_rate']:.1%}")
+                col2.metric("Всего забронировано смен", f"≈ {estimates['booked']:,.0f}")
+                col3.metric("Всего выполнено смен", f"≈ {estimates['done']:,.0f}")
+                st.caption(
+                    f"Интервалы {ci_level:.0%} по выборке: Fill Rate {estimates['fill_rate_low']:.1%} - "
+                    f"{estimates['fill_rate_high']:.1%}, забронировано {estimates['booked_low']:,.0f} - "
+                    f"{estimates['booked_high']:,.0f}, выполнено {estimates['done_low']:,.0f} - {estimates['done_high']:,.0f}."
+                )
+            else:
+                total_booked, total_done = view.totals()
+                overall_fr = total_done / total_booked if total_booked > 0 else 0
+
+                col1.metric("Общий Fill Rate", f"{overall_fr:.1%}")
+                col2.metric("Всего забронировано смен", f"{total_booked:,}")
+                col3.metric("Всего выполнено смен", f"{total_done:,.0f}")
+            if view.backend == 'duckdb':
+                aggregate_source = 'SQL-запросы DuckDB'
+            elif view.use_cube:
+                aggregate_source = 'предагрегированный куб'
+            else:
+                aggregate_source = (
+                    'сырые смены (куба нет, фильтр вне его измерений, даты внутри недели или неполный диапазон откликов)'
+                )
+            if view_engine.approximate:
+                aggregate_source += ', по выборке пользователей'
+            st.caption(f"Источник агрегатов: {aggregate_source}.")
     
-    with col1:
-        if 'price_per_hour' in filtered_shifts.columns:
-            st.subheader("Распределение ставок (Успех vs. Неуспех)")
-            fig = px.histogram(
-                filtered_shifts.dropna(subset=['price_per_hour']),
-                x='price_per_hour', color='job_done', barmode='overlay', marginal='box',
-                title="Распределение ставок для успешных (1) и неуспешных (0) смен",
-                labels={'price_per_hour': 'Ставка в час (руб.)'}, template='plotly_white'
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.warning("Колонка 'price_per_hour' отсутствует.")
-
-    with col2:
-        if 'duration' in filtered_shifts.columns:
-            st.subheader("Распределение длительности (Успех vs. Неуспех)")
-            fig = px.histogram(
-                filtered_shifts.dropna(subset=['duration']),
-                x='duration', color='job_done', barmode='overlay', marginal='box',
-                title="Распределение длительности смен (1 vs. 0)",
-                labels={'duration': 'Длительность (часы)'}, template='plotly_white'
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.warning("Колонка 'duration' отсутствует.")
-
-
-# --- Вкладка 3: Профиль Работника (РАСШИРЕНА) ---
-with tab3:
-    st.header("Анализ профиля работника")
-    st.info("`user_avg_fr` = (Успехи пользователя / Бронирования пользователя).")
+            st.markdown("---")
     
-    col1, col2 = st.columns(2)
+            col1, col2 = st.columns(2)
     
-    with col1:
-        st.subheader("Средний FR по сегментам (Возраст/Доход)")
-        if 'age' in filtered_users.columns and 'income' in filtered_users.columns:
-            fr_demo = filtered_users.groupby(['age', 'income'])['user_avg_fr'].mean().reset_index()
-            fr_demo_pivot = fr_demo.pivot(index='age', columns='income', values='user_avg_fr')
-            
-            fig = px.imshow(
-                fr_demo_pivot, text_auto=".1%", aspect="auto",
-                title="Тепловая карта: Средний FR (Возраст vs. Доход)",
-                labels={'color': 'Avg. Fill Rate'}, template='plotly_white'
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-             st.warning("Колонки 'age' или 'income' отсутствуют.")
-
-    with col2:
-        st.subheader("Эффект опыта: FR на 2-й смене")
-        shifts_1 = filtered_shifts[filtered_shifts['shift_number'] == 1][['user_id', 'job_done']]
-        shifts_2 = filtered_shifts[filtered_shifts['shift_number'] == 2][['user_id', 'job_done']]
+            with col1, perf.span("Fill Rate по № смены", 'chart'):
+                st.subheader("Fill Rate по № смены")
+                fr_by_shift_num = fill_rate_breakdown('fill_rate_by_shift_number')
+
+                fig = px.bar(
+                    fr_by_shift_num, x='shift_number', y='fill_rate',
+                    title="Fill Rate для 1-й, 2-й и 3-й смены",
+                    labels={'shift_number': 'Номер смены', 'fill_rate': 'Fill Rate'},
+                    text_auto='.1%', template='plotly_white', **error_bars(fr_by_shift_num, 'fill_rate')
+                )
+                fig.update_layout(yaxis_title="Fill Rate", xaxis_title="Номер смены", yaxis_tickformat=".0%")
+                st.plotly_chart(fig, use_container_width=True)
         
-        merged_exp = pd.merge(shifts_1, shifts_2, on='user_id', suffixes=('_1', '_2'))
+                st.caption("Данные для расчета стат. значимости:")
+                significance_cols = [col for col in ['shift_number', 'booked', 'done', 'ci_low', 'ci_high'] if col in fr_by_shift_num]
+                st.dataframe(fr_by_shift_num[significance_cols], use_container_width=True)
+                show_pairwise_tests('fill_rate_by_shift_number')
+
+            with col2, perf.span("Динамика Fill Rate", 'chart'):
+                st.subheader("Динамика Fill Rate")
+                fr_dynamics = view.weekly_fill_rate()
         
-        if merged_exp.empty:
-            st.warning("Недостаточно данных для анализа 'Эффекта опыта'")
-        else:
-            fr_exp = merged_exp.groupby('job_done_1')['job_done_2'].mean().reset_index()
-            fr_exp['job_done_1'] = fr_exp['job_done_1'].map({0.0: 'Провал 1-й', 1.0: 'Успех 1-й'})
-            
-            fig = px.bar(
-                fr_exp, x='job_done_1', y='job_done_2',
-                title="FR на 2-й смене (в зависимости от 1-й)",
-                labels={'job_done_1': 'Результат 1-й смены', 'job_done_2': 'Fill Rate на 2-й смене'},
-                text_auto='.1%', template='plotly_white'
-            )
-            fig.update_layout(yaxis_tickformat=".0%")
-            st.plotly_chart(fig, use_container_width=True)
-            
-    st.markdown("---")
+                fig = px.line(
+                    fr_dynamics, x='shift_start_time', y='job_done',
+                    title="Динамика Fill Rate по неделям",
+                    labels={'shift_start_time': 'Неделя', 'job_done': 'Fill Rate'},
+                    template='plotly_white'
+                )
+                fig.update_layout(yaxis_tickformat=".0%")
+                fig.update_traces(mode='lines+markers')
+                st.plotly_chart(fig, use_container_width=True)
+
+            st.subheader("Fill Rate по Регионам")
+            top_n_regions = st.slider("Показать Топ-N регионов (по кол-ву смен):", min_value=5, max_value=100, step=5, key='regions_slider')
     
-    # --- НОВЫЕ ГРАФИКИ ---
+            # Топ-N вырезается из полного закэшированного агрегата - слайдер не пересчитывает группировку
+            with perf.span("Fill Rate по регионам", 'chart'):
+                fr_by_region = top_n(fill_rate_breakdown('shift_fill_rate_by', 'shift_region'), top_n_regions)
     
-    def plot_fr_by_flags(df, flag_cols_map, title):
-        """Вспомогательная функция для плавления и отрисовки флагов."""
-        flag_cols = [col for col in flag_cols_map.keys() if col in df.columns]
-        if not flag_cols:
-            st.warning(f"Нет данных для '{title}'")
-            return
+                fig_region = px.bar(
+                    fr_by_region, x='fill_rate', y='shift_region', orientation='h',
+                    title=f"Fill Rate по Топ-{top_n_regions} регионам (по числу смен)",
+                    labels={'shift_region': 'Регион', 'fill_rate': 'Fill Rate'},
+                    text_auto='.1%', template='plotly_white', **error_bars(fr_by_region, 'fill_rate', 'x')
+                )
+                fig_region.update_layout(yaxis_title="Регион", xaxis_title="Fill Rate", xaxis_tickformat=".0%")
+                st.plotly_chart(fig_region, use_container_width=True)
+                download_table(view.shift_fill_rate_by('shift_region'), 'fr_by_region')
+                show_pairwise_tests('shift_fill_rate_by', 'shift_region', shown=fr_by_region['shift_region'])
+
+
+    # --- Вкладка 2: Анализ Смен ---
+    if tab2.open is not False:
+        with tab2, perf.span("Вкладка 2: Анализ Смен", 'tab'):
+            st.header("Анализ характеристик смены")
+    
+            col1, col2 = st.columns(2)
+    
+            with col1, perf.span("FR по группам заданий", 'chart'):
+                st.subheader("FR по группам заданий")
+                top_n_groups = st.slider("Показать Топ-N групп заданий (по кол-ву смен):", min_value=5, max_value=50, step=5, key='groups_slider')
 
-        melted_df = df.melt(id_vars=['user_id', 'user_avg_fr'], value_vars=flag_cols)
-        fr_by_flag = melted_df.groupby(['variable', 'value'])['user_avg_fr'].agg(
-            fill_rate='mean',
-            count='size'
-        ).reset_index()
+                fr_by_group = top_n(fill_rate_breakdown('shift_fill_rate_by', 'task_group'), top_n_groups)
         
-        fr_by_flag['variable'] = fr_by_flag['variable'].map(flag_cols_map)
-        fr_by_flag['value'] = fr_by_flag['value'].map({0.0: 'Нет', 1.0: 'Да'})
+                fig = px.bar(
+                    fr_by_group, x='fill_rate', y='task_group', orientation='h',
+                    title=f"Fill Rate по Топ-{top_n_groups} группам заданий",
+                    labels={'task_group': 'Группа задания', 'fill_rate': 'Fill Rate'},
+                    text_auto='.1%', template='plotly_white', **error_bars(fr_by_group, 'fill_rate', 'x')
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                download_table(view.shift_fill_rate_by('task_group'), 'fr_by_group')
+                show_pairwise_tests('shift_fill_rate_by', 'task_group', shown=fr_by_group['task_group'])
+
+            with col2, perf.span("FR по длительности смены", 'chart'):
+                st.subheader("FR по длительности смены (в часах)")
+                if 'duration' in engine.shift_columns:
+                    duration_bins = custom_bins('duration_bins', DURATION_BINS, "Границы корзин (часы)")
+                    fr_by_duration = fill_rate_breakdown('fill_rate_by_duration', duration_bins)
+
+                    fig = px.bar(
+                        fr_by_duration, x='duration_bin', y='job_done',
+                        title="Fill Rate по длительности смены",
+                        labels={'duration_bin': 'Длительность (часы)', 'job_done': 'Fill Rate'},
+                        text_auto='.1%', template='plotly_white', **error_bars(fr_by_duration, 'job_done')
+                    )
+                    fig.update_layout(yaxis_tickformat=".0%")
+                    st.plotly_chart(fig, use_container_width=True)
+                    show_pairwise_tests('fill_rate_by_duration', duration_bins)
+                else:
+                    st.warning("Колонка 'duration' отсутствует.")
+
+            st.subheader("FR по типам заданий")
+            top_n_tasks = st.slider("Показать Топ-N типов заданий (по кол-ву смен):", min_value=5, max_value=50, step=5, key='tasks_slider')
+
+            with perf.span("FR по типам заданий", 'chart'):
+                fr_by_task = top_n(fill_rate_breakdown('shift_fill_rate_by', 'task_type'), top_n_tasks)
         
-        fig = px.bar(
-            fr_by_flag.dropna(subset=['value']), 
-            x='fill_rate', y='variable', color='value', barmode='group', orientation='h',
-            title=title,
-            labels={'variable': 'Признак', 'fill_rate': 'Средний FR'},
-            text_auto='.1%', template='plotly_white', hover_data=['count']
-        )
-        fig.update_layout(xaxis_tickformat=".0%")
-        st.plotly_chart(fig, use_container_width=True)
-
-    # График по маркетингу
-    st.subheader("Влияние маркетинга на средний FR")
-    marketing_flags = {
-        'click_internet_adv_flg': 'Клик (Реклама)',
-        'opened_push_flg': 'Открыл Push',
-        'watched_stories_in_app_flg': 'Смотрел Stories',
-        'click_addv_communication_flg': 'Клик (Внутри Avito)',
-        'has_call_centre_communication_flg': 'Звонок из КЦ'
-    }
-    plot_fr_by_flags(filtered_users, marketing_flags, "Средний FR по маркетинговым касаниям")
-
-    # График по профилю
-    st.subheader("Влияние профиля (CV/Вакансии) на средний FR")
-    profile_flags = {
-        'success_verification_gu_flg': 'Верификация ГУ',
-        'cv_podrabotka_flg': 'Резюме (Подработка)',
-        'cv_free_grafik_flg': 'Резюме (Своб. график)',
-        'vac_podrabotka_flg': 'Отклик (Подработка)'
-    }
-    plot_fr_by_flags(filtered_users, profile_flags, "Средний FR по признакам профиля")
+                fig = px.bar(
+                    fr_by_task, x='fill_rate', y='task_type', orientation='h',
+                    title=f"Fill Rate по Топ-{top_n_tasks} типам заданий",
+                    labels={'task_type': 'Тип задания', 'fill_rate': 'Fill Rate'},
+                    text_auto='.1%', template='plotly_white', **error_bars(fr_by_task, 'fill_rate', 'x')
+                )
+                st.plotly_chart(fig, use_container_width=True)
+                download_table(view.shift_fill_rate_by('task_type'), 'fr_by_task')
+                show_pairwise_tests('shift_fill_rate_by', 'task_type', shown=fr_by_task['task_type'])
     
-    st.markdown("---")
-    st.subheader("Влияние активности на платформе на средний FR")
-    col1, col2, col3 = st.columns(3)
-
-    def create_bins(df, column, bins, labels):
-        df_copy = df.copy()
-        if column not in df_copy.columns:
-            return pd.DataFrame() # Возвращаем пустой DF
-        df_copy[f'{column}_bin'] = pd.cut(df_copy[column], bins=bins, labels=labels, right=False)
-        fr_by_bin = df_copy.groupby(f'{column}_bin')['user_avg_fr'].agg(fill_rate='mean', count='size').reset_index()
-        return fr_by_bin
-
-    with col1:
-        serp_bins = [-np.inf, 1, 5, 10, 20, np.inf]
-        serp_labels = ['0', '1-4', '5-9', '10-19', '20+']
-        fr_serp = create_bins(filtered_users, 'serp_frequency', serp_bins, serp_labels)
-        if not fr_serp.empty:
-            fig = px.bar(
-                fr_serp, x='serp_frequency_bin', y='fill_rate',
-                title="FR по serp_frequency",
-                labels={'serp_frequency_bin': 'Бакет', 'fill_rate': 'Средний FR'},
-                text_auto='.1%', template='plotly_white', hover_data=['count']
-            )
-            fig.update_layout(yaxis_tickformat=".0%")
-            st.plotly_chart(fig, use_container_width=True)
-
-    with col2:
-        item_bins = [-np.inf, 1, 5, 10, 20, np.inf]
-        item_labels = ['0', '1-4', '5-9', '10-19', '20+']
-        fr_item = create_bins(filtered_users, 'item_view_frequency', item_bins, item_labels)
-        if not fr_item.empty:
-            fig = px.bar(
-                fr_item, x='item_view_frequency_bin', y='fill_rate',
-                title="FR по item_view_frequency",
-                labels={'item_view_frequency_bin': 'Бакет', 'fill_rate': 'Средний FR'},
-                text_auto='.1%', template='plotly_white', hover_data=['count']
-            )
-            fig.update_layout(yaxis_tickformat=".0%")
-            st.plotly_chart(fig, use_container_width=True)
-            
-    with col3:
-        resp_bins = [-np.inf, 1, 5, 10, 20, 50, np.inf]
-        resp_labels = ['0', '1-4', '5-9', '10-19', '20-49', '50+']
-        fr_resp = create_bins(filtered_users, 'quantity_responses', resp_bins, resp_labels)
-        if not fr_resp.empty:
-            fig = px.bar(
-                fr_resp, x='quantity_responses_bin', y='fill_rate',
-                title="FR по quantity_responses",
-                labels={'quantity_responses_bin': 'Бакет', 'fill_rate': 'Средний FR'},
-                text_auto='.1%', template='plotly_white', hover_data=['count']
-            )
-            fig.update_layout(yaxis_tickformat=".0%")
-            st.plotly_chart(fig, use_container_width=True)
-
-
-# --- Вкладка 4: Удержание и Когорты ---
-with tab4:
-    st.header("Удержание и Когорты")
-    st.info("В этой вкладке анализируются только пользователи, у которых есть 1-я смена в выбранном диапазоне.")
+            col1, col2 = st.columns(2)
     
-    users_with_1st_shift = filtered_users.dropna(subset=['shift_booked_time_1'])
-    total_users_1st = users_with_1st_shift['user_id'].nunique()
+            # Распределения: гистограммы и box-статистики считаются на сервере (NumPy),
+            # в браузер уходят только агрегированные трассы в пределах бюджета на фигуру
+            def plot_distribution(column, x_label, title):
+                with perf.span(f"Распределение {column}", 'chart'):
+                    stats = view.distribution(column)
+                    fig, payload = fit_payload(stats, lambda reduced: distribution_figure(reduced, x_label, title))
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.caption(f"Размер данных графика: {payload / 1024:.0f} КБ")
+
+            with col1:
+                if 'price_per_hour' in engine.shift_columns:
+                    st.subheader("Распределение ставок (Успех vs. Неуспех)")
+                    plot_distribution(
+                        'price_per_hour', 'Ставка в час (руб.)',
+                        "Распределение ставок для успешных (1) и неуспешных (0) смен"
+                    )
+                else:
+                    st.warning("Колонка 'price_per_hour' отсутствует.")
+
+            with col2:
+                if 'duration' in engine.shift_columns:
+                    st.subheader("Распределение длительности (Успех vs. Неуспех)")
+                    plot_distribution('duration', 'Длительность (часы)', "Распределение длительности смен (1 vs. 0)")
+                else:
+                    st.warning("Колонка 'duration' отсутствует.")
+
+
+    # --- Вкладка 3: Профиль Работника (РАСШИРЕНА) ---
+    if tab3.open is not False:
+        with tab3, perf.span("Вкладка 3: Профиль Работника", 'tab'):
+            st.header("Анализ профиля работника")
+            st.info("`user_avg_fr` = (Успехи пользователя / Бронирования пользователя).")
     
-    if total_users_1st == 0:
-        st.warning("Нет данных для анализа удержания в выбранном диапазоне.")
-        st.stop()
-
-    # --- 1. Когортный анализ ---
-    st.subheader("Когортный анализ: возврат на 2-ю смену")
+            col1, col2 = st.columns(2)
     
-    try:
-        cohort_data = users_with_1st_shift[['user_id', 'shift_booked_time_1', 'shift_booked_time_2']].copy()
-        cohort_data = cohort_data.dropna(subset=['shift_booked_time_1'])
-        
-        cohort_data['cohort_week'] = cohort_data['shift_booked_time_1'].dt.to_period('W')
-        cohort_data['event_week'] = cohort_data['shift_booked_time_2'].dt.to_period('W')
-        
-        cohort_size = cohort_data.groupby('cohort_week')['user_id'].nunique().reset_index()
-        cohort_size.rename(columns={'user_id': 'cohort_size'}, inplace=True)
-        
-        cohort_data['week_diff'] = (cohort_data['event_week'] - cohort_data['cohort_week']).apply(lambda x: x.n if pd.notna(x) else np.nan)
-        
-        cohort_retention = cohort_data.dropna(subset=['week_diff']).groupby(['cohort_week', 'week_diff'])['user_id'].nunique().reset_index()
-        
-        cohort_analysis = pd.merge(cohort_retention, cohort_size, on='cohort_week')
-        cohort_analysis['retention'] = (cohort_analysis['user_id'] / cohort_analysis['cohort_size'])
+            with col1, perf.span("Средний FR: возраст и доход", 'chart'):
+                st.subheader("Средний FR по сегментам (Возраст/Доход)")
+                if 'age' in engine.user_columns and 'income' in engine.user_columns:
+                    fr_demo_pivot = view.demo_fill_rate_pivot()
+            
+                    fig = px.imshow(
+                        fr_demo_pivot, text_auto=".1%", aspect="auto",
+                        title="Тепловая карта: Средний FR (Возраст vs. Доход)",
+                        labels={'color': 'Avg. Fill Rate'}, template='plotly_white'
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                     st.warning("Колонки 'age' или 'income' отсутствуют.")
+
+            with col2, perf.span("Эффект опыта", 'chart'):
+                st.subheader("Эффект опыта: FR на 2-й смене")
+                fr_exp = view.experience_effect()
         
-        cohort_pivot = cohort_analysis.pivot_table(
-            index='cohort_week', columns='week_diff', values='retention'
-        )
-        # Ограничиваем вывод, чтобы не было слишком много данных
-        cohort_pivot = cohort_pivot.iloc[-15:, :12] 
-
-        fig_cohort = go.Figure(data=go.Heatmap(
-            z=cohort_pivot.values,
-            x=[f"Нед {int(c)}" for c in cohort_pivot.columns],
-            y=[str(i) for i in cohort_pivot.index],
-            colorscale='Viridis', zmin=0,
-            zmax=cohort_pivot.max().max() if not cohort_pivot.empty else 0.1,
-            text=cohort_pivot.applymap(lambda x: f"{x:.1%}" if not pd.isna(x) else ""),
-            texttemplate="%{text}", hoverongaps=False
-        ))
-        fig_cohort.update_layout(
-            title="Когорты: % пользователей, забронировавших 2-ю смену",
-            xaxis_title="Неделя с момента 1-й брони",
-            yaxis_title="Когорта (неделя 1-й брони)",
-            yaxis_autorange='reversed'
-        )
-        st.plotly_chart(fig_cohort, use_container_width=True)
-
-    except Exception as e:
-        st.warning(f"Не удалось построить когортный анализ. Возможно, не хватает данных. Ошибка: {e}")
-
-    # --- 2. Кривая удержания ---
-    st.subheader("Классическая кривая удержания")
+                if fr_exp.empty:
+                    st.warning("Недостаточно данных для анализа 'Эффекта опыта'")
+                else:
+                    fig = px.bar(
+                        fr_exp, x='job_done_1', y='job_done_2',
+                        title="FR на 2-й смене (в зависимости от 1-й)",
+                        labels={'job_done_1': 'Результат 1-й смены', 'job_done_2': 'Fill Rate на 2-й смене'},
+                        text_auto='.1%', template='plotly_white'
+                    )
+                    fig.update_layout(yaxis_tickformat=".0%")
+                    st.plotly_chart(fig, use_container_width=True)
+
+            st.subheader("Последовательности смен")
+            transitions = view.transition_matrix()
+            if transitions.empty:
+                st.warning("Недостаточно данных: в выгрузке один слот смен")
+            else:
+                col3, col4 = st.columns(2)
+
+                with col3, perf.span("Матрица переходов", 'chart'):
+                    matrix = transitions.assign(
+                        row=transitions['transition'] + ': ' + transitions['outcome']
+                    ).pivot(index='row', columns='next_outcome', values='share')
+                    matrix = matrix.reindex(columns=TRANSITION_OUTCOMES)
+                    fig = px.imshow(
+                        matrix, text_auto=".1%", aspect="auto", color_continuous_scale='Blues',
+                        title="Исход следующей смены при исходе текущей",
+                        labels={'x': 'Следующая смена', 'y': 'Переход: текущая смена', 'color': 'Доля'},
+                        template='plotly_white'
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+
+                with col4, perf.span("Дни до следующей брони", 'chart'):
+                    next_booking = view.next_booking_days()
+                    if next_booking.empty:
+                        st.warning("Нет пар смен с датами бронирования")
+                    else:
+                        gaps = next_booking.melt(
+                            id_vars=['transition', 'outcome', 'count', 'median'], value_vars=NEXT_BOOKING_LABELS,
+                            var_name='days_bin', value_name='pairs'
+                        )
+                        gaps['share'] = gaps['pairs'] / gaps['count']
+                        gaps['row'] = gaps['transition'] + ': ' + gaps['outcome']
+                        fig = px.bar(
+                            gaps, x='share', y='row', color='days_bin', orientation='h',
+                            title="Дни от брони до следующей брони",
+                            labels={'share': 'Доля пар', 'row': 'Переход: текущая смена', 'days_bin': 'Дней',
+                                    'median': 'Медиана, дн'},
+                            hover_data={'pairs': True, 'median': ':.1f'}, template='plotly_white'
+                        )
+                        fig.update_layout(xaxis_tickformat=".0%", yaxis={'autorange': 'reversed'})
+                        st.plotly_chart(fig, use_container_width=True)
+
+                with st.expander("Цепочки исходов по слотам"):
+                    st.dataframe(
+                        view.transition_paths().rename(columns={
+                            'path': 'Цепочка', 'shifts': 'Смен', 'users': 'Пользователей', 'share': 'Доля'
+                        }),
+                        column_config={'Доля': st.column_config.NumberColumn(format='percent')},
+                        hide_index=True, use_container_width=True
+                    )
+
+            st.markdown("---")
+    
+            # --- НОВЫЕ ГРАФИКИ ---
     
-    retention_data = []
-    for day in range(0, 91):
-        active_users = users_with_1st_shift[
-            (users_with_1st_shift['min_return_days'].isna()) | 
-            (users_with_1st_shift['min_return_days'] > day)
-        ].shape[0]
+            def plot_fr_by_flags(flag_cols_map, title):
+                """Вспомогательная функция для отрисовки среднего FR по флагам."""
+                with perf.span(title, 'chart'):
+                    fr_by_flag = fill_rate_breakdown('fill_rate_by_flags', flag_cols_map)
+                    if fr_by_flag.empty:
+                        st.warning(f"Нет данных для '{title}'")
+                        return
         
-        retention_percent = active_users / total_users_1st if total_users_1st > 0 else 0
-        retention_data.append({'day': day, 'retention_percent': retention_percent})
-
-    retention_df = pd.DataFrame(retention_data)
+                    fig = px.bar(
+                        fr_by_flag, 
+                        x='fill_rate', y='variable', color='value', barmode='group', orientation='h',
+                        title=title,
+                        labels={'variable': 'Признак', 'fill_rate': 'Средний FR'},
+                        text_auto='.1%', template='plotly_white', hover_data=['count'],
+                        **error_bars(fr_by_flag, 'fill_rate', 'x')
+                    )
+                    fig.update_layout(xaxis_tickformat=".0%")
+                    st.plotly_chart(fig, use_container_width=True)
+                    show_pairwise_tests('fill_rate_by_flags', flag_cols_map, label='value', within='variable')
+
+            # График по маркетингу
+            st.subheader("Влияние маркетинга на средний FR")
+            plot_fr_by_flags(MARKETING_FLAGS, "Средний FR по маркетинговым касаниям")
+
+            # График по профилю
+            st.subheader("Влияние профиля (CV/Вакансии) на средний FR")
+            plot_fr_by_flags(PROFILE_FLAGS, "Средний FR по признакам профиля")
+
+            st.subheader("Взаимодействия признаков")
+            with perf.span("Взаимодействия флагов", 'chart'):
+                interactions = view.flag_interactions(INTERACTION_FLAGS)
+                if interactions.empty:
+                    st.warning("Недостаточно флагов для анализа взаимодействий")
+                else:
+                    # Симметричная матрица: пара (A, B) показывается и в ячейке (B, A)
+                    pairs = pd.concat([
+                        interactions,
+                        interactions.rename(columns={
+                            'flag_a': 'flag_b', 'flag_b': 'flag_a', 'fr_a_only': 'fr_b_only', 'fr_b_only': 'fr_a_only'
+                        })
+                    ], ignore_index=True)
+                    flags = list(dict.fromkeys([*interactions['flag_a'], *interactions['flag_b']]))
+                    hover = ['count_both', 'fr_both', 'fr_a_only', 'fr_b_only', 'fr_neither']
+                    square = lambda col: pairs.pivot(index='flag_a', columns='flag_b', values=col).reindex(
+                        index=flags, columns=flags
+                    ).to_numpy(dtype=float)
+                    matrix = square('interaction')
+                    limit = np.nanmax(np.abs(matrix)) if np.isfinite(matrix).any() else 1
+                    fig = go.Figure(go.Heatmap(
+                        z=matrix, x=flags, y=flags, customdata=np.stack([square(col) for col in hover], axis=-1),
+                        colorscale='RdBu', zmid=0, zmin=-limit, zmax=limit,
+                        texttemplate='%{z:+.1%}', colorbar={'title': 'Эффект', 'tickformat': '+.0%'},
+                        hovertemplate=(
+                            "%{y} × %{x}<br>Эффект взаимодействия: %{z:+.2%}<br>Оба: %{customdata[1]:.1%} "
+                            "(%{customdata[0]:,.0f} польз.)<br>Только %{y}: %{customdata[2]:.1%}<br>"
+                            "Только %{x}: %{customdata[3]:.1%}<br>Ни одного: %{customdata[4]:.1%}<extra></extra>"
+                        )
+                    ))
+                    fig.update_layout(
+                        title="Эффект взаимодействия: FR(оба) − FR(только A) − FR(только B) + FR(ни одного)",
+                        template='plotly_white', height=550, yaxis={'autorange': 'reversed'}
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+
+            st.markdown("---")
+            st.subheader("Влияние активности на платформе на средний FR")
+            with st.expander("Границы бакетов активности"):
+                activity_bins = {col: custom_bins(f'bins_{col}', bins, col) for col, (bins, _) in ACTIVITY_BINS.items()}
+            col1, col2, col3 = st.columns(3)
+
+            with col1, perf.span("FR по serp_frequency", 'chart'):
+                fr_serp = fill_rate_breakdown('fill_rate_by_bins', 'serp_frequency', activity_bins['serp_frequency'])
+                if not fr_serp.empty:
+                    fig = px.bar(
+                        fr_serp, x='serp_frequency_bin', y='fill_rate',
+                        title="FR по serp_frequency",
+                        labels={'serp_frequency_bin': 'Бакет', 'fill_rate': 'Средний FR'},
+                        text_auto='.1%', template='plotly_white', hover_data=['count'], **error_bars(fr_serp, 'fill_rate')
+                    )
+                    fig.update_layout(yaxis_tickformat=".0%")
+                    st.plotly_chart(fig, use_container_width=True)
+                    show_pairwise_tests('fill_rate_by_bins', 'serp_frequency', activity_bins['serp_frequency'])
+
+            with col2, perf.span("FR по item_view_frequency", 'chart'):
+                fr_item = fill_rate_breakdown('fill_rate_by_bins', 'item_view_frequency', activity_bins['item_view_frequency'])
+                if not fr_item.empty:
+                    fig = px.bar(
+                        fr_item, x='item_view_frequency_bin', y='fill_rate',
+                        title="FR по item_view_frequency",
+                        labels={'item_view_frequency_bin': 'Бакет', 'fill_rate': 'Средний FR'},
+                        text_auto='.1%', template='plotly_white', hover_data=['count'], **error_bars(fr_item, 'fill_rate')
+                    )
+                    fig.update_layout(yaxis_tickformat=".0%")
+                    st.plotly_chart(fig, use_container_width=True)
+                    show_pairwise_tests('fill_rate_by_bins', 'item_view_frequency', activity_bins['item_view_frequency'])
+            
+            with col3, perf.span("FR по quantity_responses", 'chart'):
+                fr_resp = fill_rate_breakdown('fill_rate_by_bins', 'quantity_responses', activity_bins['quantity_responses'])
+                if not fr_resp.empty:
+                    fig = px.bar(
+                        fr_resp, x='quantity_responses_bin', y='fill_rate',
+                        title="FR по quantity_responses",
+                        labels={'quantity_responses_bin': 'Бакет', 'fill_rate': 'Средний FR'},
+                        text_auto='.1%', template='plotly_white', hover_data=['count'], **error_bars(fr_resp, 'fill_rate')
+                    )
+                    fig.update_layout(yaxis_tickformat=".0%")
+                    st.plotly_chart(fig, use_container_width=True)
+                    show_pairwise_tests('fill_rate_by_bins', 'quantity_responses', activity_bins['quantity_responses'])
+
+            st.markdown("---")
+            st.subheader("Драйверы Fill Rate: многофакторная модель")
+            # Модель обучается в пуле процессов и хранится в кэше агрегатов - вкладка не ждёт обучения
+            with perf.span("Модель драйверов FR", 'chart'):
+                drivers, training = get_driver_models().result(view, DRIVER_FACTORS)
+                if drivers is None and training.done():
+                    st.warning(f"Не удалось обучить модель драйверов: {training.exception()}")
+                elif drivers is None:
+                    st.info("Модель обучается в фоне на случайных отфильтрованных сменах - результат появится автоматически.")
+                    st.fragment(rerun_when_done, run_every=2)(training, "⏳ Обучение модели драйверов...")
+                else:
+                    model_metrics = drivers['metrics']
+                    st.caption(
+                        f"Логистическая регрессия job_done по {model_metrics['rows']:,} сменам: все факторы вместе, "
+                        f"числовые - квантильными корзинами. На отложенных {model_metrics['holdout_rows']:,} сменах "
+                        f"AUC {model_metrics['auc']:.3f}, псевдо-R² {model_metrics['pseudo_r2']:.1%}. "
+                        "Важность - рост log loss, если перемешать значения фактора между сменами."
+                    )
+                    importance = drivers['importance']
+                    fig = px.bar(
+                        importance, x='share', y='label', orientation='h',
+                        title="Важность факторов (доля суммарного роста log loss)",
+                        labels={'share': 'Доля важности', 'label': 'Фактор', 'importance': 'Рост log loss', 'levels': 'Уровней'},
+                        text_auto='.0%', template='plotly_white', hover_data=['importance', 'levels']
+                    )
+                    fig.update_layout(
+                        yaxis={'categoryorder': 'total ascending'}, xaxis_tickformat='.0%', height=max(400, 28 * len(importance))
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+
+                    # Частичная зависимость самых важных факторов: модель (при прочих равных) рядом с сырым FR уровня
+                    top_labels = importance['label'].head(6).tolist()
+                    dependence = drivers['partial_dependence']
+                    dependence = dependence[dependence['label'].isin(top_labels)].melt(
+                        id_vars=['label', 'level', 'rows'], value_vars=['fill_rate', 'observed_fr'],
+                        var_name='series', value_name='value'
+                    ).replace({'series': {'fill_rate': 'Модель (при прочих равных)', 'observed_fr': 'Наблюдаемый FR'}})
+                    fig = px.line(
+                        dependence, x='level', y='value', color='series', facet_col='label', facet_col_wrap=3,
+                        category_orders={'label': top_labels}, markers=True, template='plotly_white',
+                        title="Частичная зависимость FR от самых важных факторов",
+                        labels={'level': '', 'value': 'Fill Rate', 'series': '', 'rows': 'Смен'}, hover_data=['rows']
+                    )
+                    fig.for_each_annotation(lambda annotation: annotation.update(text=annotation.text.split('=', 1)[-1]))
+                    fig.update_xaxes(matches=None, showticklabels=True)
+                    fig.update_yaxes(tickformat='.0%')
+                    fig.update_layout(height=650)
+                    st.plotly_chart(fig, use_container_width=True)
+
+                    with st.expander("Таблицы модели: важность и частичная зависимость всех факторов"):
+                        st.dataframe(importance, hide_index=True, use_container_width=True)
+                        st.dataframe(drivers['partial_dependence'], hide_index=True, use_container_width=True)
+
+
+    # --- Вкладка 4: Удержание и Когорты ---
+    if tab4.open is not False:
+        with tab4, perf.span("Вкладка 4: Удержание и Когорты", 'tab'):
+            st.header("Удержание и Когорты")
+            st.info("В этой вкладке анализируются только пользователи, у которых есть 1-я смена в выбранном диапазоне.")
     
-    fig_retention = px.line(
-        retention_df, x='day', y='retention_percent',
-        title="Кривая удержания (Survival Curve)",
-        labels={'day': 'Дни после 1-й брони', 'retention_percent': '% оставшихся пользователей'},
-        template='plotly_white'
-    )
-    fig_retention.update_layout(
-        yaxis_tickformat=".0%",
-        annotations=[dict(
-            x=0, y=1, xref='paper', yref='y',
-            text=f"100% (n={total_users_1st})", showarrow=False, xanchor='left'
-        )]
+            total_users_1st = view.total_users_1st()
+    
+            if total_users_1st == 0:
+                st.warning("Нет данных для анализа удержания в выбранном диапазоне.")
+            else:
+                # --- 1. Когортный анализ ---
+                st.subheader("Когортный анализ: возврат на 2-ю смену")
+    
+                with perf.span("Когортный анализ", 'chart'):
+                    try:
+                        cohort_pivot = view.cohort_retention()
+
+                        fig_cohort = go.Figure(data=go.Heatmap(
+                            z=cohort_pivot.values,
+                            x=[f"Нед {int(c)}" for c in cohort_pivot.columns],
+                            y=[str(i) for i in cohort_pivot.index],
+                            colorscale='Viridis', zmin=0,
+                            zmax=np.nanmax(cohort_pivot.values) if not cohort_pivot.empty else 0.1,
+                            text=format_percent(cohort_pivot.values),
+                            texttemplate="%{text}", hoverongaps=False
+                        ))
+                        fig_cohort.update_layout(
+                            title="Когорты: % пользователей, забронировавших 2-ю смену",
+                            xaxis_title="Неделя с момента 1-й брони",
+                            yaxis_title="Когорта (неделя 1-й брони)",
+                            yaxis_autorange='reversed'
+                        )
+                        st.plotly_chart(fig_cohort, use_container_width=True)
+                        download_table(cohort_pivot, 'cohort_pivot')
+
+                    except Exception as e:
+                        st.warning(f"Не удалось построить когортный анализ. Возможно, не хватает данных. Ошибка: {e}")
+
+                # --- 2. Кривая удержания ---
+                st.subheader("Классическая кривая удержания")
+                retention_horizon = st.slider(
+                    "Горизонт кривой (дней после 1-й брони):", min_value=30, max_value=365, step=15, key='retention_horizon'
+                )
+    
+                with perf.span("Кривая удержания", 'chart'):
+                    retention_df = view.survival_curve(retention_horizon)
+    
+                    fig_retention = px.line(
+                        retention_df, x='day', y='retention_percent',
+                        title="Кривая удержания (Survival Curve)",
+                        labels={'day': 'Дни после 1-й брони', 'retention_percent': '% оставшихся пользователей'},
+                        template='plotly_white'
+                    )
+                    fig_retention.update_layout(
+                        yaxis_tickformat=".0%",
+                        annotations=[dict(
+                            x=0, y=1, xref='paper', yref='y',
+                            text=f"100% (n={total_users_1st})", showarrow=False, xanchor='left'
+                        )]
+                    )
+                    fig_retention.update_traces(mode='lines')
+                    st.plotly_chart(fig_retention, use_container_width=True)
+
+                st.caption("Кривая показывает, какой процент пользователей еще *не* забронировал вторую (или третью) смену к N-му дню.")
+
+# --- 7. Статистика кэша агрегатов ---
+cache_stats = aggregate_cache.stats()
+st.sidebar.caption(
+    f"Кэш агрегатов: попаданий {cache_stats['hits']}, промахов {cache_stats['misses']}, "
+    f"записей {cache_stats['entries']} ({cache_stats['bytes'] / 2**20:.1f} МБ)"
+)
+if warmup_job is not None:
+    # Фрагмент обновляет только индикатор, пока прогрев не закончится
+    with st.sidebar:
+        st.fragment(warmup_progress, run_every=None if warmup_job.finished else 2)(warmup_job)
+if BACKEND == 'pandas':
+    registry_stats = dataset_registry.stats()
+    st.sidebar.caption(
+        f"Общий реестр датасетов: в памяти {registry_stats['entries']} "
+        f"({registry_stats['bytes'] / 2**20:.0f} МБ), сессий {registry_stats['sessions']}"
     )
-    fig_retention.update_traces(mode='lines')
-    st.plotly_chart(fig_retention, use_container_width=True)
-
-    st.caption("Кривая показывает, какой процент пользователей еще *не* забронировал вторую (или третью) смену к N-му дню.")
-
-
-
-
 
+# --- 8. Панель производительности ---
+perf_tracer.meta.update(dataset_key=dataset_meta['dataset_key'], backend=BACKEND, aggregate_cache=cache_stats)
+perf_tracer.finish()
+if st.sidebar.toggle("⏱ Панель производительности", key='perf_panel',
+                     help="Время и изменение памяти (RSS) каждого этапа, попадания в кэши."):
+    with st.sidebar.expander(f"⏱ {perf_tracer.label}: {perf_tracer.total_ms:,.0f} мс", expanded=True):
+        st.dataframe(perf_tracer.table(), hide_index=True, use_container_width=True)
+        perf_traces = st.session_state['perf_traces']
+        st.caption(f"В трассировке последних перезапусков: {len(perf_traces)}")
+        st.download_button(
+            "Скачать трассировку (JSON)", perf.export_json(perf_traces),
+            file_name='fr_dashboard_trace.json', mime='application/json', on_click='ignore'
+        )
@@ -0,0 +1,294 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+except ImportError:  # Хранилище просто отключается, если pyarrow не установлен
+    pa = None
+
+# Каталог и лимит размера локального хранилища обработанных датасетов
+DEFAULT_STORE_DIR = Path(os.environ.get('FR_DASHBOARD_STORE_DIR', '~/.cache/fr_dashboard/datasets')).expanduser()
+DEFAULT_MAX_BYTES = int(float(os.environ.get('FR_DASHBOARD_STORE_MAX_MB', 4096)) * 1024 * 1024)
+# Сколько датасетов (и размеров выборки) держат кэши ресурсов дашборда: индекс фильтров, куб, каталог и т.п.
+MAX_CACHED_DATASETS = int(os.environ.get('FR_DASHBOARD_MAX_CACHED_DATASETS', 4))
+
+_HASH_CHUNK = 8 * 1024 * 1024
+_TABLES = ('users', 'shifts')
+
+
+def content_hash(file_obj):
+    """Считает хэш содержимого файла (UploadedFile/файлового объекта) по частям."""
+    hasher = hashlib.blake2b(digest_size=20)
+    file_obj.seek(0)
+    while True:
+        chunk = file_obj.read(_HASH_CHUNK)
+        if not chunk:
+            break
+        hasher.update(chunk)
+    file_obj.seek(0)
+    return hasher.hexdigest()
+
+
+def file_signature(path):
+    """Быстрый ключ локального файла по пути, размеру и времени изменения (без чтения содержимого)."""
+    stat = os.stat(path)
+    payload = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+
+# Хэши содержимого локальных файлов по их сигнатуре: файл перечитывается, только если изменился
+_FILE_KEYS = {}
+_FILE_KEYS_LOCK = threading.Lock()
+
+
+def file_key(path, memo_dir=None):
+    """Ключ локального файла - хэш содержимого, как у загруженного файла (content_hash).
+
+    Хэш запоминается по file_signature в процессе и в каталоге memo_dir (по умолчанию - рядом
+    с хранилищем), поэтому файл читается целиком один раз на версию. Так ключ датасета
+    одинаков у дашборда и report.py и не зависит от того, загружен файл или указан путём.
+    """
+    signature = file_signature(path)
+    with _FILE_KEYS_LOCK:
+        key = _FILE_KEYS.get(signature)
+    if key is not None:
+        return key
+    memo = Path(memo_dir if memo_dir is not None else DEFAULT_STORE_DIR / '.file-keys') / signature
+    try:
+        key = memo.read_text(encoding='utf-8').strip()
+    except OSError:
+        with open(path, 'rb') as file_obj:
+            key = content_hash(file_obj)
+        try:
+            memo.parent.mkdir(parents=True, exist_ok=True)
+            memo.write_text(key, encoding='utf-8')
+        except OSError:
+            pass
+    with _FILE_KEYS_LOCK:
+        _FILE_KEYS[signature] = key
+    return key
+
+
+def combine_keys(keys):
+    """Один ключ для упорядоченного набора файлов (партиций)."""
+    keys = list(keys)
+    if len(keys) == 1:
+        return keys[0]
+    return hashlib.blake2b('|'.join(keys).encode('utf-8'), digest_size=20).hexdigest()
+
+
+class DatasetStore:
+    """Дисковое хранилище обработанных df_users / long_shifts_df в формате Arrow IPC.
+
+    Каждая запись - каталог `<key>/` с файлами `users.arrow`, `shifts.arrow` и `meta.json`.
+    Файлы читаются через memory map, старые записи вытесняются по LRU при превышении `max_bytes`.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self):
+        return pa is not None
+
+    def _entry(self, key):
+        return self.root / key
+
+    def get(self, key):
+        """Возвращает (df_users, long_shifts_df, meta) или None, если записи нет."""
+        entry = self._entry(key)
+        if not self.enabled or not (entry / 'meta.json').exists():
+            return None
+        try:
+            frames = [self._read_table(entry / f'{name}.arrow') for name in _TABLES]
+            meta = json.loads((entry / 'meta.json').read_text(encoding='utf-8'))
+        except (OSError, ValueError, pa.ArrowException):
+            # Повреждённая/недописанная запись - удаляем и считаем промахом
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # Время последнего обращения для LRU (без гарантий: запись могла вытеснить параллельная сессия)
+        try:
+            os.utime(entry / 'meta.json')
+        except OSError:
+            pass
+        return frames[0], frames[1], meta
+
+    def put(self, key, df_users, long_shifts_df, meta=None):
+        """Атомарно сохраняет обработанные таблицы и вытесняет старые записи."""
+        if not self.enabled:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = self._entry(key)
+        tmp_dir = self.root / f'.tmp-{key}-{os.getpid()}-{time.monotonic_ns()}'
+        tmp_dir.mkdir()
+        try:
+            for name, df in zip(_TABLES, (df_users, long_shifts_df)):
+                self._write_table(tmp_dir / f'{name}.arrow', df)
+            (tmp_dir / 'meta.json').write_text(json.dumps(meta or {}, ensure_ascii=False, default=str), encoding='utf-8')
+            try:
+                os.replace(tmp_dir, entry)
+            except OSError:
+                # Запись уже сохранена параллельной сессией
+                pass
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Удаляет наименее давно использованные записи, пока хранилище не влезет в лимит."""
+        entries = []
+        for entry in self.root.iterdir():
+            if entry.name.startswith('.') or not entry.is_dir():
+                continue
+            try:
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                last_access = (entry / 'meta.json').stat().st_mtime
+            except OSError:
+                continue
+            entries.append((last_access, size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    @staticmethod
+    def _write_table(path, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    @staticmethod
+    def _read_table(path):
+        # Несжатый Arrow IPC читается через memory map без разбора/копирования буферов
+        source = pa.memory_map(str(path), 'r')
+        table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
+
+
+# --- Общий реестр датасетов процесса ---
+
+# Через сколько секунд без перезапусков сессия считается закрытой, если её жизнь нельзя проверить
+DEFAULT_SESSION_TTL = int(os.environ.get('FR_DASHBOARD_SESSION_TTL', 1800))
+
+
+def frame_bytes(df):
+    """Размер буферов таблицы без учёта строк-объектов (memory_usage без deep)."""
+    return int(df.memory_usage(index=True, deep=False).sum()) if df is not None else 0
+
+
+class DatasetRegistry:
+    """Одна копия обработанных таблиц на процесс для всех сессий дашборда.
+
+    Запись - (df_users, long_shifts_df, meta) по ключу датасета; после загрузки таблицы
+    перечитываются из DatasetStore через memory map, так что буферы Arrow - страницы
+    файлового кэша ОС, общие для всех, кто их читает. Таблицы общие: их нельзя менять
+    на месте (при copy-on-write pandas производные таблицы и так не пишут в исходные).
+
+    Сессия отмечает используемые ключи при каждом перезапуске; запись вытесняется, когда
+    на неё не ссылается ни одна живая сессия. Сессия жива, пока is_session_alive(id) или,
+    если проверки нет, пока с её последнего перезапуска прошло меньше session_ttl секунд.
+    """
+
+    def __init__(self, store=None, session_ttl=DEFAULT_SESSION_TTL, is_session_alive=None):
+        self.store = store
+        self.session_ttl = session_ttl
+        self.is_session_alive = is_session_alive
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._loading = {}
+        self._sessions = {}
+
+    def acquire(self, session_id, key, load):
+        """Таблицы датасета key: из реестра или через load() (один раз на процесс).
+
+        load() возвращает (df_users, long_shifts_df, meta) или None (тогда ничего не
+        запоминается); meta['from_cache'] - таблицы уже прочитаны из хранилища.
+        Возвращает (запись или None, была ли запись уже в реестре).
+        """
+        with self._lock:
+            self._touch(session_id).add(key)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, True
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Параллельные сессии с тем же ключом ждут одну загрузку
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry, True
+            try:
+                loaded = load()
+                if loaded is not None:
+                    entry = self._shared(key, loaded)
+                    with self._lock:
+                        self._entries[key] = entry
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return entry, False
+
+    def _shared(self, key, loaded):
+        """Запись реестра: таблицы из хранилища (memory map), если load() сохранил их туда, а не прочитал оттуда."""
+        df_users, long_shifts_df, meta = loaded
+        if not meta.get('from_cache') and self.store is not None and self.store.enabled:
+            stored = self.store.get(key)
+            if stored is not None:
+                df_users, long_shifts_df = stored[0], stored[1]
+        return df_users, long_shifts_df, meta
+
+    def retain(self, session_id, keys):
+        """Оставляет за сессией только keys и вытесняет записи без живых пользователей."""
+        with self._lock:
+            self._touch(session_id).intersection_update(keys)
+        self.evict()
+
+    def release(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self.evict()
+
+    def _touch(self, session_id):
+        keys, _ = self._sessions.get(session_id, (set(), None))
+        self._sessions[session_id] = (keys, time.monotonic())
+        return keys
+
+    def _alive(self, session_id, last_seen):
+        if self.is_session_alive is not None:
+            return self.is_session_alive(session_id)
+        return time.monotonic() - last_seen < self.session_ttl
+
+    def evict(self):
+        """Забывает закрытые сессии и записи, на которые никто не ссылается. Возвращает число вытесненных."""
+        with self._lock:
+            for session_id, (_, last_seen) in list(self._sessions.items()):
+                if not self._alive(session_id, last_seen):
+                    del self._sessions[session_id]
+            used = set().union(*(keys for keys, _ in self._sessions.values()))
+            unused = [key for key in self._entries if key not in used]
+            for key in unused:
+                del self._entries[key]
+        return len(unused)
+
+    def stats(self):
+        with self._lock:
+            refs = {key: sum(key in keys for keys, _ in self._sessions.values()) for key in self._entries}
+            return {
+                'entries': len(self._entries),
+                'sessions': len(self._sessions),
+                'bytes': sum(frame_bytes(users) + frame_bytes(shifts) for users, shifts, _ in self._entries.values()),
+                'refs': refs,
+            }
@@ -0,0 +1,267 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from bucketizer import NO_BUCKET, bucket_codes
+from filter_index import codes_and_values
+from ingest import submit_to_pool
+
+# Смен в обучающей выборке модели (случайные отфильтрованные смены)
+DEFAULT_MAX_ROWS = int(os.environ.get('FR_DASHBOARD_MODEL_ROWS', 100_000))
+# Процессов обучения (FR_DASHBOARD_MODEL_WORKERS)
+DEFAULT_WORKERS = int(os.environ.get('FR_DASHBOARD_MODEL_WORKERS', 1))
+# Числовые факторы - квантильные корзины, категориальные - не больше MAX_LEVELS уровней (остальные - "прочие")
+MAX_BINS = 8
+MAX_LEVELS = 30
+MISSING_LABEL = 'нет данных'
+OTHER_LABEL = 'прочие'
+# L2-штраф коэффициентов, итерации Ньютона, доля отложенной выборки, повторы перестановок
+DEFAULT_L2 = 1.0
+MAX_ITER = 25
+HOLDOUT_SHARE = 0.2
+PERMUTATION_REPEATS = 3
+# Версия модели в ключе кэша: результаты другой версии пересчитываются
+MODEL_VERSION = 1
+# Сколько задач обучения помнить во всех сессиях
+MAX_JOBS = 32
+
+
+# --- Кодирование факторов ---
+
+def _interval_labels(bins):
+    labels = []
+    for low, high in zip(bins[:-1], bins[1:]):
+        if not np.isfinite(low):
+            labels.append(f'<{high:g}')
+        elif not np.isfinite(high):
+            labels.append(f'{low:g}+')
+        else:
+            labels.append(f'{low:g}-{high:g}')
+    return labels
+
+
+def encode_factor(series, max_bins=MAX_BINS, max_levels=MAX_LEVELS):
+    """Коды уровней фактора (0..k-1) и их метки.
+
+    Числа с большим числом значений - квантильные корзины [a, b), остальные значения -
+    уровни как есть; редкие уровни сверх max_levels объединяются в "прочие",
+    пропуск - отдельный уровень.
+    """
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        values = series.to_numpy(dtype='float64', na_value=np.nan)
+        present = values[~np.isnan(values)]
+        distinct = np.unique(present)
+        if len(distinct) > max_bins:
+            inner = np.unique(np.quantile(present, np.linspace(0, 1, max_bins + 1)[1:-1]))
+            bins = [-np.inf, *inner, np.inf]
+            codes = bucket_codes(values, bins).astype('int64')
+            codes[codes == NO_BUCKET] = -1
+            labels = _interval_labels(bins)
+        else:
+            codes = np.searchsorted(distinct, values)
+            codes[np.isnan(values)] = -1
+            labels = [f'{value:g}' for value in distinct]
+    else:
+        codes, values = codes_and_values(series)
+        codes = np.asarray(codes, dtype='int64')
+        labels = [str(value) for value in values]
+
+    # Только встречающиеся уровни; при избытке - самые частые и "прочие"
+    counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+    kept = np.flatnonzero(counts)
+    if len(kept) > max_levels:
+        kept = np.sort(kept[np.argsort(-counts[kept], kind='stable')[:max_levels - 1]])
+    # Последний элемент remap - для кода -1 (пропуск): remap[-1] остаётся -1
+    remap = np.full(len(labels) + 1, -1, dtype='int64')
+    remap[kept] = np.arange(len(kept))
+    labels = [labels[i] for i in kept]
+    if len(kept) < len(np.flatnonzero(counts)):
+        remap[:-1][(counts > 0) & (remap[:-1] < 0)] = len(labels)
+        labels.append(OTHER_LABEL)
+    codes = remap[codes]
+    if (codes < 0).any():
+        codes[codes < 0] = len(labels)
+        labels.append(MISSING_LABEL)
+    return codes, labels
+
+
+# --- Модель ---
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -35, 35)))
+
+
+def _log_loss(y, p):
+    p = np.clip(p, 1e-12, 1 - 1e-12)
+    return float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p)))
+
+
+def _auc(y, p):
+    """Площадь под ROC-кривой через ранги (NaN, если все исходы одинаковые)."""
+    positives = int(y.sum())
+    negatives = len(y) - positives
+    if not positives or not negatives:
+        return np.nan
+    ranks = pd.Series(p).rank().to_numpy()
+    return float((ranks[y == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def fit_logistic(codes, sizes, y, l2=DEFAULT_L2, max_iter=MAX_ITER, tol=1e-6):
+    """Логистическая регрессия на one-hot уровнях факторов методом Ньютона с L2-штрафом.
+
+    codes - (строки x факторы) коды уровней, sizes - число уровней факторов. Штраф делает
+    модель определённой без опорного уровня. Возвращает (свободный член, [коэффициенты уровней фактора]).
+    """
+    offsets = np.r_[0, np.cumsum(sizes)[:-1]].astype('int64') + 1
+    X = np.zeros((len(y), 1 + int(np.sum(sizes))), dtype='float32')
+    X[:, 0] = 1
+    rows = np.arange(len(y))
+    for j, offset in enumerate(offsets):
+        X[rows, offset + codes[:, j]] = 1
+
+    beta = np.zeros(X.shape[1])
+    rate = np.clip(y.mean(), 1e-6, 1 - 1e-6)
+    beta[0] = np.log(rate / (1 - rate))
+    penalty = np.full(X.shape[1], float(l2))
+    penalty[0] = 0
+    for _ in range(max_iter):
+        p = _sigmoid(X @ beta.astype('float32'))
+        gradient = X.T @ (y - p).astype('float32') - penalty * beta
+        hessian = (X * (p * (1 - p)).astype('float32')[:, None]).T @ X + np.diag(penalty)
+        step = np.linalg.solve(hessian.astype('float64'), gradient.astype('float64'))
+        beta += step
+        if np.abs(step).max() < tol:
+            break
+    return beta[0], [beta[offset:offset + size] for offset, size in zip(offsets, sizes)]
+
+
+def train_driver_model(frame, factors, seed=0):
+    """Модель драйверов job_done по факторам frame - функция верхнего уровня для пула процессов.
+
+    factors - {колонка: подпись}. Возвращает {'metrics': ..., 'importance': ..., 'partial_dependence': ...}:
+    важность - рост log loss на отложенной выборке при перестановке значений фактора,
+    частичная зависимость - средняя предсказанная вероятность при уровне фактора у всех смен
+    отложенной выборки (рядом - наблюдаемый FR уровня в данных).
+    """
+    frame = frame[frame['job_done'].notna()]
+    y = frame['job_done'].to_numpy(dtype='float64')
+    encoded = {}
+    for col in factors:
+        if col in frame.columns:
+            codes, labels = encode_factor(frame[col])
+            if len(labels) > 1:
+                encoded[col] = (codes, labels)
+    columns = list(encoded)
+    if not columns or len(y) < 50 or y.min() == y.max():
+        raise ValueError("Недостаточно данных для модели: нужны хотя бы 50 смен с обоими исходами и различающиеся факторы")
+
+    codes = np.column_stack([encoded[col][0] for col in columns])
+    sizes = [len(encoded[col][1]) for col in columns]
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(y))
+    holdout_size = max(1, int(len(y) * HOLDOUT_SHARE))
+    train, holdout = order[holdout_size:], order[:holdout_size]
+    intercept, coefs = fit_logistic(codes[train], sizes, y[train])
+
+    # Вклады факторов в логит отложенных смен: перестановка и частичная зависимость меняют один столбец
+    contributions = np.column_stack([coefs[j][codes[holdout, j]] for j in range(len(columns))])
+    logit = intercept + contributions.sum(axis=1)
+    y_holdout = y[holdout]
+    base_loss = _log_loss(y_holdout, _sigmoid(logit))
+    rate = y[train].mean()
+    null_loss = _log_loss(y_holdout, np.full(len(y_holdout), rate))
+
+    importance, dependence = [], []
+    for j, col in enumerate(columns):
+        losses = []
+        for _ in range(PERMUTATION_REPEATS):
+            permuted = logit - contributions[:, j] + contributions[rng.permutation(len(holdout)), j]
+            losses.append(_log_loss(y_holdout, _sigmoid(permuted)))
+        importance.append({
+            'factor': col, 'label': factors[col], 'importance': np.mean(losses) - base_loss, 'levels': sizes[j],
+        })
+
+        level_rows = np.bincount(codes[:, j], minlength=sizes[j])
+        level_done = np.bincount(codes[:, j], weights=y, minlength=sizes[j])
+        curve = _sigmoid((logit - contributions[:, j])[:, None] + coefs[j][None, :]).mean(axis=0)
+        for level, label in enumerate(encoded[col][1]):
+            dependence.append({
+                'factor': col, 'label': factors[col], 'level': label, 'order': level,
+                'fill_rate': curve[level], 'observed_fr': level_done[level] / level_rows[level] if level_rows[level] else np.nan,
+                'rows': int(level_rows[level]),
+            })
+
+    importance = pd.DataFrame(importance)
+    positive = importance['importance'].clip(lower=0)
+    importance['share'] = positive / positive.sum() if positive.sum() > 0 else 0.0
+    metrics = {
+        'rows': len(y), 'train_rows': len(train), 'holdout_rows': len(holdout), 'base_rate': float(rate),
+        'log_loss': base_loss, 'null_log_loss': null_loss, 'pseudo_r2': 1 - base_loss / null_loss if null_loss else np.nan,
+        'auc': _auc(y_holdout, _sigmoid(logit)),
+    }
+    return {
+        'metrics': metrics,
+        'importance': importance.sort_values('importance', ascending=False, ignore_index=True),
+        'partial_dependence': pd.DataFrame(dependence),
+    }
+
+
+# --- Фоновое обучение ---
+
+def _broken(future):
+    """Задача упала вместе с процессом пула (например, по памяти) - её можно отправить заново."""
+    return future.done() and isinstance(future.exception(), BrokenProcessPool)
+
+
+class DriverModels:
+    """Фоновое обучение модели драйверов FR в общем пуле процессов (ingest.submit_to_pool).
+
+    Готовые результаты лежат в кэше агрегатов движка под ключом состояния фильтров, поэтому
+    вкладка никогда не ждёт обучения: без результата она запускает задачу и показывает статус.
+    Одно состояние фильтров обучается один раз на все сессии.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS):
+        self.max_workers = max_workers
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def result(self, view, factors, max_rows=DEFAULT_MAX_ROWS, seed=0):
+        """(результат или None, задача обучения или None) для состояния фильтров view.
+
+        Если результата нет в кэше, обучение на до max_rows случайных отфильтрованных сменах
+        запускается в фоне; упавшая задача возвращается как есть (ошибку показывает вызывающий),
+        кроме упавшей вместе с процессом пула - она запускается заново (сломанный пул заменяет submit_to_pool).
+        """
+        key = (view.state_key, 'drivers', MODEL_VERSION, tuple(factors), max_rows, seed)
+        cache = view.engine.cache
+        result = cache.get(key)
+        if result is not None:
+            return result, None
+
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is not None and _broken(future):
+                del self._jobs[key]
+                future = None
+        if future is None:
+            frame = view.driver_frame(list(factors), max_rows, seed)
+            with self._lock:
+                future = self._jobs.get(key)
+                if future is None:
+                    future = self._jobs[key] = submit_to_pool(
+                        'drivers', self.max_workers, train_driver_model, frame, factors, seed
+                    )
+                    while len(self._jobs) > MAX_JOBS:
+                        self._jobs.popitem(last=False)
+
+        if future.done() and future.exception() is None:
+            cache.put(key, future.result())
+            with self._lock:
+                self._jobs.pop(key, None)
+            return future.result(), None
+        return None, future
@@ -0,0 +1,655 @@
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import perf
+from aggregates import (
+    AggregateCache, cohort_retention, demo_fill_rate_pivot, experience_effect, fill_rate_by,
+    fill_rate_by_bins, fill_rate_by_duration, fill_rate_by_flags, fill_rate_by_shift_number,
+    filter_state_key, flag_combinations, flag_interactions, next_booking_table, path_table, shift_transitions,
+    survival_curve, transition_table, weekly_fill_rate
+)
+from bucketizer import Bucketizer, bin_labels
+from chart_data import distribution_stats
+from cube import FillRateCube, select_user_dims
+from dataset_store import combine_keys
+from export import EXPORT_CHUNK_ROWS, export_frame
+from filter_index import FilterIndex, FilteredData
+from ingest import PIPELINE_VERSION
+from sampling import estimate_totals, stratified_sample
+from stats import DEFAULT_CONFIDENCE, fill_rate_intervals, fill_rate_tests
+
+# --- Параметры вкладок (общие для дашборда и пакетных отчётов) ---
+
+# Колонки, по которым строятся фильтры боковой панели
+USER_FILTER_COLS = [
+    'gender', 'age', 'income', 'platform', 'region',
+    'success_verification_gu_flg', 'cv_podrabotka_flg', 'cv_free_grafik_flg', 'vac_podrabotka_flg'
+]
+SHIFT_FILTER_COLS = ['shift_region', 'task_group']
+USER_RANGE_COLS = ['quantity_responses']
+# Колонки, значения которых каталог метаданных хранит всегда (build_catalog keep_values)
+FILTER_VALUE_COLS = {'users': USER_FILTER_COLS, 'shifts': SHIFT_FILTER_COLS}
+
+# Разрезы Fill Rate по сменам: колонка -> имя агрегата
+SHIFT_BREAKDOWNS = {'shift_region': 'fr_by_region', 'task_group': 'fr_by_group', 'task_type': 'fr_by_task'}
+
+DURATION_BINS = [0, 2, 4, 6, 8, 10, 12, 24]
+DURATION_LABELS = ['0-2ч', '2-4ч', '4-6ч', '6-8ч', '8-10ч', '10-12ч', '12+ч']
+
+# Распределения вкладки 2 (успешные vs. неуспешные смены)
+DISTRIBUTION_COLS = ['price_per_hour', 'duration']
+
+MARKETING_FLAGS = {
+    'click_internet_adv_flg': 'Клик (Реклама)',
+    'opened_push_flg': 'Открыл Push',
+    'watched_stories_in_app_flg': 'Смотрел Stories',
+    'click_addv_communication_flg': 'Клик (Внутри Avito)',
+    'has_call_centre_communication_flg': 'Звонок из КЦ'
+}
+PROFILE_FLAGS = {
+    'success_verification_gu_flg': 'Верификация ГУ',
+    'cv_podrabotka_flg': 'Резюме (Подработка)',
+    'cv_free_grafik_flg': 'Резюме (Своб. график)',
+    'vac_podrabotka_flg': 'Отклик (Подработка)'
+}
+
+# Взаимодействия флагов (тепловая карта вкладки 3): маркетинговые и профильные вместе
+INTERACTION_FLAGS = {**MARKETING_FLAGS, **PROFILE_FLAGS}
+
+# Факторы модели драйверов Fill Rate (вкладка 3): колонка смены или её пользователя -> подпись
+DRIVER_FACTORS = {
+    'shift_number': 'Номер смены', 'duration': 'Длительность смены', 'price_per_hour': 'Ставка в час',
+    'task_group': 'Группа заданий', 'task_type': 'Тип задания', 'shift_region': 'Регион смены',
+    'age': 'Возраст', 'income': 'Доход', 'gender': 'Пол', 'platform': 'Платформа',
+    'serp_frequency': 'Поиски (serp_frequency)', 'item_view_frequency': 'Просмотры (item_view_frequency)',
+    'quantity_responses': 'Отклики (quantity_responses)',
+    **INTERACTION_FLAGS,
+}
+
+# Бакеты активности на платформе: колонка -> (границы, метки)
+ACTIVITY_BINS = {
+    'serp_frequency': ([-np.inf, 1, 5, 10, 20, np.inf], ['0', '1-4', '5-9', '10-19', '20+']),
+    'item_view_frequency': ([-np.inf, 1, 5, 10, 20, np.inf], ['0', '1-4', '5-9', '10-19', '20+']),
+    'quantity_responses': ([-np.inf, 1, 5, 10, 20, 50, np.inf], ['0', '1-4', '5-9', '10-19', '20-49', '50+']),
+}
+
+# Дни от брони смены k до брони смены k+1 (вкладка 3)
+NEXT_BOOKING_BINS = [0, 1, 3, 7, 14, 30, 60, 90, np.inf]
+NEXT_BOOKING_LABELS = ['<1 дн', '1-2 дн', '3-6 дн', '7-13 дн', '14-29 дн', '30-59 дн', '60-89 дн', '90+ дн']
+
+
+
+def bins_and_labels(default, bins=None):
+    """(границы, метки): стандартные default или пользовательские границы с метками bin_labels."""
+    return default if bins is None else (list(bins), bin_labels(bins))
+
+
+DEFAULT_RETENTION_HORIZON = 90
+
+MANIFEST_NAME = 'manifest.json'
+# Версия схемы таблиц отчётов: отчёты другой версии не подгружаются в кэш
+REPORT_VERSION = 2
+
+
+def dataset_key(file_keys):
+    """Ключ датасета по ключам файлов - общий для дашборда, хранилища и отчётов."""
+    return f"{combine_keys(file_keys)}-v{PIPELINE_VERSION}"
+
+
+# --- Движок ---
+
+def build_cube(df_users, df_shifts):
+    """Куб Fill Rate или None, если он не меньше таблицы смен в CUBE_MIN_REDUCTION раз.
+
+    Из фильтров пользователя в куб попадают только те, с которыми он остаётся компактным.
+    """
+    user_dims = select_user_dims(df_users, df_shifts, USER_FILTER_COLS)
+    if user_dims is None:
+        return None
+    try:
+        return FillRateCube(df_users, df_shifts, user_dims=user_dims)
+    except ValueError:
+        return None
+
+
+class AnalyticsEngine:
+    """Вычисления вкладок дашборда без Streamlit: индекс фильтров, куб и кэш агрегатов на датасет.
+
+    cube может быть None - тогда все агрегаты считаются по сырым сменам. catalog - каталог
+    метаданных датасета (DatasetCatalog); без него значения фильтров берутся из индекса.
+    bucketizer - коды корзин датасета (Bucketizer); без него создаётся свой, пустой.
+    sample_fraction < 1 - движок по выборке пользователей (см. sample).
+    """
+
+    # Доля пользователей датасета в таблицах движка: 1.0 - точный движок, у движка выборки - меньше
+    sample_fraction = 1.0
+
+    def __init__(self, df_users, df_shifts, dataset_key, filter_index, cube=None, cache=None, catalog=None,
+                 bucketizer=None):
+        self.df_users = df_users
+        self.df_shifts = df_shifts
+        self.dataset_key = dataset_key
+        self.filter_index = filter_index
+        self.cube = cube
+        self.cache = cache if cache is not None else AggregateCache()
+        self.bucketizer = bucketizer if bucketizer is not None else Bucketizer({'users': df_users, 'shifts': df_shifts})
+        self.catalog = catalog
+        # Последний слот смен выгрузки: после него следующей брони быть не может
+        self.max_shift_number = int(df_shifts['shift_number'].max()) if len(df_shifts) else 0
+
+    @classmethod
+    def from_tables(cls, df_users, df_shifts, dataset_key, cache=None, catalog=None):
+        """Движок с индексом фильтров и кубом, построенными по таблицам."""
+        filter_index = FilterIndex(
+            df_users, df_shifts, user_dims=USER_FILTER_COLS, shift_dims=SHIFT_FILTER_COLS,
+            user_range_cols=USER_RANGE_COLS
+        )
+        return cls(df_users, df_shifts, dataset_key, filter_index, build_cube(df_users, df_shifts), cache, catalog)
+
+    @property
+    def approximate(self):
+        return self.sample_fraction < 1.0
+
+    def sample(self, size, seed=0):
+        """Движок по стратифицированной выборке size пользователей (stratified_sample) или self.
+
+        Кэш агрегатов и каталог общие с точным движком: спецификация фильтров нормализуется
+        так же, а агрегаты выборки хранятся под своим ключом датасета.
+        """
+        users, shifts, fraction = stratified_sample(self.df_users, self.df_shifts, size, seed=seed)
+        if fraction == 1.0:
+            return self
+        engine = AnalyticsEngine.from_tables(
+            users, shifts, f"{self.dataset_key}-sample{size}-{seed}", self.cache, self.catalog
+        )
+        engine.sample_fraction = fraction
+        engine.max_shift_number = self.max_shift_number
+        return engine
+
+    # --- Каталог фильтров: значения и границы, по которым строятся виджеты и нормализуется спецификация ---
+
+    @property
+    def user_columns(self):
+        return list(self.df_users.columns)
+
+    @property
+    def shift_columns(self):
+        return list(self.df_shifts.columns)
+
+    def filter_values(self, section):
+        """{колонка: (встречающиеся значения по возрастанию, есть ли пропуски)} фильтров 'users' или 'shifts'."""
+        if self.catalog is not None:
+            return self.catalog.filter_values(section, USER_FILTER_COLS if section == 'users' else SHIFT_FILTER_COLS)
+        bitmaps = self.filter_index.user_bitmaps if section == 'users' else self.filter_index.shift_bitmaps
+        return {col: (column.present, column.has_nulls) for col, column in bitmaps.items()}
+
+    def range_bounds(self):
+        """{колонка: (минимум, максимум, нет ли пропусков)} диапазонных фильтров пользователей."""
+        if self.catalog is not None:
+            return self.catalog.range_bounds(USER_RANGE_COLS)
+        return {
+            col: (*(v.item() for v in column.bounds), column.complete)
+            for col, column in self.filter_index.user_ranges.items() if column.bounds[0] is not None
+        }
+
+    def date_bounds(self):
+        """(первый день, последний день, у всех ли смен есть дата старта); (None, None, False) без дат."""
+        if self.catalog is not None:
+            return self.catalog.date_bounds()
+        first, last = self.filter_index.date_bounds
+        return first, last, self.filter_index.shift_days.complete
+
+    def normalize_spec(self, filter_spec):
+        """Убирает из спецификации фильтры, которые ничего не отсекают.
+
+        Так "все значения выбраны" в дашборде и отсутствие фильтра в отчёте дают один ключ кэша.
+        Спецификация: {'users': {колонка: значения}, 'user_ranges': {колонка: (от, до)},
+        'dates': (начало, конец) или None, 'shifts': {колонка: значения}}.
+        """
+        def selections(filters, catalog):
+            result = {}
+            for col, values in (filters or {}).items():
+                present, has_nulls = catalog.get(col, (None, True))
+                if not has_nulls and set(present) <= set(values):
+                    continue
+                result[col] = list(values)
+            return result
+
+        user_ranges = {}
+        bounds = self.range_bounds()
+        for col, (low, high) in (filter_spec.get('user_ranges') or {}).items():
+            if col in bounds:
+                min_value, max_value, complete = bounds[col]
+                if complete and low <= min_value and high >= max_value:
+                    continue
+            user_ranges[col] = (low, high)
+
+        dates = filter_spec.get('dates')
+        if dates is not None:
+            dates = tuple(np.datetime64(d, 'D').astype(object) for d in dates)
+            first, last, complete = self.date_bounds()
+            if complete and first is not None and dates[0] <= first and dates[1] >= last:
+                dates = None
+
+        return {
+            'users': selections(filter_spec.get('users'), self.filter_values('users')),
+            'user_ranges': user_ranges,
+            'dates': dates,
+            'shifts': selections(filter_spec.get('shifts'), self.filter_values('shifts')),
+        }
+
+    def default_spec(self):
+        """Спецификация как в дашборде по умолчанию: выбраны все значения, полные диапазоны и даты."""
+        first, last, _ = self.date_bounds()
+        return {
+            'users': {col: list(present) for col, (present, _) in self.filter_values('users').items()},
+            'user_ranges': {col: (low, high) for col, (low, high, _) in self.range_bounds().items()},
+            'dates': (first, last) if first is not None else None,
+            'shifts': {col: list(present) for col, (present, _) in self.filter_values('shifts').items()},
+        }
+
+    def view(self, filter_spec=None):
+        return FilterView(self, self.normalize_spec(filter_spec or {}))
+
+    def adopt_aggregates(self, base, user_ids):
+        """Переносит из кэша агрегаты состояний фильтров движка base, которых не коснулась дельта.
+
+        base - движок датасета до apply_delta, user_ids - пользователи дельты (обновлённые и
+        новые). Если ни старая, ни новая версия этих пользователей не проходит фильтры
+        состояния, все его агрегаты - и по сменам, и по пользователям - прежние, и записи кэша
+        копируются под ключ этого датасета. Возвращает число перенесённых состояний.
+        """
+        if self.max_shift_number != base.max_shift_number:
+            return 0
+        user_ids = np.asarray(user_ids, dtype='int64')
+        old_pos = pd.Index(base.df_users['user_id']).get_indexer(user_ids)
+        old_pos = old_pos[old_pos >= 0]
+        new_pos = pd.Index(self.df_users['user_id']).get_indexer(user_ids)
+
+        def passes(engine, spec, positions):
+            user_mask, _ = engine.filter_index.apply(spec['users'], spec['user_ranges'], spec['dates'], spec['shifts'])
+            return user_mask[positions].any()
+
+        state_keys, specs = {}, {}
+        for state_key, (dataset_key, spec) in self.cache.named('filter_spec'):
+            if dataset_key != base.dataset_key or passes(base, spec, old_pos):
+                continue
+            spec = self.normalize_spec(spec)
+            if passes(self, spec, new_pos):
+                continue
+            state_keys[state_key] = filter_state_key(self.dataset_key, spec)
+            specs[state_keys[state_key]] = spec
+        self.cache.copy_states(state_keys)
+        for state_key, spec in specs.items():
+            self.cache.put((state_key, 'filter_spec'), (self.dataset_key, spec))
+        return len(state_keys)
+
+
+def _param_key(args):
+    """Аргументы метода view для ключа кэша (словари флагов - кортежем колонок, как в fill_rate_by_flags)."""
+    return tuple(tuple(arg) if isinstance(arg, dict) else arg for arg in args)
+
+
+class FilterView:
+    """Датасет под конкретной спецификацией фильтров: агрегаты всех вкладок через общий кэш."""
+
+    backend = 'pandas'
+
+    def __init__(self, engine, filter_spec):
+        self.engine = engine
+        self.filter_spec = filter_spec
+        self.state_key = filter_state_key(engine.dataset_key, filter_spec)
+        # Спецификация состояния - для переноса его агрегатов на датасет после дельты (adopt_aggregates)
+        if engine.cache.get((self.state_key, 'filter_spec')) is None:
+            engine.cache.put((self.state_key, 'filter_spec'), (engine.dataset_key, filter_spec))
+        # Ключи кэша и значения агрегатов, запрошенных через этот view
+        self.results = {}
+        self._transitions = None
+
+        user_filters, user_ranges = filter_spec['users'], filter_spec['user_ranges']
+        date_range, shift_filters = filter_spec['dates'], filter_spec['shifts']
+        with perf.span("Фильтрация по индексу", 'filter'):
+            user_mask, shift_mask = engine.filter_index.apply(user_filters, user_ranges, date_range, shift_filters)
+        self.filtered = FilteredData(engine.df_users, engine.df_shifts, user_mask, shift_mask)
+
+        # Агрегаты Fill Rate по сменам берём из куба, если фильтры совпадают с его измерениями
+        # (даты - целыми неделями); иначе (например, даты внутри недели) - из сырых смен.
+        cube = engine.cube
+        self.use_cube = cube is not None and cube.covers(user_ranges, date_range, {**user_filters, **shift_filters})
+        self.cube_slice = cube.slice(user_filters, shift_filters, date_range) if self.use_cube else None
+
+    @property
+    def empty(self):
+        return self.filtered.empty
+
+    def aggregate(self, name, compute, *params):
+        """Агрегат для этого состояния фильтров: из кэша или через compute()."""
+        key = (self.state_key, name, *params)
+
+        def traced_compute():
+            perf.annotate(cache='miss')
+            return compute()
+
+        # В имени этапа - простые параметры (колонка, горизонт), словари флагов опускаются
+        label = ' '.join([name, *(str(param) for param in params if isinstance(param, (str, int)))])
+        with perf.span(label, 'aggregate', cache='hit'):
+            value = self.engine.cache.get_or_compute(key, traced_compute)
+        self.results[key] = value
+        return value
+
+    # --- Вкладка 1: Обзор ---
+
+    def totals(self):
+        """(забронировано, выполнено) смен."""
+        return self.aggregate(
+            'totals',
+            lambda: self.cube_slice.totals() if self.use_cube else (
+                self.filtered.shifts.shape[0], self.filtered.shifts['job_done'].sum()
+            )
+        )
+
+    def total_estimates(self, confidence=DEFAULT_CONFIDENCE):
+        """Забронировано / выполнено / FR всей выгрузки с интервалами (estimate_totals).
+
+        Для движка по выборке - оценки по ней, для точного - те же totals с нулевыми интервалами.
+        """
+        engine = self.engine
+        return self.aggregate(
+            'total_estimates',
+            lambda: estimate_totals(self.filtered.shifts, len(engine.df_users), engine.sample_fraction, confidence),
+            confidence
+        )
+
+    def fill_rate_by_shift_number(self):
+        return self.aggregate(
+            'fr_by_shift_num',
+            lambda: self.cube_slice.fill_rate_by_shift_number() if self.use_cube else fill_rate_by_shift_number(self.filtered.shifts)
+        )
+
+    def weekly_fill_rate(self):
+        return self.aggregate(
+            'fr_dynamics',
+            lambda: self.cube_slice.weekly_fill_rate() if self.use_cube else weekly_fill_rate(self.filtered.shifts)
+        )
+
+    def shift_fill_rate_by(self, column):
+        """Полный (без Топ-N) агрегат fill_rate_by по колонке смены из SHIFT_BREAKDOWNS."""
+        return self.aggregate(
+            SHIFT_BREAKDOWNS[column],
+            lambda: self.cube_slice.fill_rate_by(column) if self.use_cube else fill_rate_by(self.filtered.shifts, column)
+        )
+
+    # --- Вкладка 2: Анализ смен ---
+
+    def fill_rate_by_duration(self, bins=None):
+        """FR по корзинам длительности; bins - пользовательские границы вместо DURATION_BINS."""
+        bins, labels = bins_and_labels((DURATION_BINS, DURATION_LABELS), bins)
+        return self.aggregate(
+            'fr_by_duration',
+            lambda: fill_rate_by_duration(
+                self.engine.bucketizer.moments('shifts', 'duration', bins, 'job_done', self.filtered.shift_mask), labels
+            ),
+            tuple(bins)
+        )
+
+    def distribution(self, column):
+        return self.aggregate(
+            'distribution',
+            lambda: distribution_stats(self.filtered.shifts[column], self.filtered.shifts['job_done']), column
+        )
+
+    # --- Вкладка 3: Профиль работника ---
+
+    def demo_fill_rate_pivot(self):
+        return self.aggregate('fr_demo_pivot', lambda: demo_fill_rate_pivot(self.filtered.users))
+
+    def _shift_transitions(self):
+        """Счётчики переходов между сменами (shift_transitions) - один проход на view для агрегатов ниже."""
+        if self._transitions is None:
+            self._transitions = shift_transitions(
+                self.filtered.shifts, self.engine.max_shift_number, NEXT_BOOKING_BINS
+            )
+        return self._transitions
+
+    def experience_effect(self):
+        return self.aggregate('fr_exp', lambda: experience_effect(self._shift_transitions()[0]))
+
+    def transition_matrix(self):
+        """Доли исходов смены k+1 (провал / успех / нет брони) при исходе смены k для всех шагов."""
+        return self.aggregate('transitions', lambda: transition_table(self._shift_transitions()[0]))
+
+    def transition_paths(self):
+        """Число пользователей по цепочкам исходов слотов (1→2→3 и дальше)."""
+        return self.aggregate(
+            'transition_paths', lambda: path_table(self._shift_transitions()[1], self.engine.max_shift_number)
+        )
+
+    def next_booking_days(self):
+        """Распределение дней до следующей брони по шагу и исходу смены."""
+        return self.aggregate(
+            'next_booking', lambda: next_booking_table(*self._shift_transitions()[2:], NEXT_BOOKING_LABELS)
+        )
+
+    def flag_combinations(self, flag_cols_map):
+        """Компактная таблица сочетаний значений флагов с моментами FR (flag_combinations)."""
+        flag_cols = [col for col in flag_cols_map if col in self.engine.user_columns]
+        return flag_combinations(self.filtered.users, flag_cols)
+
+    def fill_rate_by_flags(self, flag_cols_map):
+        return self.aggregate(
+            'fr_by_flags', lambda: fill_rate_by_flags(self.flag_combinations(flag_cols_map), flag_cols_map),
+            tuple(flag_cols_map)
+        )
+
+    def flag_interactions(self, flag_cols_map):
+        """Попарные взаимодействия флагов по той же таблице сочетаний."""
+        return self.aggregate(
+            'flag_interactions', lambda: flag_interactions(self.flag_combinations(flag_cols_map), flag_cols_map),
+            tuple(flag_cols_map)
+        )
+
+    def fill_rate_by_bins(self, column, bins=None):
+        """Средний FR по бакетам активности; bins - пользовательские границы вместо ACTIVITY_BINS."""
+        bins, labels = bins_and_labels(ACTIVITY_BINS[column], bins)
+
+        def compute():
+            if column not in self.engine.user_columns:
+                return pd.DataFrame()
+            moments = self.engine.bucketizer.moments('users', column, bins, 'user_avg_fr', self.filtered.user_mask)
+            return fill_rate_by_bins(moments, column, labels)
+        return self.aggregate('fr_by_bins', compute, column, tuple(bins))
+
+    def driver_frame(self, columns, max_rows, seed=0):
+        """До max_rows случайных отфильтрованных смен: job_done и колонки columns смены или её пользователя."""
+        engine = self.engine
+        positions = np.flatnonzero(self.filtered.shift_mask)
+        if len(positions) > max_rows:
+            positions = np.sort(np.random.default_rng(seed).choice(positions, max_rows, replace=False))
+        shift_cols = [col for col in ['job_done', *columns] if col in engine.shift_columns]
+        user_cols = [col for col in columns if col not in shift_cols and col in engine.user_columns]
+        return pd.concat([
+            engine.df_shifts[shift_cols].take(positions).reset_index(drop=True),
+            engine.df_users[user_cols].take(engine.filter_index.shift_user_pos[positions]).reset_index(drop=True),
+        ], axis=1)
+
+    # --- Вкладка 4: Удержание и когорты ---
+
+    def total_users_1st(self):
+        return self.aggregate(
+            'total_users_1st', lambda: int(self.filtered.users['shift_booked_time_1'].notna().sum())
+        )
+
+    def cohort_retention(self):
+        return self.aggregate('cohort_pivot', lambda: cohort_retention(self.filtered.users))
+
+    def survival_curve(self, horizon=DEFAULT_RETENTION_HORIZON):
+        return self.aggregate(
+            'survival_curve',
+            lambda: survival_curve(
+                self.filtered.users.loc[self.filtered.users['shift_booked_time_1'].notna(), 'min_return_days'], horizon
+            ),
+            horizon
+        )
+
+    # --- Выгрузка ---
+
+    def export_rows(self, table, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+        """Байты файла выгрузки отфильтрованных пользователей ('users') или смен ('shifts') в формате fmt.
+
+        Строки берутся пачками прямо по маске фильтров - отфильтрованная таблица не вырезается.
+        """
+        if table == 'users':
+            return export_frame(self.engine.df_users, fmt, self.filtered.user_mask, chunk_rows)
+        return export_frame(self.engine.df_shifts, fmt, self.filtered.shift_mask, chunk_rows)
+
+    # --- Доверительные интервалы и попарные сравнения ---
+
+    def fill_rate_intervals(self, breakdown, *args, method='wilson', confidence=DEFAULT_CONFIDENCE):
+        """Разбивка Fill Rate (имя метода view и его аргументы) с колонками ci_low / ci_high."""
+        agg = getattr(self, breakdown)(*args)
+        return self.aggregate(
+            'fr_intervals', lambda: fill_rate_intervals(agg, method, confidence),
+            breakdown, *_param_key(args), method, confidence
+        )
+
+    def fill_rate_tests(self, breakdown, *args, label=None, within=None, confidence=DEFAULT_CONFIDENCE):
+        """Попарные z-тесты групп разбивки; label по умолчанию - первая колонка разбивки."""
+        agg = getattr(self, breakdown)(*args)
+        return self.aggregate(
+            'fr_tests', lambda: fill_rate_tests(agg, label or agg.columns[0], within, confidence),
+            breakdown, *_param_key(args), label, within, confidence
+        )
+
+    def compute_all(self, retention_horizons=(DEFAULT_RETENTION_HORIZON,)):
+        """Все агрегаты вкладок по очереди - около 25 отдельных группировок.
+
+        Общее у них - один view: маски фильтров считаются и таблицы вырезаются один раз,
+        а агрегаты, которые уже есть в кэше, не пересчитываются.
+
+        Возвращает {ключ кэша: результат}; ключ - (state_key, имя агрегата, параметры).
+        """
+        shift_cols = self.engine.shift_columns
+        user_cols = self.engine.user_columns
+        calls = [self.totals, self.fill_rate_by_shift_number, self.weekly_fill_rate]
+        calls += [lambda col=col: self.shift_fill_rate_by(col) for col in SHIFT_BREAKDOWNS if col in shift_cols]
+        if 'duration' in shift_cols:
+            calls.append(self.fill_rate_by_duration)
+        calls += [lambda col=col: self.distribution(col) for col in DISTRIBUTION_COLS if col in shift_cols]
+        if 'age' in user_cols and 'income' in user_cols:
+            calls.append(self.demo_fill_rate_pivot)
+        calls += [self.experience_effect, self.transition_matrix, self.transition_paths, self.next_booking_days]
+        calls += [lambda flags=flags: self.fill_rate_by_flags(flags) for flags in (MARKETING_FLAGS, PROFILE_FLAGS)]
+        calls.append(lambda: self.flag_interactions(INTERACTION_FLAGS))
+        calls += [lambda col=col: self.fill_rate_by_bins(col) for col in ACTIVITY_BINS]
+        calls.append(self.total_users_1st)
+        if self.total_users_1st():
+            calls.append(self.cohort_retention)
+            calls += [lambda h=horizon: self.survival_curve(h) for horizon in retention_horizons]
+
+        for call in calls:
+            call()
+        return dict(self.results)
+
+
+# --- Предрасчитанные отчёты: Parquet (таблицы) + JSON (манифест и прочие значения) ---
+
+def _encode(value):
+    """Приводит значение агрегата к JSON: массивы NumPy помечаются, чтобы восстановиться при чтении."""
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': str(value.dtype)}
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if '__ndarray__' in value:
+            return np.array(value['__ndarray__'], dtype=value['dtype'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _as_tuple(value):
+    return tuple(_as_tuple(v) for v in value) if isinstance(value, list) else value
+
+
+def write_report(view, results, out_dir):
+    """Пишет агрегаты view в каталог out_dir/<state_key>: таблицы - Parquet, остальное - в манифест.
+
+    Возвращает путь к каталогу отчёта.
+    """
+    report_dir = Path(out_dir) / view.state_key
+    report_dir.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for i, (key, value) in enumerate(results.items()):
+        _, name, *params = key
+        entry = {'name': name, 'params': _encode(list(params))}
+        if isinstance(value, pd.DataFrame):
+            frame = value.copy()
+            # Parquet требует строковые имена колонок - исходные сохраняем в манифесте
+            entry['columns'] = _encode(list(frame.columns))
+            entry['columns_name'] = frame.columns.name
+            frame.columns = [str(col) for col in frame.columns]
+            entry['file'] = f"{i:02d}_{name}.parquet"
+            frame.to_parquet(report_dir / entry['file'])
+        else:
+            entry['value'] = _encode(value)
+        entries.append(entry)
+
+    manifest = {
+        'dataset_key': view.engine.dataset_key,
+        'report_version': REPORT_VERSION,
+        'state_key': view.state_key,
+        'filter_spec': _encode(json.loads(json.dumps(view.filter_spec, default=str))),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'entries': entries,
+    }
+    (report_dir / MANIFEST_NAME).write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding='utf-8')
+    return report_dir
+
+
+def read_report(report_dir):
+    """Читает отчёт write_report: (манифест, {(state_key, имя, параметры): значение})."""
+    report_dir = Path(report_dir)
+    manifest = json.loads((report_dir / MANIFEST_NAME).read_text(encoding='utf-8'))
+    results = {}
+    for entry in manifest['entries']:
+        key = (manifest['state_key'], entry['name'], *_as_tuple(_decode(entry['params'])))
+        if 'file' in entry:
+            value = pd.read_parquet(report_dir / entry['file'])
+            value.columns = pd.Index(_decode(entry['columns']), name=entry['columns_name'])
+        else:
+            value = _decode(entry['value'])
+        results[key] = value
+    return manifest, results
+
+
+def preload_reports(reports_dir, dataset_key, cache):
+    """Кладёт в кэш агрегатов все отчёты из reports_dir, посчитанные для dataset_key.
+
+    Возвращает число загруженных отчётов; повреждённые отчёты пропускаются.
+    """
+    loaded = 0
+    for manifest_path in sorted(Path(reports_dir).glob(f'*/{MANIFEST_NAME}')):
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+            if manifest.get('dataset_key') != dataset_key or manifest.get('report_version', 1) != REPORT_VERSION:
+                continue
+            _, results = read_report(manifest_path.parent)
+        except (OSError, ValueError, KeyError):
+            continue
+        for key, value in results.items():
+            cache.put(key, value)
+        loaded += 1
+    return loaded
@@ -0,0 +1,95 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+import perf
+
+# Форматы выгрузки: название -> (расширение файла, MIME-тип)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'Arrow IPC': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+# Строк в одной пачке выгрузки: в памяти одновременно только одна пачка
+EXPORT_CHUNK_ROWS = int(os.environ.get('FR_DASHBOARD_EXPORT_CHUNK_ROWS', 100_000))
+# Файл выгрузки держится в памяти до этого размера, дальше - на диске
+SPOOL_MAX_BYTES = 16 * 2**20
+
+
+def _export_ready(df):
+    """Таблица для записи: именованный индекс (как у сводных таблиц) - колонкой, имена колонок - строками."""
+    if not isinstance(df.index, pd.RangeIndex) or any(name is not None for name in df.index.names):
+        df = df.reset_index()
+    if not all(isinstance(col, str) for col in df.columns):
+        df = df.set_axis([str(col) for col in df.columns], axis=1)
+    return df
+
+
+def frame_reader(df, mask=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Поток пачек Arrow из строк df по булевой маске: строки вырезаются пачками, без полной копии."""
+    df = _export_ready(df)
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    positions = np.flatnonzero(mask) if mask is not None else None
+    rows = len(df) if positions is None else len(positions)
+
+    def batches():
+        for start in range(0, rows, chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows] if positions is None else df.take(positions[start:start + chunk_rows])
+            yield from pa.Table.from_pandas(chunk, schema=schema, preserve_index=False).to_batches()
+
+    return pa.RecordBatchReader.from_batches(schema, batches())
+
+
+def _csv_schema(schema):
+    """CSV-писатель не поддерживает словарные (категориальные) колонки - пишем их значения."""
+    return pa.schema([
+        field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field for field in schema
+    ])
+
+
+def _csv_batch(batch):
+    columns = [
+        column.dictionary_decode() if pa.types.is_dictionary(column.type) else column for column in batch.columns
+    ]
+    return pa.RecordBatch.from_arrays(columns, schema=_csv_schema(batch.schema))
+
+
+def write_reader(reader, fmt):
+    """Записывает поток пачек в файл формата fmt (ключ EXPORT_FORMATS) и возвращает его байты.
+
+    Пачки пишутся по одной, так что в памяти - одна пачка и уже записанная часть файла
+    (после SPOOL_MAX_BYTES - на диске). Результат - bytes: st.download_button всё равно
+    читает файл целиком, а файловые объекты, кроме BytesIO и открытых на чтение, не принимает.
+    """
+    rows = 0
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as sink:
+        with perf.span(f"Выгрузка {fmt}", 'export'):
+            if fmt == 'CSV':
+                writer = pa_csv.CSVWriter(sink, _csv_schema(reader.schema))
+            elif fmt == 'Parquet':
+                writer = pq.ParquetWriter(sink, reader.schema)
+            elif fmt == 'Arrow IPC':
+                writer = pa.ipc.new_file(sink, reader.schema)
+            else:
+                raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+            with writer:
+                for batch in reader:
+                    writer.write_batch(_csv_batch(batch) if fmt == 'CSV' else batch)
+                    rows += batch.num_rows
+            perf.annotate(rows=rows)
+        sink.seek(0)
+        return sink.read()
+
+
+def export_frame(df, fmt, mask=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Байты файла выгрузки строк df (по маске) в формате fmt."""
+    return write_reader(frame_reader(df, mask, chunk_rows), fmt)
+
+
+def export_file_name(name, fmt):
+    return f"{name}.{EXPORT_FORMATS[fmt][0]}"
@@ -0,0 +1,302 @@
+import numpy as np
+import pandas as pd
+
+import perf
+
+
+def codes_and_values(series):
+    """Целочисленные коды (-1 для пропусков) и список различных значений колонки."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), list(series.cat.categories)
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes, list(uniques)
+
+
+def _pack(mask):
+    return np.packbits(mask)
+
+
+def _extended_bits(packed, n):
+    """Копия упакованной маски, дополненная нулями до n строк."""
+    out = np.zeros((n + 7) // 8, dtype=np.uint8)
+    out[:len(packed)] = packed
+    return out
+
+
+def _assign_bits(packed, positions, bits):
+    """Записывает (на месте) биты bits в строки positions упакованной маски."""
+    byte = positions >> 3
+    flag = (np.uint8(1) << (7 - (positions & 7)).astype(np.uint8)).astype(np.uint8)
+    np.bitwise_and.at(packed, byte, ~flag)
+    np.bitwise_or.at(packed, byte[bits], flag[bits])
+    return packed
+
+
+class _ValueBitmaps:
+    """Битовые карты (np.packbits) "строка имеет значение v" для каждого значения колонки."""
+
+    def __init__(self, series):
+        codes, values = codes_and_values(series)
+        self.n = len(codes)
+        self.values = values
+        self.bitmaps = {value: _pack(codes == code) for code, value in enumerate(values)}
+        # Значения, которые реально встречаются (у категорий могут быть неиспользуемые)
+        self.present = [value for value in values if self.bitmaps[value].any()]
+        self.has_nulls = bool((codes < 0).any())
+        self.notnull = _pack(codes >= 0) if self.has_nulls else None
+
+    def updated(self, series, changed):
+        """Битовые карты для новой версии колонки series, в которой изменились только строки changed.
+
+        Остальные строки остались на своих местах (новые строки - в конце), их биты переносятся
+        без пересчёта.
+        """
+        codes, values = codes_and_values(series.iloc[changed])
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            all_values = list(series.cat.categories)
+        else:
+            all_values = list(pd.Index(self.values).union(pd.Index(values)))
+        n = len(series)
+        updated = object.__new__(_ValueBitmaps)
+        updated.n = n
+        updated.values = all_values
+        updated.bitmaps = {}
+        empty = _pack(np.zeros(self.n, dtype=bool))
+        value_codes = {value: code for code, value in enumerate(values)}
+        for value in all_values:
+            bitmap = _extended_bits(self.bitmaps.get(value, empty), n)
+            updated.bitmaps[value] = _assign_bits(bitmap, changed, codes == value_codes.get(value, -2))
+        updated.present = [value for value in all_values if updated.bitmaps[value].any()]
+        notnull = self.notnull if self.has_nulls else _pack(np.ones(self.n, dtype=bool))
+        notnull = _assign_bits(_extended_bits(notnull, n), changed, codes >= 0)
+        updated.has_nulls = bool(np.count_nonzero(np.unpackbits(notnull, count=n)) < n)
+        updated.notnull = notnull if updated.has_nulls else None
+        return updated
+
+    def select(self, selected):
+        """Упакованная маска строк со значением из selected или None, если ограничения нет.
+
+        Как и isin(), строки с пропуском никогда не проходят фильтр.
+        """
+        selected = {value for value in selected if value in self.bitmaps}
+        if len(selected) == len(self.values):
+            return self.notnull
+        if not selected:
+            return _pack(np.zeros(self.n, dtype=bool))
+
+        # Выбрано больше половины значений - дешевле вычесть невыбранные
+        if len(selected) > len(self.values) / 2:
+            rest = [self.bitmaps[v] for v in self.values if v not in selected]
+            mask = ~np.bitwise_or.reduce(rest)
+            return mask & self.notnull if self.has_nulls else mask
+        return np.bitwise_or.reduce([self.bitmaps[v] for v in selected])
+
+
+class _SortedColumn:
+    """Отсортированные значения числовой колонки для диапазонных фильтров бинарным поиском."""
+
+    def __init__(self, values):
+        values = np.asarray(values)
+        valid = ~np.isnan(values) if values.dtype.kind == 'f' else np.ones(len(values), bool)
+        self.n = len(values)
+        self.order = np.flatnonzero(valid)[np.argsort(values[valid], kind='stable')]
+        self.sorted_values = values[self.order]
+        self.complete = len(self.order) == self.n
+
+    def updated(self, values, changed, dropped, remap=None):
+        """Колонка values, в которой изменились строки changed, а строки dropped старой колонки удалены.
+
+        remap - новые позиции оставшихся старых строк (None - позиции те же). Новые значения
+        вставляются в уже отсортированные бинарным поиском, без полной сортировки.
+        """
+        values = np.asarray(values)
+        survivors = ~dropped[self.order]
+        order = self.order[survivors]
+        if remap is not None:
+            order = remap[order]
+        sorted_values = self.sorted_values[survivors]
+
+        new_values = values[changed]
+        valid = ~np.isnan(new_values) if new_values.dtype.kind == 'f' else np.ones(len(new_values), bool)
+        new_order = np.asarray(changed)[valid][np.argsort(new_values[valid], kind='stable')]
+        insert_at = np.searchsorted(sorted_values, values[new_order], side='right')
+
+        updated = object.__new__(_SortedColumn)
+        updated.n = len(values)
+        updated.order = np.insert(order, insert_at, new_order)
+        updated.sorted_values = np.insert(sorted_values, insert_at, values[new_order])
+        updated.complete = len(updated.order) == updated.n
+        return updated
+
+    @property
+    def bounds(self):
+        if not len(self.sorted_values):
+            return None, None
+        return self.sorted_values[0], self.sorted_values[-1]
+
+    def select(self, low, high):
+        """Упакованная маска строк с low <= value <= high или None, если ограничения нет."""
+        start = np.searchsorted(self.sorted_values, low, side='left')
+        stop = np.searchsorted(self.sorted_values, high, side='right')
+        if self.complete and start == 0 and stop == self.n:
+            return None
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.order[start:stop]] = True
+        return _pack(mask)
+
+
+def _shift_days(df_shifts):
+    """День старта смены как число дней от эпохи (NaT -> NaN, такие смены под фильтр дат не попадают)."""
+    start_days = df_shifts['shift_start_time'].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    days = start_days.astype('int64').astype('float64')
+    days[np.isnat(start_days)] = np.nan
+    return days
+
+
+def _and(masks):
+    masks = [m for m in masks if m is not None]
+    if not masks:
+        return None
+    return np.bitwise_and.reduce(masks) if len(masks) > 1 else masks[0]
+
+
+def _unpack(mask, n):
+    if mask is None:
+        return np.ones(n, dtype=bool)
+    return np.unpackbits(mask, count=n).view(bool)
+
+
+class FilterIndex:
+    """Индекс для глобальных фильтров, строится один раз на датасет.
+
+    Для каждого значения фильтруемых колонок хранится битовая карта строк,
+    для диапазонных фильтров и даты старта смены - отсортированные значения.
+    Фильтрация сводится к AND/OR битовых карт и бинарному поиску без копий таблиц.
+    """
+
+    def __init__(self, df_users, df_shifts, user_dims, shift_dims, user_range_cols=('quantity_responses',)):
+        self.n_users = len(df_users)
+        self.n_shifts = len(df_shifts)
+        self.user_bitmaps = {col: _ValueBitmaps(df_users[col]) for col in user_dims if col in df_users.columns}
+        self.shift_bitmaps = {col: _ValueBitmaps(df_shifts[col]) for col in shift_dims if col in df_shifts.columns}
+        self.user_ranges = {
+            col: _SortedColumn(df_users[col].to_numpy(dtype='float64'))
+            for col in user_range_cols if col in df_users.columns
+        }
+
+        # Позиция пользователя каждой смены в df_users
+        self.shift_user_pos = pd.Index(df_users['user_id']).get_indexer(df_shifts['user_id'])
+
+        self.shift_days = _SortedColumn(_shift_days(df_shifts))
+
+    def updated(self, df_users, df_shifts, user_ids):
+        """Индекс для таблиц после apply_delta, пересчитанный только в строках пользователей user_ids.
+
+        apply_delta оставляет пользователей на местах (новые - в конце), а из смен убирает
+        смены затронутых пользователей и дописывает смены дельты в конец. Поэтому битовые
+        карты остальных строк переносятся как есть, а отсортированные колонки пополняются
+        бинарным поиском. Битовые карты смен дешевле построить заново, чем сдвигать.
+        """
+        user_pos = np.sort(pd.Index(df_users['user_id']).get_indexer(np.asarray(user_ids, dtype='int64')))
+        if (user_pos < 0).any() or len(df_users) - self.n_users != int((user_pos >= self.n_users).sum()):
+            raise ValueError("Таблицы не совпадают с раскладкой apply_delta - индекс нужно строить заново")
+        replaced_users = np.zeros(self.n_users, dtype=bool)
+        replaced_users[user_pos[user_pos < self.n_users]] = True
+        keep = ~replaced_users[self.shift_user_pos]
+        kept = int(keep.sum())
+        appended = np.arange(kept, len(df_shifts))
+        remap = np.cumsum(keep) - 1
+
+        index = object.__new__(FilterIndex)
+        index.n_users = len(df_users)
+        index.n_shifts = len(df_shifts)
+        index.user_bitmaps = {
+            col: bitmaps.updated(df_users[col], user_pos) for col, bitmaps in self.user_bitmaps.items()
+        }
+        index.shift_bitmaps = {col: _ValueBitmaps(df_shifts[col]) for col in self.shift_bitmaps}
+        index.user_ranges = {
+            col: column.updated(df_users[col].to_numpy(dtype='float64'), user_pos, replaced_users)
+            for col, column in self.user_ranges.items()
+        }
+        index.shift_user_pos = np.r_[
+            self.shift_user_pos[keep],
+            pd.Index(df_users['user_id']).get_indexer(df_shifts['user_id'].iloc[kept:])
+        ]
+        index.shift_days = self.shift_days.updated(_shift_days(df_shifts), appended, ~keep, remap)
+        return index
+
+    @property
+    def date_bounds(self):
+        low, high = self.shift_days.bounds
+        if low is None:
+            return None, None
+        to_date = lambda day: np.datetime64(int(day), 'D').astype(object)
+        return to_date(low), to_date(high)
+
+    def user_mask(self, user_filters, user_ranges=None):
+        """Булева маска пользователей по фильтрам демографии/поведения и диапазонам."""
+        masks = [self.user_bitmaps[col].select(values) for col, values in user_filters.items() if col in self.user_bitmaps]
+        for col, (low, high) in (user_ranges or {}).items():
+            if col in self.user_ranges:
+                masks.append(self.user_ranges[col].select(low, high))
+        return _unpack(_and(masks), self.n_users)
+
+    def apply(self, user_filters, user_ranges=None, date_range=None, shift_filters=None):
+        """Возвращает (маска df_users, маска df_shifts) с финальной синхронизацией.
+
+        Пользователь остаётся, только если у него есть хотя бы одна смена, прошедшая фильтры.
+        """
+        user_mask = self.user_mask(user_filters, user_ranges)
+
+        masks = [self.shift_bitmaps[col].select(values) for col, values in (shift_filters or {}).items() if col in self.shift_bitmaps]
+        if date_range is not None:
+            start_date, end_date = date_range
+            low = np.datetime64(start_date, 'D').astype('int64')
+            high = np.datetime64(end_date, 'D').astype('int64')
+            masks.append(self.shift_days.select(low, high))
+        shift_mask = _unpack(_and(masks), self.n_shifts)
+        if not user_mask.all():
+            shift_mask &= user_mask[self.shift_user_pos]
+
+        # Финальная синхронизация: пользователи, у которых остались смены
+        has_shift = np.zeros(self.n_users, dtype=bool)
+        has_shift[self.shift_user_pos[shift_mask]] = True
+        return user_mask & has_shift, shift_mask
+
+
+def take(df, mask):
+    """Строки df по булевой маске; без копирования, если маска пропускает всё."""
+    return df if mask.all() else df[mask]
+
+
+class FilteredData:
+    """Отфильтрованные df_users / df_shifts, которые вырезаются только при первом обращении.
+
+    Если все нужные агрегаты уже есть в кэше, таблицы не материализуются вовсе.
+    """
+
+    def __init__(self, df_users, df_shifts, user_mask, shift_mask):
+        self.user_mask = user_mask
+        self.shift_mask = shift_mask
+        self._df_users = df_users
+        self._df_shifts = df_shifts
+        self._users = None
+        self._shifts = None
+
+    @property
+    def users(self):
+        if self._users is None:
+            with perf.span("Вырезка отфильтрованных пользователей", 'filter'):
+                self._users = take(self._df_users, self.user_mask)
+        return self._users
+
+    @property
+    def shifts(self):
+        if self._shifts is None:
+            with perf.span("Вырезка отфильтрованных смен", 'filter'):
+                self._shifts = take(self._df_shifts, self.shift_mask)
+        return self._shifts
+
+    @property
+    def empty(self):
+        return not self.user_mask.any() or not self.shift_mask.any()
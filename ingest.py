@@ -0,0 +1,661 @@
+import io
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from glob import glob
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+try:
+    import pyarrow as pa
+except ImportError:  # Без pyarrow части потоковой загрузки копятся в памяти
+    pa = None
+
+import perf
+from cube import week_index
+
+# --- Описание входного формата ---
+DATE_COLS = [
+    'shift_booked_time_1', 'shift_start_time_1',
+    'shift_booked_time_2', 'shift_start_time_2',
+    'shift_booked_time_3', 'shift_start_time_3'
+]
+
+# Добавляем ВСЕ флаги и числовые колонки для корректной обработки
+NUMERIC_COLS = [
+    'job_done_1', 'job_done_2', 'job_done_3',
+    'shift_duration_1', 'shift_price_per_hour_1',
+    'shift_duration_2', 'shift_price_per_hour_2',
+    'shift_duration_3', 'shift_price_per_hour_3',
+    'serp_frequency', 'item_view_frequency',
+    'started_verification_gu_flg', 'success_verification_gu_flg',
+    'cv_free_grafik_flg', 'cv_podrabotka_flg', 'vac_podrabotka_flg',
+    'quantity_responses', 'click_internet_adv_flg', 'opened_push_flg',
+    'watched_stories_in_app_flg', 'click_addv_communication_flg',
+    'has_call_centre_communication_flg'
+]
+
+# Колонки слотов смен (без суффикса _<номер слота>): даты и числа. В выгрузке 3 слота,
+# но слоты определяются по колонкам shift_booked_time_<i>, поэтому их может быть больше.
+SLOT_DATE_COLS = {'shift_booked_time', 'shift_start_time'}
+SLOT_NUMERIC_COLS = {'job_done', 'shift_duration', 'shift_price_per_hour'}
+
+# Версия логики обработки: увеличивается при изменении этого модуля,
+# чтобы не отдавать из дискового хранилища данные, посчитанные старой логикой
+PIPELINE_VERSION = 5
+
+# Размер части по умолчанию для потоковой загрузки (строк CSV)
+DEFAULT_CHUNKSIZE = 200_000
+
+# --- Схема типов: общая для df_users и long_shifts_df ---
+# Колонки смен в "широкой" таблице имеют суффикс _1/_2/_3 и приводятся по имени без суффикса.
+DIMENSION_COLS = {'region', 'platform', 'age', 'income', 'gender', 'task_type', 'task_group', 'shift_region'}
+COUNTER_COLS = {
+    'serp_frequency', 'item_view_frequency', 'quantity_responses', 'user_id', 'shift_number',
+    'user_booked', 'user_done'
+}
+FLOAT_COLS = {
+    'shift_duration', 'shift_price_per_hour', 'duration', 'price_per_hour',
+    'user_avg_fr', 'delta_1_2', 'delta_1_3', 'min_return_days'
+}
+
+_SLOT_SUFFIX = re.compile(r'_\d+$')
+_BOOKED_SLOT = re.compile(r'^shift_booked_time_(\d+)$')
+
+
+def shift_slots(columns):
+    """Номера слотов смен "широкой" таблицы (по колонкам shift_booked_time_<i>) по возрастанию."""
+    return sorted(int(match.group(1)) for match in map(_BOOKED_SLOT.match, columns) if match)
+
+
+def is_date_column(col):
+    return col in DATE_COLS or (_SLOT_SUFFIX.search(col) is not None and _SLOT_SUFFIX.sub('', col) in SLOT_DATE_COLS)
+
+
+def is_numeric_column(col):
+    return col in NUMERIC_COLS or (_SLOT_SUFFIX.search(col) is not None and _SLOT_SUFFIX.sub('', col) in SLOT_NUMERIC_COLS)
+
+
+def column_kind(col):
+    """Тип колонки по схеме: 'category', 'flag', 'counter', 'float' или None (не трогаем)."""
+    base = _SLOT_SUFFIX.sub('', col)
+    if base in DIMENSION_COLS:
+        return 'category'
+    # job_done в длинной таблице (после fillna) - такой же 0/1 флаг
+    if col.endswith('_flg') or base == 'job_done':
+        return 'flag'
+    if base in COUNTER_COLS:
+        return 'counter'
+    if col in FLOAT_COLS or base in FLOAT_COLS:
+        return 'float'
+    return None
+
+
+def _is_integral(values, low, high):
+    values = values[~np.isnan(values)]
+    return values.size == 0 or (
+        values.min() >= low and values.max() <= high and np.array_equal(values, np.round(values))
+    )
+
+
+def apply_schema(df):
+    """Приводит колонки к компактным типам (на месте) и возвращает тот же DataFrame.
+
+    Измерения -> category, флаги и job_done -> uint8, счётчики -> минимальный целый тип,
+    длительности/ставки/доли -> float32. Целые колонки с пропусками становятся float32.
+    """
+    for col in df.columns:
+        kind = column_kind(col)
+        series = df[col]
+        if kind == 'category':
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                df[col] = series.astype('category')
+        elif kind is None or not is_numeric_dtype(series.dtype):
+            continue
+        elif kind == 'flag':
+            values = series.to_numpy(dtype='float64')
+            if _is_integral(values, 0, 255) and not np.isnan(values).any():
+                df[col] = series.astype('uint8')
+            else:
+                df[col] = series.astype('float32')
+        elif kind == 'counter':
+            values = series.to_numpy(dtype='float64')
+            if not np.isnan(values).any() and _is_integral(values, -2**63, 2**63 - 1):
+                df[col] = pd.to_numeric(series, downcast='unsigned' if values.size == 0 or values.min() >= 0 else 'integer')
+            else:
+                df[col] = series.astype('float32')
+        elif kind == 'float':
+            df[col] = series.astype('float32')
+    return df
+
+
+def unify_categories(frames):
+    """Делает категории одноимённых колонок (и слотов _1/_2/_3) общими во всех таблицах.
+
+    Нужна для склейки частей потоковой загрузки (иначе pd.concat вернёт object)
+    и для того, чтобы df_users и long_shifts_df разделяли один словарь значений.
+    """
+    groups = {}
+    for df in frames:
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                groups.setdefault(_SLOT_SUFFIX.sub('', col), []).append((df, col))
+
+    for members in groups.values():
+        categories = pd.Index([])
+        for df, col in members:
+            categories = categories.union(df[col].cat.categories)
+        dtype = pd.CategoricalDtype(categories)
+        for df, col in members:
+            if df[col].dtype != dtype:
+                df[col] = df[col].cat.set_categories(categories)
+    return frames
+
+
+def memory_usage(df):
+    """Полный (deep) объём DataFrame в байтах."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def convert_types(df_users):
+    """Преобразует даты и числовые колонки (на месте) и возвращает тот же DataFrame."""
+    for col in df_users.columns:
+        if is_date_column(col):
+            df_users[col] = pd.to_datetime(df_users[col], errors='coerce')
+
+    for col in df_users.columns:
+        if is_numeric_column(col):
+            df_users[col] = pd.to_numeric(df_users[col], errors='coerce')
+            # Важно: заполняем пропуски в флагах и счетчиках нулями
+            if '_flg' in col or 'frequency' in col or 'quantity' in col:
+                df_users[col] = df_users[col].fillna(0)
+    return df_users
+
+
+def melt_shifts(df_users):
+    """Строит "длинную" таблицу смен (одна строка = одна бронь) или None, если броней нет."""
+    all_shifts = []
+    for i in shift_slots(df_users.columns):
+        # КЛЮЧЕВОЙ ШАГ 1: Оставляем только те строки, где есть бронь
+
+        cols_to_pull = [
+            'user_id', 'region', 'platform', 'age', 'income',
+            f'shift_booked_time_{i}', f'shift_start_time_{i}', f'job_done_{i}',
+            f'shift_duration_{i}', f'shift_price_per_hour_{i}',
+            f'task_type_{i}', f'task_group_{i}', f'shift_region_{i}'
+        ]
+        # Убедимся, что все колонки существуют
+        existing_cols = [col for col in cols_to_pull if col in df_users.columns]
+        # Сначала отбираем строки с бронью, и только потом - нужные колонки (без копии всей таблицы)
+        shift_df = df_users.loc[df_users[f'shift_booked_time_{i}'].notna(), existing_cols]
+        if shift_df.empty:
+            continue
+
+        # Переименовываем колонки в общий вид
+        rename_map = {
+            f'shift_booked_time_{i}': 'shift_booked_time',
+            f'shift_start_time_{i}': 'shift_start_time',
+            f'job_done_{i}': 'job_done',
+            f'shift_duration_{i}': 'duration',
+            f'shift_price_per_hour_{i}': 'price_per_hour',
+            f'task_type_{i}': 'task_type',
+            f'task_group_{i}': 'task_group',
+            f'shift_region_{i}': 'shift_region'
+        }
+        # Применяем переименование только для существующих колонок
+        shift_df = shift_df.rename(columns={k: v for k, v in rename_map.items() if k in shift_df.columns})
+        shift_df['shift_number'] = i
+        all_shifts.append(shift_df)
+
+    if not all_shifts:
+        return None
+
+    long_shifts_df = pd.concat(all_shifts, ignore_index=True)
+    # КЛЮЧЕВОЙ ШАГ 2: .fillna(0) для 'job_done'
+    long_shifts_df['job_done'] = long_shifts_df['job_done'].fillna(0)
+    return long_shifts_df
+
+
+def add_user_metrics(df_users, long_shifts_df):
+    """Добавляет 'user_avg_fr' и поля для анализа удержания (на месте)."""
+    # 'user_avg_fr' = (Успехи пользователя / Бронирования пользователя); счётчики храним,
+    # чтобы дозагрузка дельты пересчитывала только затронутых пользователей
+    user_counts = long_shifts_df.groupby('user_id')['job_done'].agg(['size', 'sum'])
+    df_users['user_booked'] = df_users['user_id'].map(user_counts['size']).fillna(0)
+    df_users['user_done'] = df_users['user_id'].map(user_counts['sum']).fillna(0)
+    df_users['user_avg_fr'] = (df_users['user_done'] / df_users['user_booked']).fillna(0)
+
+    # --- Доп. поля для user-level анализа (для удержания) ---
+    df_users['delta_1_2'] = (df_users['shift_booked_time_2'] - df_users['shift_booked_time_1']).dt.days
+    df_users['delta_1_3'] = (df_users['shift_booked_time_3'] - df_users['shift_booked_time_1']).dt.days
+    df_users['min_return_days'] = df_users[['delta_1_2', 'delta_1_3']].min(axis=1)
+    return df_users
+
+
+def process_frame(df_users):
+    """Полный цикл обработки одной "широкой" таблицы: типы -> смены -> метрики пользователя.
+
+    `user_id` берётся из индекса, поэтому у частей одного файла он остаётся сквозным.
+    Возвращает (df_users, long_shifts_df, memory), где memory - объём таблиц в байтах
+    до и после приведения к схеме; long_shifts_df = None, если броней нет.
+    """
+    with perf.span("Преобразование типов", 'pipeline'):
+        convert_types(df_users)
+    df_users['user_id'] = df_users.index
+    with perf.span("Melt: широкая таблица -> смены", 'pipeline'):
+        long_shifts_df = melt_shifts(df_users)
+    if long_shifts_df is None:
+        return df_users, None, None
+    with perf.span("user_avg_fr и поля удержания", 'pipeline'):
+        add_user_metrics(df_users, long_shifts_df)
+
+    # --- Компактная схема типов (с замером памяти до/после) ---
+    with perf.span("Компактная схема типов", 'pipeline'):
+        memory = {'users': {'before': memory_usage(df_users)}, 'shifts': {'before': memory_usage(long_shifts_df)}}
+        apply_schema(df_users)
+        apply_schema(long_shifts_df)
+        unify_categories([df_users, long_shifts_df])
+    memory['users']['after'] = memory_usage(df_users)
+    memory['shifts']['after'] = memory_usage(long_shifts_df)
+    return df_users, long_shifts_df, memory
+
+
+def _file_size(file_obj):
+    position = file_obj.tell()
+    file_obj.seek(0, 2)
+    size = file_obj.tell()
+    file_obj.seek(position)
+    return size
+
+
+def iter_csv_chunks(file_obj, chunksize=DEFAULT_CHUNKSIZE):
+    """Читает CSV по частям и отдаёт (users_chunk, shifts_chunk, memory, доля_прочитанного, строк_всего).
+
+    Все расчёты на уровне пользователя построчные (одна строка = один пользователь),
+    поэтому каждая часть обрабатывается независимо и в памяти одновременно
+    находится только одна "сырая" часть файла.
+    """
+    total_size = _file_size(file_obj) or 1
+    rows_done = 0
+    with pd.read_csv(file_obj, chunksize=chunksize) as reader:
+        chunks = iter(reader)
+        while True:
+            with perf.span("Парсинг CSV (часть)", 'pipeline'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            users_chunk, shifts_chunk, memory = process_frame(chunk)
+            rows_done += len(users_chunk)
+            yield users_chunk, shifts_chunk, memory, min(file_obj.tell() / total_size, 1.0), rows_done
+
+
+def concat_parts(parts):
+    """Склеивает части одной таблицы, сохраняя категориальные и компактные типы."""
+    unify_categories(parts)
+    return apply_schema(pd.concat(parts, ignore_index=True))
+
+
+def merge_processed(parts):
+    """Склеивает обработанные части [(users, shifts, memory), ...] в один датасет.
+
+    user_id в частях уже должен быть глобально уникальным.
+    Возвращает (df_users, long_shifts_df, memory_report); long_shifts_df = None, если броней нет.
+    """
+    memory = {'users': {'before': 0, 'after': 0}, 'shifts': {'before': 0, 'after': 0}}
+    user_parts, shift_parts = [], []
+    for users_part, shifts_part, part_memory in parts:
+        user_parts.append(users_part)
+        if shifts_part is not None:
+            shift_parts.append(shifts_part)
+            for table, sizes in part_memory.items():
+                memory[table]['before'] += sizes['before']
+    parts.clear()
+
+    if not shift_parts:
+        return pd.DataFrame(), None, None
+    with perf.span("Склейка частей", 'pipeline'):
+        df_users = concat_parts(user_parts)
+        del user_parts
+        long_shifts_df = concat_parts(shift_parts)
+        del shift_parts
+        unify_categories([df_users, long_shifts_df])
+    memory['users']['after'] = memory_usage(df_users)
+    memory['shifts']['after'] = memory_usage(long_shifts_df)
+    return df_users, long_shifts_df, memory
+
+
+def spool_part(directory, name, index, df):
+    """Пишет обработанную часть таблицы в свой файл Arrow IPC и возвращает путь.
+
+    У частей свои компактные типы и словари категорий, поэтому у каждой - отдельный файл.
+    """
+    path = Path(directory) / f'{name}-{index:05d}.arrow'
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(str(path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def read_spooled(paths):
+    """Склеивает части таблицы из файлов Arrow IPC через memory map.
+
+    Типы частей приводятся к общему (uint8 и float32 -> float32 и т.п.), словари
+    категорий объединяются; затем - снова компактная схема и отсортированные категории,
+    как у склейки в памяти.
+    """
+    tables = [pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all() for path in paths]
+    df = pa.concat_tables(tables, promote_options='permissive').to_pandas(split_blocks=True)
+    del tables
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and not df[col].cat.categories.is_monotonic_increasing:
+            df[col] = df[col].cat.reorder_categories(df[col].cat.categories.sort_values())
+    return apply_schema(df)
+
+
+def load_csv(file_obj, chunksize=None, on_progress=None):
+    """Загружает и обрабатывает CSV целиком (chunksize=None) или потоково по частям.
+
+    При потоковой загрузке каждая обработанная часть сразу сбрасывается на диск в Arrow IPC,
+    а результат собирается из файлов через memory map: в памяти одновременно одна часть
+    и итоговые таблицы. on_progress(доля, текст) вызывается по мере обработки.
+    Возвращает (df_users, long_shifts_df, memory_report); long_shifts_df = None, если броней нет.
+    """
+    report = on_progress or (lambda fraction, text: None)
+
+    if not chunksize:
+        report(0.0, "Чтение CSV...")
+        with perf.span("Парсинг CSV", 'pipeline'):
+            df_users = pd.read_csv(file_obj)
+        report(0.5, "Преобразование типов и построение таблицы смен...")
+        result = process_frame(df_users)
+        report(1.0, "Готово")
+        return result
+
+    chunks = iter_csv_chunks(file_obj, chunksize)
+    if pa is None:
+        parts = []
+        for users_chunk, shifts_chunk, chunk_memory, fraction, rows_done in chunks:
+            parts.append((users_chunk, shifts_chunk, chunk_memory))
+            report(fraction, f"Обработано строк: {rows_done:,}")
+        result = merge_processed(parts)
+        report(1.0, "Готово")
+        return result
+
+    memory = {'users': {'before': 0, 'after': 0}, 'shifts': {'before': 0, 'after': 0}}
+    spooled = {'users': [], 'shifts': []}
+    with tempfile.TemporaryDirectory(prefix='fr-load-', ignore_cleanup_errors=True) as spool_dir:
+        for index, (users_chunk, shifts_chunk, chunk_memory, fraction, rows_done) in enumerate(chunks):
+            with perf.span("Запись части на диск", 'pipeline'):
+                spooled['users'].append(spool_part(spool_dir, 'users', index, users_chunk))
+                if shifts_chunk is not None:
+                    spooled['shifts'].append(spool_part(spool_dir, 'shifts', index, shifts_chunk))
+                    for table, sizes in chunk_memory.items():
+                        memory[table]['before'] += sizes['before']
+            del users_chunk, shifts_chunk
+            report(fraction, f"Обработано строк: {rows_done:,}")
+
+        if not spooled['shifts']:
+            return pd.DataFrame(), None, None
+        with perf.span("Склейка частей (memory map)", 'pipeline'):
+            df_users = read_spooled(spooled['users'])
+            long_shifts_df = read_spooled(spooled['shifts'])
+            unify_categories([df_users, long_shifts_df])
+    memory['users']['after'] = memory_usage(df_users)
+    memory['shifts']['after'] = memory_usage(long_shifts_df)
+    report(1.0, "Готово")
+    return df_users, long_shifts_df, memory
+
+
+# --- Несколько файлов / партиции ---
+
+PARTITION_EXTENSIONS = ('.csv', '.parquet')
+
+
+def source_name(source):
+    """Имя источника: путь, (имя, байты) или файловый объект с атрибутом name."""
+    if isinstance(source, tuple):
+        return source[0]
+    return str(getattr(source, 'name', source))
+
+
+def expand_partitions(pattern):
+    """Список файлов партиций по каталогу или glob-шаблону (CSV/Parquet), отсортированный по имени."""
+    path = Path(pattern).expanduser()
+    if path.is_dir():
+        paths = [p for p in path.iterdir() if p.suffix.lower() in PARTITION_EXTENSIONS]
+    else:
+        paths = [Path(p) for p in glob(str(path), recursive=True)]
+        paths = [p for p in paths if p.is_file() and p.suffix.lower() in PARTITION_EXTENSIONS]
+    return sorted(paths)
+
+
+def read_partition(source):
+    """Читает одну партицию целиком: CSV или Parquet, из пути или (имя, байты)."""
+    name = source_name(source)
+    data = io.BytesIO(source[1]) if isinstance(source, tuple) else source
+    if name.lower().endswith('.parquet'):
+        return pd.read_parquet(data)
+    return pd.read_csv(data)
+
+
+def process_partition(source):
+    """Обработка одной партиции в процессе пула (функция верхнего уровня для pickle)."""
+    return process_frame(read_partition(source))
+
+
+def _offset_user_ids(users, shifts, offset):
+    users['user_id'] = users['user_id'].astype('int64') + offset
+    if shifts is not None:
+        shifts['user_id'] = shifts['user_id'].astype('int64') + offset
+
+
+# Подмена __main__ на время запуска процессов: сессии Streamlit - потоки одного процесса
+_MAIN_LOCK = threading.Lock()
+# Общие пулы процессов spawn: (назначение, число процессов) -> пул, один раз на процесс
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+@contextmanager
+def detached_main():
+    """Скрывает __main__ (скрипт Streamlit) на время запуска процессов пула.
+
+    Дочерние процессы spawn заново исполняют модуль __main__ родителя - для дашборда это
+    весь интерфейс. Процессы пула стартуют синхронно при submit, поэтому задачи
+    отправляются внутри этого контекста. Подмена идёт под общей блокировкой; если за это
+    время запуск скрипта другой сессии поставил свой __main__, он не перетирается.
+    """
+    with _MAIN_LOCK:
+        main_module = sys.modules.get('__main__')
+        placeholder = sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            yield
+        finally:
+            if sys.modules.get('__main__') is placeholder:
+                sys.modules['__main__'] = main_module
+
+
+def process_pool(name, max_workers):
+    """Общий пул процессов spawn для задач name: создаётся один раз и живёт до конца процесса.
+
+    Процессы стартуют по мере надобности (не больше max_workers) и переиспользуются,
+    так что цена запуска интерпретатора платится один раз, а не на каждый вызов.
+    """
+    key = (name, max_workers)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            # spawn: fork процесса Streamlit с живыми потоками небезопасен
+            context = multiprocessing.get_context('spawn')
+            pool = _POOLS[key] = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+    return pool
+
+
+def _discard_pool(name, max_workers, pool):
+    with _POOLS_LOCK:
+        if _POOLS.get((name, max_workers)) is pool:
+            del _POOLS[(name, max_workers)]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_to_pool(name, max_workers, fn, *args):
+    """Отправляет fn(*args) в общий пул name (см. process_pool) и возвращает future.
+
+    Если процесс пула упал (например, по памяти), пул сломан: он закрывается,
+    а задача отправляется в новый.
+    """
+    pool = process_pool(name, max_workers)
+    try:
+        with detached_main():
+            return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        _discard_pool(name, max_workers, pool)
+        with detached_main():
+            return process_pool(name, max_workers).submit(fn, *args)
+
+
+def load_partitions(sources, max_workers=None, on_progress=None):
+    """Параллельно обрабатывает партиции в пуле процессов и склеивает их в один датасет.
+
+    Каждая партиция проходит тот же конвейер, что и load_csv. user_id внутри партиции
+    начинается с 0, поэтому при склейке сдвигается на число пользователей предыдущих
+    партиций (в порядке sources) - идентификаторы глобально уникальны и детерминированы.
+    """
+    report = on_progress or (lambda fraction, text: None)
+    sources = list(sources)
+    if not sources:
+        return pd.DataFrame(), None, None
+
+    results = [None] * len(sources)
+    if len(sources) == 1:
+        report(0.0, f"Обработка {source_name(sources[0])}...")
+        results[0] = process_partition(sources[0])
+    else:
+        max_workers = max_workers or os.cpu_count() or 1
+        with perf.span(f"Пул процессов: {len(sources)} партиций", 'pipeline'):
+            futures = {
+                submit_to_pool('ingest', max_workers, process_partition, source): i for i, source in enumerate(sources)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                report(done / len(sources), f"Обработано партиций: {done} из {len(sources)}")
+
+    offset = 0
+    for users, shifts, _ in results:
+        _offset_user_ids(users, shifts, offset)
+        offset += len(users)
+    result = merge_processed(results)
+    report(1.0, "Готово")
+    return result
+
+
+def load_sources(sources, chunksize=None, max_workers=None, on_progress=None):
+    """Точка входа загрузчика: один CSV (целиком или потоково) или несколько партиций в пуле."""
+    sources = list(sources)
+    if len(sources) == 1 and chunksize and not source_name(sources[0]).lower().endswith('.parquet'):
+        source = sources[0]
+        if isinstance(source, tuple):
+            source = io.BytesIO(source[1])
+        elif isinstance(source, (str, Path)):
+            with open(source, 'rb') as file_obj:
+                return load_csv(file_obj, chunksize=chunksize, on_progress=on_progress)
+        return load_csv(source, chunksize=chunksize, on_progress=on_progress)
+    return load_partitions(sources, max_workers=max_workers, on_progress=on_progress)
+
+
+# --- Инкрементальная дозагрузка (дельта) ---
+
+def apply_delta(df_users, long_shifts_df, delta, key):
+    """Применяет дельту - "широкие" строки новых и изменившихся пользователей - без полной переобработки.
+
+    Пользователь ищется по стабильному идентификатору key из выгрузки (не user_id: это номер
+    строки, присвоенный при загрузке): найденная строка заменяется на месте вместе со сменами,
+    новые пользователи добавляются в конец со следующими user_id. Смены незатронутых
+    пользователей остаются в прежнем порядке, смены дельты дописываются в конец - так индекс
+    фильтров обновляется только в строках затронутых пользователей (FilterIndex.updated).
+    Конвейер обработки проходят только строки дельты, поэтому счётчики user_booked/user_done,
+    'user_avg_fr' и поля удержания пересчитываются только у затронутых пользователей.
+    Возвращает (df_users, long_shifts_df, memory, changes): в memory 'before' - объём только
+    строк дельты; changes - число обновлённых и новых пользователей, их user_id и недели
+    (номера week_index), в которых изменились смены.
+    """
+    if key == 'user_id':
+        raise ValueError(
+            "'user_id' - номер строки, присвоенный при загрузке, а не идентификатор из выгрузки: "
+            "укажите колонку стабильного идентификатора пользователя"
+        )
+    if key not in delta.columns or key not in df_users.columns:
+        raise ValueError(f"Колонка идентификатора '{key}' должна быть и в данных, и в дельте")
+    if delta[key].isna().any():
+        raise ValueError(f"В дельте есть строки без идентификатора '{key}'")
+    # Повтор пользователя в дельте - берём последнюю версию строки
+    delta = delta.drop_duplicates(subset=key, keep='last')
+
+    user_ids = df_users['user_id'].to_numpy(dtype='int64')
+    positions = pd.Index(df_users[key]).get_indexer(delta[key])
+    is_new = positions < 0
+    next_id = int(user_ids.max()) + 1 if user_ids.size else 0
+    assigned = np.empty(len(delta), dtype='int64')
+    assigned[~is_new] = user_ids[positions[~is_new]]
+    assigned[is_new] = np.arange(next_id, next_id + int(is_new.sum()))
+
+    # user_id берётся из индекса (как в process_frame)
+    delta_users, delta_shifts, delta_memory = process_frame(delta.set_axis(assigned))
+    if delta_shifts is None:
+        raise ValueError("В дельте нет данных о бронированиях")
+
+    replaced_shifts = np.isin(long_shifts_df['user_id'].to_numpy(dtype='int64'), assigned[~is_new])
+
+    # Недели, в которых изменились смены: старые смены заменённых пользователей и новые смены
+    start_times = pd.concat([
+        long_shifts_df.loc[replaced_shifts, 'shift_start_time'], delta_shifts['shift_start_time']
+    ])
+    start_days = start_times.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    has_date = ~np.isnat(start_days)
+    changes = {
+        'updated_users': int((~is_new).sum()),
+        'new_users': int(is_new.sum()),
+        'user_ids': assigned.tolist(),
+        'weeks': np.unique(week_index(start_days[has_date].astype('int64'))).tolist(),
+        'undated': bool((~has_date).any()),
+    }
+
+    # Строки объединённой таблицы: обновлённые пользователи - на месте старых строк, новые - в конце
+    rows = np.arange(len(df_users) + int(is_new.sum()))
+    rows[positions[~is_new]] = len(df_users) + np.flatnonzero(~is_new)
+    rows[len(df_users):] = len(df_users) + np.flatnonzero(is_new)
+    users = concat_parts([df_users, delta_users]).take(rows).reset_index(drop=True)
+    shifts = concat_parts([long_shifts_df[~replaced_shifts], delta_shifts])
+    unify_categories([users, shifts])
+
+    memory = {
+        table: {'before': delta_memory[table]['before'], 'after': memory_usage(df)}
+        for table, df in [('users', users), ('shifts', shifts)]
+    }
+    return users, shifts, memory, changes
+
+
+def memory_report(memory):
+    """Таблица "до/после" по объёму памяти (МБ) для отображения в дашборде."""
+    rows = []
+    for table, label in [('users', 'df_users'), ('shifts', 'long_shifts_df')]:
+        before_mb = memory[table]['before'] / 2**20
+        after_mb = memory[table]['after'] / 2**20
+        rows.append({
+            'Таблица': label,
+            'До, МБ': round(before_mb, 1),
+            'После, МБ': round(after_mb, 1),
+            'Экономия': f"{1 - after_mb / before_mb:.0%}" if before_mb else '-'
+        })
+    return pd.DataFrame(rows)
@@ -0,0 +1,132 @@
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Сколько последних перезапусков скрипта хранится в сессии для выгрузки трассировки
+DEFAULT_HISTORY = 100
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = None
+
+# Трассировщик текущего перезапуска; у каждого потока Streamlit - свой контекст
+_active = contextvars.ContextVar('fr_dashboard_tracer', default=None)
+
+
+def rss_bytes():
+    """Текущий RSS процесса в байтах (Linux, /proc/self/statm) или None, если недоступен."""
+    if _PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Tracer:
+    """Замеры одного перезапуска: вложенные этапы с временем, изменением RSS и атрибутами (кэш и т.п.)."""
+
+    def __init__(self, label=''):
+        self.label = label
+        self.started_at = time.time()
+        self.spans = []
+        self.meta = {}
+        self.finished_ms = None
+        self._stack = []
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name, category='stage', **attrs):
+        record = {
+            'name': name, 'category': category, 'depth': len(self._stack),
+            'start_ms': (time.perf_counter() - self._origin) * 1000, 'ms': None, 'rss_delta_mb': None, **attrs
+        }
+        self.spans.append(record)
+        self._stack.append(record)
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['ms'] = (time.perf_counter() - started) * 1000
+            rss_after = rss_bytes()
+            if rss_before is not None and rss_after is not None:
+                record['rss_delta_mb'] = (rss_after - rss_before) / 2**20
+            self._stack.pop()
+
+    def annotate(self, **attrs):
+        """Добавляет атрибуты к текущему (самому вложенному) этапу."""
+        if self._stack:
+            self._stack[-1].update(attrs)
+
+    def finish(self):
+        """Фиксирует полное время перезапуска (вызывается в конце скрипта)."""
+        self.finished_ms = (time.perf_counter() - self._origin) * 1000
+
+    @property
+    def total_ms(self):
+        """Время перезапуска; если скрипт прерван (st.stop) - до конца последнего этапа."""
+        if self.finished_ms is not None:
+            return self.finished_ms
+        return max((span['start_ms'] + (span['ms'] or 0) for span in self.spans), default=0.0)
+
+    def to_dict(self):
+        return {
+            'label': self.label,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'total_ms': self.total_ms,
+            'meta': self.meta,
+            'spans': self.spans,
+        }
+
+    def table(self):
+        """Этапы для панели: отступ по вложенности, время, изменение RSS и попадание в кэш."""
+        rows = [{
+            'Этап': ' ' * span['depth'] + span['name'],
+            'Тип': span['category'],
+            'мс': round(span['ms'], 1) if span['ms'] is not None else None,
+            'ΔRSS, МБ': round(span['rss_delta_mb'], 1) if span['rss_delta_mb'] is not None else None,
+            'Кэш': span.get('cache', ''),
+        } for span in self.spans]
+        return pd.DataFrame(rows, columns=['Этап', 'Тип', 'мс', 'ΔRSS, МБ', 'Кэш'])
+
+
+def start_rerun(history, label='', max_history=DEFAULT_HISTORY):
+    """Создаёт трассировщик перезапуска, делает его активным и добавляет в history (список сессии)."""
+    tracer = Tracer(label)
+    _active.set(tracer)
+    history.append(tracer)
+    del history[:-max_history]
+    return tracer
+
+
+def current():
+    return _active.get()
+
+
+@contextmanager
+def span(name, category='stage', **attrs):
+    """Замер этапа в активном трассировщике; без трассировщика ничего не делает."""
+    tracer = _active.get()
+    if tracer is None:
+        yield {}
+        return
+    with tracer.span(name, category, **attrs) as record:
+        yield record
+
+
+def annotate(**attrs):
+    tracer = _active.get()
+    if tracer is not None:
+        tracer.annotate(**attrs)
+
+
+def export_json(tracers):
+    """JSON-трассировка нескольких перезапусков (для выгрузки из панели)."""
+    return json.dumps([tracer.to_dict() for tracer in tracers], ensure_ascii=False, indent=1, default=str)
@@ -0,0 +1,105 @@
+"""Пакетный расчёт агрегатов дашборда без Streamlit.
+
+Пример:
+    python report.py data.csv --filters specs.json --out reports/
+
+specs.json - одна спецификация фильтров или список спецификаций:
+    {"users": {"gender": ["male"]}, "user_ranges": {"quantity_responses": [0, 50]},
+     "dates": ["2024-01-01", "2024-03-31"], "shifts": {"task_group": ["Склад"]}}
+Отсутствующий фильтр - как в дашборде по умолчанию (выбраны все значения).
+Для каждой спецификации создаётся каталог <out>/<state_key> с таблицами Parquet
+и manifest.json; дашборд подхватывает их через "Каталог предрасчитанных отчётов"
+(ключ датасета совпадает с загрузкой тех же файлов тем же бэкендом).
+
+С --backend duckdb файлы обрабатываются в DuckDB (датасеты больше оперативной памяти).
+"""
+import argparse
+import json
+import sys
+import time
+
+from dataset_store import DatasetStore, file_key
+from engine import DEFAULT_RETENTION_HORIZON, AnalyticsEngine, dataset_key, write_report
+from ingest import load_sources, source_name
+from sql_engine import open_dataset, resolve_backend, sql_dataset_key
+
+
+def file_keys(paths):
+    return [file_key(path) for path in paths]
+
+
+def load_dataset(paths, store=None):
+    """Загружает файлы как дашборд (тот же ключ датасета), используя дисковое хранилище, если оно есть."""
+    key = dataset_key(file_keys(paths))
+
+    if store is not None:
+        cached = store.get(key)
+        if cached is not None:
+            df_users, df_shifts, _ = cached
+            return key, df_users, df_shifts
+
+    df_users, df_shifts, memory = load_sources(paths)
+    if df_shifts is None:
+        raise ValueError("В данных нет бронирований")
+    if store is not None:
+        meta = {'dataset_key': key, 'source_name': ', '.join(source_name(path) for path in paths), 'memory': memory}
+        store.put(key, df_users, df_shifts, meta)
+    return key, df_users, df_shifts
+
+
+def read_specs(path):
+    if path is None:
+        return [{}]
+    with open(path, encoding='utf-8') as spec_file:
+        specs = json.load(spec_file)
+    return specs if isinstance(specs, list) else [specs]
+
+
+def with_defaults(defaults, spec):
+    """Дополняет спецификацию значениями по умолчанию по каждой колонке."""
+    result = {section: {**defaults[section], **spec.get(section, {})} for section in ('users', 'user_ranges', 'shifts')}
+    result['dates'] = spec.get('dates', defaults['dates'])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Предрасчёт агрегатов дашборда Fill Rate в Parquet/JSON.")
+    parser.add_argument('paths', nargs='+', help="CSV/Parquet-файлы датасета (в том же порядке, что и в дашборде)")
+    parser.add_argument('--filters', help="JSON со спецификацией фильтров или списком спецификаций")
+    parser.add_argument('--out', required=True, help="Каталог для отчётов")
+    parser.add_argument(
+        '--horizon', type=int, action='append',
+        help=f"Горизонт кривой удержания в днях (можно несколько, по умолчанию {DEFAULT_RETENTION_HORIZON})"
+    )
+    parser.add_argument('--no-store', action='store_true', help="Не использовать дисковое хранилище датасетов")
+    parser.add_argument('--backend', help="pandas или duckdb (по умолчанию FR_DASHBOARD_BACKEND или pandas)")
+    args = parser.parse_args(argv)
+    try:
+        backend = resolve_backend(args.backend)
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.perf_counter()
+    if backend == 'duckdb':
+        engine = open_dataset(args.paths, sql_dataset_key(file_keys(args.paths)))
+        users, shifts = engine.rows['users'], engine.rows['shifts']
+    else:
+        store = None if args.no_store else DatasetStore()
+        key, df_users, df_shifts = load_dataset(args.paths, store if store is not None and store.enabled else None)
+        engine = AnalyticsEngine.from_tables(df_users, df_shifts, key)
+        users, shifts = len(df_users), len(df_shifts)
+    print(f"Датасет {engine.dataset_key} ({backend}): {users:,} пользователей, {shifts:,} смен", file=sys.stderr)
+
+    horizons = tuple(args.horizon or [DEFAULT_RETENTION_HORIZON])
+    for spec in read_specs(args.filters):
+        view = engine.view(with_defaults(engine.default_spec(), spec))
+        if view.empty:
+            print(f"Пропуск {view.state_key}: по фильтрам нет данных", file=sys.stderr)
+            continue
+        report_dir = write_report(view, view.compute_all(horizons), args.out)
+        print(report_dir)
+    print(f"Готово за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
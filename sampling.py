@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import perf
+from filter_index import codes_and_values
+from stats import DEFAULT_CONFIDENCE, z_value
+
+# Колонки страт выборки: регион пользователя и группа заданий его первой смены
+SAMPLE_STRATA = ('region', 'task_group')
+# Размеры выборки (пользователей) для быстрого предпросмотра
+DEFAULT_SAMPLE_SIZE = int(os.environ.get('FR_DASHBOARD_SAMPLE_SIZE', 50_000))
+SAMPLE_SIZES = tuple(sorted({10_000, 25_000, 50_000, 100_000, 250_000, DEFAULT_SAMPLE_SIZE}))
+
+
+def stratum_codes(df_users, df_shifts, strata=SAMPLE_STRATA):
+    """Код страты каждого пользователя: сочетание значений колонок strata.
+
+    Колонка пользователей берётся как есть, колонка смен - по первой смене пользователя
+    (пользователь без смен - отдельное значение). Пропуск - тоже отдельное значение.
+    """
+    codes = np.zeros(len(df_users), dtype='int64')
+    for col in strata:
+        if col in df_users.columns:
+            column_codes, values = codes_and_values(df_users[col])
+        elif col in df_shifts.columns:
+            first = df_shifts.sort_values('shift_number', kind='stable').drop_duplicates('user_id')
+            shift_codes, values = codes_and_values(first[col])
+            column_codes = np.full(len(df_users), -2, dtype='int64')
+            positions = pd.Index(df_users['user_id']).get_indexer(first['user_id'])
+            column_codes[positions[positions >= 0]] = shift_codes[positions >= 0]
+        else:
+            continue
+        codes = codes * (len(values) + 2) + (np.asarray(column_codes, dtype='int64') + 2)
+    return codes
+
+
+def stratified_sample(df_users, df_shifts, size, strata=SAMPLE_STRATA, seed=0):
+    """Стратифицированная выборка пользователей со всеми их сменами: (users, shifts, доля выборки).
+
+    Из каждой страты берётся одна и та же доля size / число пользователей (не меньше одного
+    пользователя), поэтому выборка почти самовзвешенная: доли и средние оцениваются по ней
+    без весов, а суммы - делением на долю. Пользователь - единица выборки, его смены не дробятся.
+    """
+    n = len(df_users)
+    if size >= n:
+        return df_users, df_shifts, 1.0
+
+    with perf.span(f"Стратифицированная выборка {size:,} из {n:,}", 'pipeline'):
+        strata_codes = stratum_codes(df_users, df_shifts, strata)
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(n), strata_codes))
+        sorted_codes = strata_codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        taken = np.maximum(1, np.rint(sizes * size / n)).astype('int64')
+        rank = np.arange(n) - np.repeat(starts, sizes)
+        chosen = np.sort(order[rank < np.repeat(taken, sizes)])
+
+        users = df_users.iloc[chosen].reset_index(drop=True)
+        shifts = df_shifts[df_shifts['user_id'].isin(users['user_id'])].reset_index(drop=True)
+    return users, shifts, len(users) / n
+
+
+def estimate_totals(shifts, sample_users, fraction, confidence=DEFAULT_CONFIDENCE):
+    """Оценки забронированных и выполненных смен и Fill Rate всей выгрузки по сменам выборки.
+
+    sample_users - число пользователей выборки (все, включая не прошедших фильтры: у них
+    нулевые суммы). Дисперсии считаются по суммам на пользователя - смены одного пользователя
+    зависимы - с поправкой на конечную совокупность; дисперсия FR - линеаризацией отношения.
+    Стратификация её только уменьшает, поэтому интервалы консервативны. Для точного движка
+    (fraction == 1) интервалы вырождаются в точку.
+    """
+    user_codes, _ = pd.factorize(shifts['user_id'])
+    booked = np.bincount(user_codes, minlength=1).astype(float)
+    done = np.bincount(user_codes, weights=shifts['job_done'].fillna(0).to_numpy(dtype=float), minlength=1)
+    booked_total, done_total = booked.sum(), done.sum()
+    fill_rate = done_total / booked_total if booked_total > 0 else 0.0
+
+    def variance(values):
+        # Выборочная дисперсия сумм на пользователя с нулями у остальных пользователей выборки
+        if sample_users < 2:
+            return 0.0
+        return max(0.0, ((values ** 2).sum() - values.sum() ** 2 / sample_users) / (sample_users - 1))
+
+    half = z_value(confidence) * np.sqrt(max(0.0, 1 - fraction) * sample_users)
+    booked_half = half * np.sqrt(variance(booked)) / fraction
+    done_half = half * np.sqrt(variance(done)) / fraction
+    fr_half = half * np.sqrt(variance(done - fill_rate * booked)) / booked_total if booked_total > 0 else 0.0
+    return {
+        'booked': booked_total / fraction, 'booked_low': max(0.0, booked_total / fraction - booked_half),
+        'booked_high': booked_total / fraction + booked_half,
+        'done': done_total / fraction, 'done_low': max(0.0, done_total / fraction - done_half),
+        'done_high': done_total / fraction + done_half,
+        'fill_rate': fill_rate, 'fill_rate_low': max(0.0, fill_rate - fr_half),
+        'fill_rate_high': min(1.0, fill_rate + fr_half),
+    }
@@ -0,0 +1,665 @@
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:  # SQL-бэкенд недоступен - дашборд и отчёты работают на pandas
+    duckdb = None
+
+import perf
+from aggregates import AggregateCache, cohort_pivot, filter_state_key, survival_from_buckets
+from catalog import MAX_CATALOG_VALUES, DatasetCatalog
+from chart_data import DEFAULT_MAX_OUTLIERS, DEFAULT_NBINS
+from engine import (
+    ACTIVITY_BINS, DEFAULT_RETENTION_HORIZON, DURATION_BINS, DURATION_LABELS, FILTER_VALUE_COLS, NEXT_BOOKING_BINS,
+    SHIFT_BREAKDOWNS, AnalyticsEngine, FilterView, bins_and_labels, dataset_key
+)
+from export import EXPORT_CHUNK_ROWS, write_reader
+from ingest import is_date_column, is_numeric_column, shift_slots
+
+# --- Выбор бэкенда при запуске ---
+# pandas - таблицы в памяти процесса; duckdb - встроенная колоночная СУБД поверх файла на диске,
+# в память попадают только результаты группировок (датасеты больше оперативной памяти).
+BACKENDS = ('pandas', 'duckdb')
+DEFAULT_BACKEND = os.environ.get('FR_DASHBOARD_BACKEND', 'pandas').lower()
+
+# Каталог файлов DuckDB и лимит памяти движка (сверх лимита DuckDB сбрасывает данные во временные файлы)
+DEFAULT_DB_DIR = Path(os.environ.get('FR_DASHBOARD_DUCKDB_DIR', '~/.cache/fr_dashboard/duckdb')).expanduser()
+DEFAULT_MEMORY_LIMIT = os.environ.get('FR_DASHBOARD_DUCKDB_MEMORY', '2GB')
+
+# Колонки пользователя, которые melt переносит в таблицу смен
+_USER_COLS_IN_SHIFTS = ['region', 'platform', 'age', 'income']
+# Колонки слота смены: имя в "широкой" таблице (без _i) -> имя в таблице смен
+_SLOT_COLS = {
+    'shift_booked_time': 'shift_booked_time',
+    'shift_start_time': 'shift_start_time',
+    'shift_duration': 'duration',
+    'shift_price_per_hour': 'price_per_hour',
+    'task_type': 'task_type',
+    'task_group': 'task_group',
+    'shift_region': 'shift_region',
+}
+
+
+def resolve_backend(name=None):
+    """Проверенное имя бэкенда; duckdb без установленного пакета - ошибка ValueError."""
+    name = (name or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд '{name}', доступны: {', '.join(BACKENDS)}")
+    if name == 'duckdb' and duckdb is None:
+        raise ValueError("Бэкенд duckdb требует пакет duckdb (pip install duckdb)")
+    return name
+
+
+def sql_dataset_key(file_keys):
+    """Ключ датасета SQL-бэкенда: отдельный от pandas, чтобы их отчёты в кэше не смешивались."""
+    return f"{dataset_key(file_keys)}-duckdb"
+
+
+def _ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _number(expr):
+    """Число или NULL (NaN в исходных данных - тоже пропуск, как в pandas)."""
+    return f"(CASE WHEN isnan(TRY_CAST({expr} AS DOUBLE)) THEN NULL ELSE TRY_CAST({expr} AS DOUBLE) END)"
+
+
+def _bucket(expr, bins):
+    """Номер корзины pd.cut(right=False) по границам bins; NULL вне границ и для пропусков."""
+    cases = []
+    for i, (low, high) in enumerate(zip(bins[:-1], bins[1:])):
+        conditions = [f"{expr} >= {float(low)!r}"] if np.isfinite(low) else []
+        conditions += [f"{expr} < {float(high)!r}"] if np.isfinite(high) else []
+        cases.append(f"WHEN {' AND '.join(conditions) or 'TRUE'} THEN {i}")
+    return f"(CASE WHEN {expr} IS NULL THEN NULL {' '.join(cases)} END)"
+
+
+def _plain(value):
+    """Значение из DuckDB для фильтров: целые флаги 0.0/1.0 - как int (как компактная схема pandas)."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# --- Каталог метаданных (как build_catalog, но запросами к базе) ---
+
+def _catalog_value(value):
+    """min/max колонки для каталога: NULL - None, даты - строкой ISO."""
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def sql_catalog(query, max_values=MAX_CATALOG_VALUES, keep_values=FILTER_VALUE_COLS):
+    """Каталог метаданных таблиц users и shifts, как build_catalog.
+
+    Пропуски, число различных значений и min/max всех колонок - одним запросом на таблицу,
+    затем счётчики значений колонок, где их не больше max_values, и колонок keep_values.
+    """
+    tables = {}
+    for table in ('users', 'shifts'):
+        described = query(f"DESCRIBE {table}")
+        types = dict(zip(described['column_name'], described['column_type']))
+        parts = ['count(*) AS n']
+        for i, (col, type_) in enumerate(types.items()):
+            parts += [f"count({_ident(col)}) AS c{i}", f"count(DISTINCT {_ident(col)}) AS d{i}"]
+            if type_ not in ('VARCHAR', 'BOOLEAN'):
+                parts += [f"min({_ident(col)}) AS lo{i}", f"max({_ident(col)}) AS hi{i}"]
+        stats = query(f"SELECT {', '.join(parts)} FROM {table}").iloc[0]
+        rows = int(stats['n'])
+
+        summaries = {}
+        for i, (col, type_) in enumerate(types.items()):
+            nulls = rows - int(stats[f'c{i}'])
+            summary = summaries[col] = {
+                'dtype': type_, 'rows': rows, 'nulls': nulls, 'null_ratio': nulls / rows if rows else 0.0,
+                'min': _catalog_value(stats.get(f'lo{i}')), 'max': _catalog_value(stats.get(f'hi{i}')),
+                'distinct': int(stats[f'd{i}']),
+            }
+            kept = col in keep_values.get(table, ())
+            if 'DATE' not in type_ and 'TIMESTAMP' not in type_ and (kept or summary['distinct'] <= max_values):
+                counts = query(
+                    f"SELECT {_ident(col)} AS value, count(*) AS n FROM {table} "
+                    f"WHERE {_ident(col)} IS NOT NULL GROUP BY 1 ORDER BY 1"
+                )
+                summary['values'] = [[_plain(_catalog_value(v)), int(n)] for v, n in zip(counts['value'], counts['n'])]
+        tables[table] = summaries
+    return DatasetCatalog(tables)
+
+
+def _catalog_path(db_path):
+    return Path(db_path).with_suffix('.catalog.json')
+
+
+# --- Загрузка: CSV/Parquet -> файл DuckDB с таблицами users и shifts ---
+
+def _spool(source, directory):
+    """Путь к файлу источника; загруженный файл (имя, байты) записывается на диск по хэшу содержимого."""
+    if not isinstance(source, tuple):
+        return Path(source), False
+    name, data = source
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{hashlib.blake2b(data, digest_size=20).hexdigest()}{Path(name).suffix.lower()}"
+    if not path.exists():
+        path.write_bytes(data)
+    return path, True
+
+
+def _source_sql(paths):
+    """SELECT по всем файлам в порядке paths: подряд идущие файлы одного формата читаются одним сканом.
+
+    CSV читается как текст (типы приводятся так же, как в convert_types), Parquet - со своими типами.
+    """
+    runs = []
+    for path in paths:
+        kind = 'parquet' if path.suffix.lower() == '.parquet' else 'csv'
+        if runs and runs[-1][0] == kind:
+            runs[-1][1].append(str(path))
+        else:
+            runs.append((kind, [str(path)]))
+    selects = []
+    for kind, files in runs:
+        listing = '[' + ', '.join("'" + f.replace("'", "''") + "'" for f in files) + ']'
+        reader = (
+            f"read_parquet({listing}, union_by_name = true)" if kind == 'parquet'
+            else f"read_csv({listing}, all_varchar = true, header = true, union_by_name = true)"
+        )
+        selects.append(f"SELECT * FROM {reader}")
+    return ' UNION ALL BY NAME '.join(selects)
+
+
+def _users_sql(source, columns):
+    """users: типы как в convert_types, сквозной user_id, счётчики смен, 'user_avg_fr' и поля удержания."""
+    typed = []
+    for col in columns:
+        if col == 'user_id':
+            continue  # Как в process_frame: user_id - номер строки
+        if is_date_column(col):
+            typed.append(f"TRY_CAST({_ident(col)} AS TIMESTAMP) AS {_ident(col)}")
+        elif is_numeric_column(col):
+            expr = _number(_ident(col))
+            # Важно: пропуски во флагах и счетчиках - нули
+            if '_flg' in col or 'frequency' in col or 'quantity' in col:
+                expr = f"coalesce({expr}, 0)"
+            typed.append(f"{expr} AS {_ident(col)}")
+        else:
+            typed.append(_ident(col))
+
+    slots = shift_slots(columns)
+    booked = [f"CAST(shift_booked_time_{i} IS NOT NULL AS INTEGER)" for i in slots] or ['0']
+    done = [
+        f"(CASE WHEN shift_booked_time_{i} IS NOT NULL THEN coalesce(job_done_{i}, 0) ELSE 0 END)"
+        if f'job_done_{i}' in columns else '0'
+        for i in slots
+    ] or ['0']
+
+    def delta(i):
+        # Как .dt.days у разности дат: целые сутки с округлением вниз
+        if f'shift_booked_time_{i}' not in columns or 'shift_booked_time_1' not in columns:
+            return "CAST(NULL AS DOUBLE)"
+        return f"floor((epoch(shift_booked_time_{i}) - epoch(shift_booked_time_1)) / 86400)"
+
+    return f"""
+        WITH typed AS (
+            SELECT {', '.join(typed)}, row_number() OVER () - 1 AS user_id FROM ({source})
+        ), counted AS (
+            SELECT *, CAST({' + '.join(booked)} AS DOUBLE) AS user_booked, CAST({' + '.join(done)} AS DOUBLE) AS user_done
+            FROM typed
+        )
+        SELECT *,
+            coalesce(user_done / nullif(user_booked, 0), 0) AS user_avg_fr,
+            {delta(2)} AS delta_1_2,
+            {delta(3)} AS delta_1_3,
+            least({delta(2)}, {delta(3)}) AS min_return_days
+        FROM counted
+    """
+
+
+def _shifts_sql(columns):
+    """shifts: melt всех слотов в "длинную" таблицу (одна строка = одна бронь), как melt_shifts."""
+    selects = []
+    for i in shift_slots(columns):
+        cols = ['user_id'] + [_ident(col) for col in _USER_COLS_IN_SHIFTS if col in columns]
+        cols += [
+            f"{_ident(f'{name}_{i}')} AS {_ident(alias)}"
+            for name, alias in _SLOT_COLS.items() if f'{name}_{i}' in columns
+        ]
+        cols.append(f"coalesce(job_done_{i}, 0) AS job_done" if f'job_done_{i}' in columns else "0.0 AS job_done")
+        cols.append(f"{i} AS shift_number")
+        selects.append(f"SELECT {', '.join(cols)} FROM users WHERE shift_booked_time_{i} IS NOT NULL")
+    return ' UNION ALL BY NAME '.join(selects)
+
+
+def _connect(path, read_only=False, memory_limit=DEFAULT_MEMORY_LIMIT):
+    temp_dir = Path(path).parent / 'tmp'
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    return duckdb.connect(str(path), read_only=read_only, config={
+        'memory_limit': memory_limit, 'temp_directory': str(temp_dir),
+    })
+
+
+def build_database(sources, db_path, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Обрабатывает CSV/Parquet-файлы (пути или пары (имя, байты)) в файл DuckDB целиком в SQL.
+
+    Файлы читаются потоково, промежуточные данные сверх memory_limit уходят во временные
+    файлы, поэтому объём выгрузки не ограничен оперативной памятью. user_id сквозной в
+    порядке sources, как у load_partitions. Возвращает число пользователей и смен.
+    """
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    spooled = [_spool(source, db_path.parent / 'uploads') for source in sources]
+    tmp_path = db_path.with_name(f'.tmp-{db_path.name}-{os.getpid()}')
+    try:
+        with _connect(tmp_path, memory_limit=memory_limit) as con:
+            source = _source_sql([path for path, _ in spooled])
+            columns = [row[0] for row in con.execute(f"DESCRIBE {source}").fetchall()]
+            if not shift_slots(columns):
+                raise ValueError("В данных нет бронирований")
+            with perf.span("SQL: типы, user_avg_fr и поля удержания", 'pipeline'):
+                con.execute(f"CREATE TABLE users AS {_users_sql(source, columns)}")
+            with perf.span("SQL: melt широкая таблица -> смены", 'pipeline'):
+                con.execute(f"CREATE TABLE shifts AS {_shifts_sql(columns)}")
+            counts = con.execute("SELECT (SELECT count(*) FROM users), (SELECT count(*) FROM shifts)").fetchone()
+            with perf.span("SQL: каталог метаданных", 'pipeline'):
+                sql_catalog(lambda sql: con.execute(sql).df()).write(_catalog_path(db_path))
+        os.replace(tmp_path, db_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        tmp_path.with_name(tmp_path.name + '.wal').unlink(missing_ok=True)
+        for path, is_upload in spooled:
+            if is_upload:
+                path.unlink(missing_ok=True)
+    return {'users': counts[0], 'shifts': counts[1]}
+
+
+def open_dataset(sources, key, db_dir=DEFAULT_DB_DIR, cache=None, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """SqlEngine по файлу DuckDB датасета key; файл строится из sources, если его ещё нет."""
+    db_path = Path(db_dir) / f'{key}.duckdb'
+    if not db_path.exists():
+        build_database(sources, db_path, memory_limit)
+    return SqlEngine(db_path, key, cache=cache, memory_limit=memory_limit)
+
+
+# --- Движок ---
+
+class SqlEngine(AnalyticsEngine):
+    """Вычисления вкладок в DuckDB: тот же интерфейс, что у AnalyticsEngine, но таблицы не в памяти.
+
+    Фильтры и группировки выполняются SQL-запросами по файлу базы, в pandas приходят
+    только их (небольшие) результаты. Каталог фильтров считается один раз при открытии.
+    """
+
+    def __init__(self, db_path, dataset_key, cache=None, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.db_path = Path(db_path)
+        self.dataset_key = dataset_key
+        self.cache = cache if cache is not None else AggregateCache()
+        self.filter_index = None
+        self.cube = None
+        # Общее соединение только для чтения; каждый запрос идёт через свой курсор (потокобезопасно)
+        self._connection = _connect(self.db_path, read_only=True, memory_limit=memory_limit)
+        self._build_catalog()
+
+    def query(self, sql, params=None):
+        """Результат SQL-запроса как DataFrame."""
+        with perf.span("SQL-запрос", 'sql'):
+            cursor = self._connection.cursor()
+            try:
+                return cursor.execute(sql, params or {}).df()
+            finally:
+                cursor.close()
+
+    def _build_catalog(self):
+        self.column_types = {}
+        for table in ('users', 'shifts'):
+            described = self.query(f"DESCRIBE {table}")
+            self.column_types[table] = dict(zip(described['column_name'], described['column_type']))
+        # Каталог метаданных считается при построении базы и лежит рядом с ней
+        catalog_path = _catalog_path(self.db_path)
+        self.catalog = DatasetCatalog.read(catalog_path)
+        if self.catalog is None:
+            self.catalog = sql_catalog(self.query)
+            try:
+                self.catalog.write(catalog_path)
+            except OSError:
+                pass
+        self.rows = {table: self.catalog.rows(table) for table in ('users', 'shifts')}
+        self.max_shift_number = int(self.catalog.tables['shifts'].get('shift_number', {}).get('max') or 0)
+
+    @property
+    def user_columns(self):
+        return list(self.column_types['users'])
+
+    @property
+    def shift_columns(self):
+        return list(self.column_types['shifts'])
+
+    def view(self, filter_spec=None):
+        return SqlView(self, self.normalize_spec(filter_spec or {}))
+
+
+class SqlView(FilterView):
+    """Датасет под спецификацией фильтров в DuckDB: агрегаты вкладок - SQL-запросы с тем же кэшем.
+
+    Отфильтрованные смены (fs) и пользователи (fu) - подзапросы с той же синхронизацией,
+    что у FilterIndex.apply: пользователь остаётся, если у него есть смена, прошедшая фильтры.
+    """
+
+    backend = 'duckdb'
+
+    def __init__(self, engine, filter_spec):
+        self.engine = engine
+        self.filter_spec = filter_spec
+        self.state_key = filter_state_key(engine.dataset_key, filter_spec)
+        self.results = {}
+        self.use_cube = False
+        self.cube_slice = None
+        self.params = {}
+        self._transitions = None
+
+        user_where = self._where('users', filter_spec['users'])
+        for col, (low, high) in filter_spec['user_ranges'].items():
+            if col in engine.column_types['users']:
+                user_where.append(
+                    f"{_ident(col)} BETWEEN {self._param(float(low))} AND {self._param(float(high))}"
+                )
+        shift_where = self._where('shifts', filter_spec['shifts'])
+        if filter_spec['dates'] is not None:
+            start, end = filter_spec['dates']
+            shift_where.append(f"CAST(shift_start_time AS DATE) BETWEEN {self._param(start)} AND {self._param(end)}")
+
+        if user_where:
+            shift_where.append(f"user_id IN (SELECT user_id FROM users WHERE {' AND '.join(user_where)})")
+        shifts_sql = f"SELECT * FROM shifts WHERE {' AND '.join(shift_where) or 'TRUE'}"
+        # Без фильтров смен у пользователя есть смена, если у него есть хотя бы одна бронь
+        has_shift = "user_id IN (SELECT user_id FROM fs)" if shift_where else "user_booked > 0"
+        users_sql = f"SELECT * FROM users WHERE {' AND '.join(user_where + [has_shift])}"
+        self.ctes = f"WITH fs AS ({shifts_sql}), fu AS ({users_sql})"
+        with perf.span("Фильтрация (SQL)", 'filter'):
+            self._empty = not self.query("SELECT EXISTS (SELECT 1 FROM fs) AS any_shift")['any_shift'].iloc[0]
+
+    def _param(self, value):
+        name = f'p{len(self.params)}'
+        self.params[name] = value
+        return f'${name}'
+
+    def _where(self, section, filters):
+        table = 'users' if section == 'users' else 'shifts'
+        types = self.engine.column_types[table]
+        conditions = []
+        for col, values in filters.items():
+            if col in types:
+                # Как isin(): строки с пропуском не проходят фильтр
+                values = [str(v) for v in values] if types[col] == 'VARCHAR' else list(values)
+                conditions.append(f"list_contains(CAST({self._param(values)} AS {types[col]}[]), {_ident(col)})")
+        return conditions
+
+    def query(self, sql):
+        """Запрос поверх отфильтрованных fs/fu."""
+        return self.engine.query(f"{self.ctes} {sql}", self.params)
+
+    @property
+    def empty(self):
+        return self._empty
+
+    def export_rows(self, table, fmt, chunk_rows=EXPORT_CHUNK_ROWS):
+        """Выгрузка fu/fs потоком пачек Arrow из результата запроса - без DataFrame в памяти."""
+        cursor = self.engine._connection.cursor()
+        try:
+            with perf.span("Выгрузка (SQL)", 'sql'):
+                reader = cursor.execute(
+                    f"{self.ctes} SELECT * FROM {'fu' if table == 'users' else 'fs'}", self.params
+                ).fetch_record_batch(chunk_rows)
+            return write_reader(reader, fmt)
+        finally:
+            cursor.close()
+
+    # --- Вкладка 1: Обзор ---
+
+    def totals(self):
+        def compute():
+            row = self.query("SELECT count(*) AS booked, coalesce(sum(job_done), 0) AS done FROM fs").iloc[0]
+            return int(row['booked']), float(row['done'])
+        return self.aggregate('totals', compute)
+
+    def fill_rate_by_shift_number(self):
+        def compute():
+            result = self.query(
+                "SELECT shift_number, avg(job_done) AS fill_rate, count(*) AS booked, sum(job_done) AS done "
+                "FROM fs GROUP BY shift_number ORDER BY shift_number"
+            )
+            result['shift_number'] = result['shift_number'].astype(str)
+            return result
+        return self.aggregate('fr_by_shift_num', compute)
+
+    def weekly_fill_rate(self):
+        def compute():
+            # Метка недели - воскресенье, как у resample('W'); пустые недели - NaN
+            weekly = self.query(
+                "SELECT date_trunc('week', shift_start_time) + INTERVAL 6 DAY AS shift_start_time, "
+                "avg(job_done) AS job_done FROM fs WHERE shift_start_time IS NOT NULL GROUP BY 1 ORDER BY 1"
+            )
+            if weekly.empty:
+                return weekly
+            weeks = pd.date_range(weekly['shift_start_time'].iloc[0], weekly['shift_start_time'].iloc[-1], freq='W')
+            return weekly.set_index('shift_start_time').reindex(weeks).rename_axis('shift_start_time').reset_index()
+        return self.aggregate('fr_dynamics', compute)
+
+    def shift_fill_rate_by(self, column):
+        def compute():
+            return self.query(
+                f"SELECT {_ident(column)}, avg(job_done) AS fill_rate, count(*) AS \"count\", sum(job_done) AS done "
+                f"FROM fs WHERE {_ident(column)} IS NOT NULL GROUP BY 1 ORDER BY \"count\" DESC, 1"
+            )
+        return self.aggregate(SHIFT_BREAKDOWNS[column], compute)
+
+    # --- Вкладка 2: Анализ смен ---
+
+    def _binned(self, table, column, bins, labels, value, aggregates):
+        """Агрегаты по корзинам pd.cut(right=False) со всеми метками (пустые корзины - NaN/0)."""
+        result = self.query(
+            f"SELECT {_bucket(_ident(column), bins)} AS bucket, {aggregates} FROM {table} "
+            f"WHERE {_ident(column)} IS NOT NULL GROUP BY 1 HAVING bucket IS NOT NULL"
+        ).set_index('bucket').reindex(range(len(labels)))
+        result.index = pd.CategoricalIndex(labels, categories=labels, ordered=True, name=value)
+        return result.reset_index()
+
+    def fill_rate_by_duration(self, bins=None):
+        bins, labels = bins_and_labels((DURATION_BINS, DURATION_LABELS), bins)
+        return self.aggregate(
+            'fr_by_duration',
+            lambda: self._binned(
+                'fs', 'duration', bins, labels, 'duration_bin',
+                'avg(job_done) AS job_done, count(*) AS booked, sum(job_done) AS done'
+            ).fillna({'booked': 0, 'done': 0}).astype({'booked': 'int64'}),
+            tuple(bins)
+        )
+
+    def distribution(self, column):
+        return self.aggregate('distribution', lambda: self._distribution_stats(column), column)
+
+    def _distribution_stats(self, column, nbins=DEFAULT_NBINS, max_outliers=DEFAULT_MAX_OUTLIERS):
+        """Как chart_data.distribution_stats: гистограммы с общими границами и box по группам job_done."""
+        values = (
+            f"SELECT CAST({_ident(column)} AS DOUBLE) AS v, CAST(job_done AS BIGINT) AS g, user_id, shift_number "
+            f"FROM fs WHERE {_ident(column)} IS NOT NULL"
+        )
+        bounds = self.query(f", d AS ({values}) SELECT min(v) AS lo, max(v) AS hi FROM d").iloc[0]
+        if pd.isna(bounds['lo']):
+            return {'edges': np.array([]), 'groups': {}}
+        edges = np.histogram_bin_edges(np.array([bounds['lo'], bounds['hi']]), bins=nbins)
+        first, step, norm = float(edges[0]), float((edges[-1] - edges[0]) / nbins), float(nbins / (edges[-1] - edges[0]))
+
+        # Номер корзины как в np.histogram: грубая оценка и поправка на границы
+        counts = self.query(
+            f", d AS ({values}), b AS ("
+            f"SELECT g, v, least(CAST(floor((v - {first!r}) * {norm!r}) AS BIGINT), {nbins - 1}) AS i FROM d) "
+            f"SELECT g, i - CAST(v < {first!r} + i * {step!r} AS BIGINT) "
+            f"+ CAST(v >= {first!r} + (i + 1) * {step!r} AND i < {nbins - 1} AS BIGINT) AS bin, count(*) AS n "
+            f"FROM b GROUP BY 1, 2"
+        )
+        boxes = self.query(
+            f", d AS ({values}), q AS ("
+            "SELECT g, quantile_cont(v, 0.25) AS q1, quantile_cont(v, 0.5) AS median, quantile_cont(v, 0.75) AS q3, "
+            "avg(v) AS mean FROM d GROUP BY g) "
+            "SELECT q.g, any_value(q1) AS q1, any_value(median) AS median, any_value(q3) AS q3, any_value(mean) AS mean, "
+            "min(v) FILTER (WHERE v >= q1 - 1.5 * (q3 - q1)) AS lowerfence, "
+            "max(v) FILTER (WHERE v <= q3 + 1.5 * (q3 - q1)) AS upperfence "
+            "FROM d JOIN q USING (g) GROUP BY q.g ORDER BY q.g"
+        )
+        # Выбросы за усами (1.5 IQR) - детерминированная выборка не больше max_outliers на группу
+        beyond = ' OR '.join(
+            f"(g = {int(box.g)} AND (v < {float(box.q1 - 1.5 * (box.q3 - box.q1))!r} "
+            f"OR v > {float(box.q3 + 1.5 * (box.q3 - box.q1))!r}))"
+            for box in boxes.itertuples(index=False)
+        )
+        outliers = self.query(
+            f", d AS ({values}) SELECT g, v FROM d WHERE {beyond} "
+            f"QUALIFY row_number() OVER (PARTITION BY g ORDER BY hash(user_id, shift_number)) <= {int(max_outliers)}"
+        )
+
+        result = {'edges': edges, 'groups': {}}
+        for box in boxes.itertuples(index=False):
+            group_counts = np.zeros(nbins, dtype='int64')
+            rows = counts[counts['g'] == box.g]
+            group_counts[rows['bin'].to_numpy(dtype='int64')] = rows['n'].to_numpy(dtype='int64')
+            result['groups'][str(box.g)] = {
+                'counts': group_counts,
+                'box': {
+                    'q1': float(box.q1), 'median': float(box.median), 'q3': float(box.q3),
+                    'lowerfence': float(box.lowerfence), 'upperfence': float(box.upperfence),
+                    'mean': float(box.mean),
+                    'outliers': np.sort(outliers.loc[outliers['g'] == box.g, 'v'].to_numpy(dtype='float64')),
+                },
+            }
+        return result
+
+    # --- Вкладка 3: Профиль работника ---
+
+    def demo_fill_rate_pivot(self):
+        def compute():
+            fr_demo = self.query(
+                "SELECT age, income, avg(user_avg_fr) AS user_avg_fr FROM fu "
+                "WHERE age IS NOT NULL AND income IS NOT NULL GROUP BY 1, 2"
+            )
+            return fr_demo.pivot(index='age', columns='income', values='user_avg_fr')
+        return self.aggregate('fr_demo_pivot', compute)
+
+    def _shift_transitions(self):
+        """Счётчики переходов между сменами как у shift_transitions: соседние смены - через lead()."""
+        if self._transitions is not None:
+            return self._transitions
+        max_slot = self.engine.max_shift_number
+        seq = (
+            "(SELECT shift_number AS step, CAST(coalesce(job_done, 0) > 0 AS BIGINT) AS done, "
+            "lead(shift_number) OVER w AS next_number, CAST(coalesce(lead(job_done) OVER w, 0) > 0 AS BIGINT) AS next_done, "
+            "date_diff('microsecond', shift_booked_time, lead(shift_booked_time) OVER w) / 86400e6 AS days "
+            "FROM fs WINDOW w AS (PARTITION BY user_id ORDER BY shift_number)) AS seq"
+        )
+        pairs = f"FROM {seq} WHERE next_number = step + 1 AND days >= 0"
+
+        counts = self.query(
+            "SELECT step, done, CASE WHEN next_number = step + 1 THEN next_done ELSE 2 END AS next, count(*) AS n "
+            f"FROM {seq} WHERE step < {int(max_slot)} GROUP BY ALL"
+        )
+        index = np.arange(max(max_slot - 1, 0) * 6)
+        steps = pd.DataFrame({'step': index // 6 + 1, 'done': index // 3 % 2, 'next': index % 3, 'count': 0})
+        codes = ((counts['step'] - 1) * 2 + counts['done']) * 3 + counts['next']
+        steps.loc[codes.to_numpy(dtype='int64'), 'count'] = counts['n'].to_numpy(dtype='int64')
+
+        paths = self.query(
+            "SELECT code, count(*) AS users FROM (SELECT CAST(sum((CAST(coalesce(job_done, 0) > 0 AS BIGINT) + 1) "
+            "* CAST(pow(3, shift_number - 1) AS BIGINT)) AS BIGINT) AS code FROM fs GROUP BY user_id) GROUP BY 1 ORDER BY 1"
+        )
+        gap_summary = self.query(
+            "SELECT step, done, count(*) AS \"count\", avg(days) AS mean, quantile_cont(days, 0.25) AS p25, "
+            f"quantile_cont(days, 0.5) AS median, quantile_cont(days, 0.75) AS p75 {pairs} GROUP BY ALL ORDER BY 1, 2"
+        )
+        gap_histogram = self.query(
+            f"SELECT step, done, {_bucket('days', NEXT_BOOKING_BINS)} AS bucket, count(*) AS \"count\" {pairs} "
+            "GROUP BY ALL HAVING bucket IS NOT NULL"
+        )
+        self._transitions = (steps, paths, gap_summary, gap_histogram)
+        return self._transitions
+
+    def flag_combinations(self, flag_cols_map):
+        """Таблица сочетаний флагов одной группировкой по всем флагам сразу (как flag_combinations)."""
+        flag_cols = [col for col in flag_cols_map if col in self.engine.column_types['users']]
+        codes = [
+            f"CAST(CASE WHEN {_ident(col)} = 1 THEN 1 WHEN {_ident(col)} = 0 THEN 0 ELSE 2 END AS UTINYINT) AS {_ident(col)}"
+            for col in flag_cols
+        ]
+        return self.query(
+            f"SELECT {', '.join(codes + [''])}count(*) AS size, count(user_avg_fr) AS n, "
+            "coalesce(sum(user_avg_fr), 0) AS sum, coalesce(sum(user_avg_fr * user_avg_fr), 0) AS sumsq "
+            f"FROM fu GROUP BY ALL"
+        )
+
+    def fill_rate_by_bins(self, column, bins=None):
+        bins, labels = bins_and_labels(ACTIVITY_BINS[column], bins)
+
+        def compute():
+            if column not in self.engine.column_types['users']:
+                return pd.DataFrame()
+            result = self._binned(
+                'fu', column, bins, labels, f'{column}_bin', 'avg(user_avg_fr) AS fill_rate, count(*) AS "count", stddev_samp(user_avg_fr) AS std'
+            )
+            result['count'] = result['count'].fillna(0).astype('int64')
+            return result
+        return self.aggregate('fr_by_bins', compute, column, tuple(bins))
+
+    def driver_frame(self, columns, max_rows, seed=0):
+        types = self.engine.column_types
+        shift_cols = [col for col in ['job_done', *columns] if col in types['shifts']]
+        user_cols = [col for col in columns if col not in shift_cols and col in types['users']]
+        select = ', '.join([f"fs.{_ident(col)}" for col in shift_cols] + [f"fu.{_ident(col)}" for col in user_cols])
+        return self.query(
+            f"SELECT {select} FROM fs JOIN fu USING (user_id) "
+            f"USING SAMPLE reservoir({int(max_rows)} ROWS) REPEATABLE ({int(seed)})"
+        )
+
+    # --- Вкладка 4: Удержание и когорты ---
+
+    def total_users_1st(self):
+        return self.aggregate(
+            'total_users_1st',
+            lambda: int(self.query("SELECT count(*) AS n FROM fu WHERE shift_booked_time_1 IS NOT NULL")['n'].iloc[0])
+        )
+
+    def cohort_retention(self):
+        def compute():
+            # Номер недели как week_index: (дни от эпохи + 3) // 7
+            weeks = (
+                ", c AS (SELECT "
+                "CAST(floor((CAST(shift_booked_time_1 AS DATE) - DATE '1970-01-01' + 3) / 7) AS BIGINT) AS cohort, "
+                "CAST(floor((CAST(shift_booked_time_2 AS DATE) - DATE '1970-01-01' + 3) / 7) AS BIGINT) AS week_2 "
+                "FROM fu WHERE shift_booked_time_1 IS NOT NULL)"
+            )
+            pairs = self.query(
+                f"{weeks} SELECT cohort, week_2 - cohort AS week_diff, count(*) AS n FROM c "
+                "WHERE week_2 IS NOT NULL GROUP BY 1, 2"
+            )
+            if pairs.empty:
+                return pd.DataFrame()
+            sizes = self.query(f"{weeks} SELECT cohort, count(*) AS n FROM c GROUP BY 1")
+            return cohort_pivot(
+                pairs.set_index(['cohort', 'week_diff'])['n'], sizes.set_index('cohort')['n']
+            )
+        return self.aggregate('cohort_pivot', compute)
+
+    def survival_curve(self, horizon=DEFAULT_RETENTION_HORIZON):
+        def compute():
+            buckets = self.query(
+                f"SELECT CAST(least(greatest(ceil(min_return_days), -1), {int(horizon) + 1}) AS BIGINT) + 1 AS bucket, "
+                "count(*) AS n FROM fu WHERE shift_booked_time_1 IS NOT NULL AND min_return_days IS NOT NULL GROUP BY 1"
+            )
+            counts = np.zeros(horizon + 3, dtype='int64')
+            counts[buckets['bucket'].to_numpy(dtype='int64')] = buckets['n'].to_numpy(dtype='int64')
+            return survival_from_buckets(counts, self.total_users_1st(), horizon)
+        return self.aggregate('survival_curve', compute, horizon)
@@ -0,0 +1,206 @@
+import math
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+import perf
+from ingest import submit_to_pool
+
+# Уровень доверия интервалов и попарных сравнений по умолчанию
+DEFAULT_CONFIDENCE = 0.95
+INTERVAL_METHODS = ('wilson', 'bootstrap')
+# Бутстрэп: число выборок и размер пачки (одна матрица выборки x группы)
+DEFAULT_RESAMPLES = 2000
+BOOTSTRAP_BATCH = 500
+# Процессов для бутстрэпа (FR_DASHBOARD_BOOTSTRAP_WORKERS); 1 - в текущем процессе
+DEFAULT_WORKERS = int(os.environ.get('FR_DASHBOARD_BOOTSTRAP_WORKERS', '1'))
+
+_erfc = np.vectorize(math.erfc, otypes=[float])
+
+
+def z_value(confidence):
+    """Квантиль нормального распределения для двустороннего интервала уровня confidence."""
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def two_sided_p(z):
+    """Двустороннее p-значение z-статистики (NaN остаётся NaN)."""
+    z = np.asarray(z, dtype=float)
+    p = np.full(z.shape, np.nan)
+    finite = np.isfinite(z)
+    p[finite] = _erfc(np.abs(z[finite]) / math.sqrt(2))
+    return p
+
+
+def holm_adjust(p_values):
+    """Поправка Холма на множественные сравнения (NaN не участвуют)."""
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    finite = np.flatnonzero(np.isfinite(p_values))
+    order = finite[np.argsort(p_values[finite], kind='stable')]
+    steps = (len(order) - np.arange(len(order))) * p_values[order]
+    adjusted[order] = np.minimum(np.maximum.accumulate(steps), 1.0)
+    return adjusted
+
+
+# --- Интервалы ---
+
+def wilson_interval(successes, trials, confidence=DEFAULT_CONFIDENCE):
+    """Интервал Уилсона для долей successes / trials (векторно; при trials == 0 - NaN)."""
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    z = z_value(confidence)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = successes / trials
+        denominator = 1 + z**2 / trials
+        center = (p + z**2 / (2 * trials)) / denominator
+        half = z * np.sqrt(p * (1 - p) / trials + z**2 / (4 * trials**2)) / denominator
+    return center - half, center + half
+
+
+def normal_interval(mean, std, count, confidence=DEFAULT_CONFIDENCE):
+    """Нормальный интервал для средних: mean ± z * std / sqrt(count) (NaN, если count < 2)."""
+    mean = np.asarray(mean, dtype=float)
+    count = np.asarray(count, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half = z_value(confidence) * np.asarray(std, dtype=float) / np.sqrt(count)
+    half = np.where(count >= 2, half, np.nan)
+    return mean - half, mean + half
+
+
+def _bootstrap_batch(successes, trials, resamples, seed):
+    """Пачка бутстрэп-долей (resamples x группы) для непустых групп - функция верхнего уровня для pickle."""
+    rng = np.random.default_rng(seed)
+    return rng.binomial(trials, successes / trials, size=(resamples, len(trials))) / trials
+
+
+def bootstrap_interval(successes, trials, confidence=DEFAULT_CONFIDENCE, resamples=DEFAULT_RESAMPLES,
+                       seed=0, workers=DEFAULT_WORKERS):
+    """Перцентильный бутстрэп-интервал долей всех групп сразу.
+
+    Выборка n исходов 0/1 группы с возвращением - это Binomial(n, k/n), поэтому пачка
+    выборок для всех групп - одна матрица rng.binomial без сырых смен. При workers > 1
+    пачки считаются в общем пуле процессов (ingest.submit_to_pool), который живёт между
+    вызовами; у каждой пачки своё зерно из SeedSequence(seed), так что результат не зависит
+    от числа процессов.
+    """
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=np.int64)
+    low, high = np.full(len(trials), np.nan), np.full(len(trials), np.nan)
+    groups = np.flatnonzero(trials > 0)
+    if not len(groups):
+        return low, high
+    successes, trials = successes[groups], trials[groups]
+    sizes = [min(BOOTSTRAP_BATCH, resamples - start) for start in range(0, resamples, BOOTSTRAP_BATCH)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    with perf.span(f"Бутстрэп: {resamples} выборок x {len(trials)} групп", 'stats'):
+        if workers > 1 and len(sizes) > 1:
+            # Общий пул процессов живёт между вызовами: интерпретаторы не запускаются заново
+            futures = [
+                submit_to_pool('bootstrap', workers, _bootstrap_batch, successes, trials, size, s)
+                for size, s in zip(sizes, seeds)
+            ]
+            batches = [future.result() for future in futures]
+        else:
+            batches = [_bootstrap_batch(successes, trials, size, s) for size, s in zip(sizes, seeds)]
+
+        tail = (1 - confidence) / 2
+        low[groups], high[groups] = np.quantile(np.vstack(batches), [tail, 1 - tail], axis=0)
+    return low, high
+
+
+# --- Разбивки Fill Rate ---
+
+def _proportions(agg):
+    """(выполнено, забронировано) для разбивок по сменам или None для средних по пользователям."""
+    trials_col = 'booked' if 'booked' in agg.columns else 'count'
+    if 'done' not in agg.columns or trials_col not in agg.columns:
+        return None
+    return agg['done'].fillna(0).to_numpy(dtype=float), agg[trials_col].fillna(0).to_numpy(dtype=float)
+
+
+def fill_rate_intervals(agg, method='wilson', confidence=DEFAULT_CONFIDENCE, resamples=DEFAULT_RESAMPLES,
+                        workers=DEFAULT_WORKERS):
+    """Копия разбивки Fill Rate с колонками ci_low / ci_high.
+
+    Доли по сменам (колонки done и booked/count) - интервал Уилсона или бутстрэп.
+    Средний user_avg_fr по пользователям (fill_rate, std, count) - нормальный интервал:
+    по сводным статистикам бутстрэп средних не построить, а группы пользователей большие.
+    """
+    result = agg.copy()
+    if result.empty:
+        return result.assign(ci_low=pd.Series(dtype=float), ci_high=pd.Series(dtype=float))
+
+    counts = _proportions(result)
+    if counts is None:
+        low, high = normal_interval(result['fill_rate'], result['std'], result['count'].fillna(0), confidence)
+    elif method == 'bootstrap':
+        low, high = bootstrap_interval(*counts, confidence, resamples, workers=workers)
+    else:
+        low, high = wilson_interval(*counts, confidence)
+    result['ci_low'], result['ci_high'] = low, high
+    return result
+
+
+def _estimates(agg):
+    """Оценка, её дисперсия и размер группы для попарных сравнений."""
+    counts = _proportions(agg)
+    if counts is None:
+        count = agg['count'].fillna(0).to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = agg['std'].to_numpy(dtype=float) ** 2 / count
+        return agg['fill_rate'].to_numpy(dtype=float), variance, count, None
+    successes, trials = counts
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = successes / trials
+        return p, p * (1 - p) / trials, trials, successes
+
+
+def _pairs(agg, label, confidence):
+    """Все пары групп разбивки: разница, её интервал и z-тест (для долей - с объединённой дисперсией)."""
+    estimate, variance, size, successes = _estimates(agg)
+    first, second = np.triu_indices(len(agg), k=1)
+    valid = (size[first] >= 2) & (size[second] >= 2)
+    first, second = first[valid], second[valid]
+
+    diff = estimate[first] - estimate[second]
+    se = np.sqrt(variance[first] + variance[second])
+    test_se = se
+    if successes is not None:
+        pooled = (successes[first] + successes[second]) / (size[first] + size[second])
+        test_se = np.sqrt(pooled * (1 - pooled) * (1 / size[first] + 1 / size[second]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(test_se > 0, diff / test_se, np.nan)
+    half = z_value(confidence) * se
+
+    labels = agg[label].astype(str).to_numpy()
+    return pd.DataFrame({
+        'group_a': labels[first], 'group_b': labels[second], 'diff': diff,
+        'diff_low': diff - half, 'diff_high': diff + half, 'z': z, 'p_value': two_sided_p(z),
+    })
+
+
+def fill_rate_tests(agg, label, within=None, confidence=DEFAULT_CONFIDENCE):
+    """Попарные z-тесты разности Fill Rate между группами разбивки с поправкой Холма.
+
+    label - колонка с названием группы; within - колонка, внутри значений которой
+    сравниваются группы (например, Да/Нет внутри каждого флага). Пары, где в одной из
+    групп меньше двух наблюдений, не сравниваются.
+    """
+    columns = ['group_a', 'group_b', 'diff', 'diff_low', 'diff_high', 'z', 'p_value']
+    parts = []
+    for name, part in (agg.groupby(within, sort=False, observed=True) if within else [(None, agg)]):
+        pairs = _pairs(part.reset_index(drop=True), label, confidence)
+        if within:
+            pairs.insert(0, within, name)
+        parts.append(pairs)
+    if not parts:
+        return pd.DataFrame(columns=([within] if within else []) + columns + ['p_holm', 'significant'])
+
+    tests = pd.concat(parts, ignore_index=True)
+    tests['p_holm'] = holm_adjust(tests['p_value'])
+    tests['significant'] = tests['p_holm'] < 1 - confidence
+    return tests.sort_values('p_value', kind='stable', ignore_index=True)
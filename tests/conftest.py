@@ -0,0 +1,32 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+# Хранилище датасетов и файлы DuckDB тестов (в том числе запусков дашборда) - не в кэше пользователя
+_TEST_CACHE_DIR = tempfile.mkdtemp(prefix='fr_dashboard_tests_')
+atexit.register(shutil.rmtree, _TEST_CACHE_DIR, True)
+os.environ.setdefault('FR_DASHBOARD_STORE_DIR', os.path.join(_TEST_CACHE_DIR, 'datasets'))
+os.environ.setdefault('FR_DASHBOARD_DUCKDB_DIR', os.path.join(_TEST_CACHE_DIR, 'duckdb'))
+
+from benchmarks.generate_data import generate_chunk
+from ingest import process_frame
+
+# Пользователей в синтетической выгрузке общих фикстур
+USERS = 2_000
+
+
+@pytest.fixture(scope='session')
+def raw_users():
+    """"Широкая" синтетическая выгрузка (одна строка - пользователь, до 3 смен). Не изменять."""
+    return generate_chunk(USERS, np.random.default_rng(11))
+
+
+@pytest.fixture(scope='session')
+def tables(raw_users):
+    """(df_users, long_shifts_df) обработанной выгрузки. Не изменять."""
+    df_users, df_shifts, _ = process_frame(raw_users.copy())
+    return df_users, df_shifts
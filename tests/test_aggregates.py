@@ -0,0 +1,313 @@
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import (
+    AggregateCache, _estimate_size, cohort_retention, fill_rate_by, fill_rate_by_flags, filter_state_key,
+    flag_combinations, flag_interactions, shift_transitions, survival_curve, survival_from_buckets, top_n
+)
+from engine import INTERACTION_FLAGS, NEXT_BOOKING_BINS, PROFILE_FLAGS
+
+
+def frame(rows):
+    return pd.DataFrame({'value': np.arange(rows, dtype='float64')})
+
+
+def test_state_key_ignores_selection_order():
+    spec = {'user_filters': {'region': ['Б', 'А'], 'age': ['25-34']}, 'date_range': (date(2024, 1, 1), date(2024, 2, 1))}
+    same = {'date_range': (date(2024, 1, 1), date(2024, 2, 1)), 'user_filters': {'age': ['25-34'], 'region': ['А', 'Б']}}
+    assert filter_state_key('data', spec) == filter_state_key('data', same)
+    assert filter_state_key('data', spec) != filter_state_key('other', spec)
+    assert filter_state_key('data', spec) != filter_state_key('data', {**spec, 'user_filters': {'region': ['А']}})
+
+
+def test_lru_byte_limit():
+    entry_bytes = _estimate_size(frame(100))
+    cache = AggregateCache(max_bytes=2 * entry_bytes)
+    cache.put(('a', 'x'), frame(100))
+    cache.put(('b', 'x'), frame(100))
+    # Обращение к a делает самой старой запись b - её и вытесняет третья
+    assert cache.get(('a', 'x')) is not None
+    cache.put(('c', 'x'), frame(100))
+    assert cache.get(('b', 'x')) is None
+    assert cache.get(('a', 'x')) is not None and cache.get(('c', 'x')) is not None
+    assert cache.stats()['bytes'] == 2 * entry_bytes <= cache.max_bytes
+
+    # Запись больше лимита вытесняет всё остальное, но сама остаётся
+    cache.put(('big', 'x'), frame(1000))
+    assert cache.stats()['entries'] == 1 and cache.get(('big', 'x')) is not None
+
+
+def test_get_or_compute_counts_and_failures():
+    cache = AggregateCache()
+    calls = []
+    compute = lambda: calls.append(1) or frame(10)
+    first = cache.get_or_compute(('s', 'agg'), compute)
+    assert cache.get_or_compute(('s', 'agg'), compute) is first
+    assert len(calls) == 1 and cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    # Ошибка вычисления не кэшируется и не блокирует ключ
+    def failing():
+        raise RuntimeError('boom')
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute(('s', 'bad'), failing)
+    assert cache.get_or_compute(('s', 'bad'), compute) is not None
+
+
+def test_parallel_requests_compute_once():
+    cache = AggregateCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return frame(10)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(('s', 'agg'), slow))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1 and len(results) == 4
+    assert all(result is results[0] for result in results)
+
+
+def test_copy_states_and_named():
+    cache = AggregateCache()
+    cache.put(('old', 'weekly'), frame(5))
+    cache.put(('old', 'region', 10), frame(5))
+    cache.put(('other', 'weekly'), frame(3))
+    assert cache.copy_states({'old': 'new'}) == 2
+    assert cache.get(('new', 'weekly')) is cache.get(('old', 'weekly'))
+    assert sorted(state for state, _ in cache.named('weekly')) == ['new', 'old', 'other']
+
+
+def test_top_n_cuts_full_aggregate(tables):
+    _, df_shifts = tables
+    full = fill_rate_by(df_shifts, 'shift_region')
+    expected = (
+        df_shifts.groupby('shift_region', observed=True)['job_done'].agg(fill_rate='mean', count='size', done='sum')
+        .nlargest(5, 'count', keep='first').sort_values('fill_rate', ascending=False)
+    )
+    actual = top_n(full, 5)
+    assert list(actual['shift_region'].astype(str)) == list(expected.index.astype(str))
+    np.testing.assert_allclose(actual['fill_rate'], expected['fill_rate'])
+
+
+# --- Удержание и когорты: сверка с исходными циклами дашборда ---
+
+def loop_cohort_pivot(users, max_cohorts=15, max_weeks=12):
+    """Исходный расчёт когорт через Period('W')."""
+    cohort_data = users.dropna(subset=['shift_booked_time_1']).reset_index(drop=True)
+    cohort_data['cohort_week'] = cohort_data['shift_booked_time_1'].dt.to_period('W')
+    cohort_data['event_week'] = cohort_data['shift_booked_time_2'].dt.to_period('W')
+    cohort_size = cohort_data.groupby('cohort_week')['user_id'].nunique().rename('cohort_size').reset_index()
+    cohort_data['week_diff'] = [
+        (event - cohort).n if pd.notna(event) else np.nan
+        for event, cohort in zip(cohort_data['event_week'], cohort_data['cohort_week'])
+    ]
+    retention = cohort_data.dropna(subset=['week_diff']).groupby(['cohort_week', 'week_diff'])['user_id'].nunique().reset_index()
+    analysis = pd.merge(retention, cohort_size, on='cohort_week')
+    analysis['retention'] = analysis['user_id'] / analysis['cohort_size']
+    pivot = analysis.pivot_table(index='cohort_week', columns='week_diff', values='retention')
+    return pivot.iloc[-max_cohorts:, :max_weeks]
+
+
+def loop_survival(min_return_days, horizon):
+    """Исходный расчёт: фильтрация всех пользователей на каждый день."""
+    values = pd.Series(min_return_days, dtype='float64')
+    return pd.DataFrame({
+        'day': range(horizon + 1),
+        'retention_percent': [((values.isna()) | (values > day)).sum() / len(values) for day in range(horizon + 1)],
+    })
+
+
+def handmade_users():
+    first = pd.to_datetime([
+        '2023-12-29', '2023-12-31', '2024-01-01', '2024-01-03', '2024-01-03', '2024-01-10', '2024-01-14', None, '2024-03-01'
+    ])
+    # Без 2-й брони, в ту же неделю, через год и "раньше 1-й"
+    second = pd.to_datetime([
+        '2024-01-02', None, '2024-01-07', '2024-01-08', None, '2025-01-20', '2024-01-12', '2024-01-05', None
+    ])
+    return pd.DataFrame({'user_id': range(len(first)), 'shift_booked_time_1': first, 'shift_booked_time_2': second})
+
+
+@pytest.mark.parametrize('source', ['fixture', 'handmade'])
+def test_cohort_retention_matches_loop(tables, source):
+    users = tables[0] if source == 'fixture' else handmade_users()
+    expected, actual = loop_cohort_pivot(users), cohort_retention(users)
+    assert list(actual.index) == [str(period) for period in expected.index]
+    assert list(actual.columns) == [int(week) for week in expected.columns]
+    np.testing.assert_allclose(actual.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'), equal_nan=True)
+
+    # Ограничение вывода режет те же когорты и недели
+    expected, actual = loop_cohort_pivot(users, 2, 1), cohort_retention(users, 2, 1)
+    assert actual.shape == expected.shape
+    np.testing.assert_allclose(actual.to_numpy(dtype='float64'), expected.to_numpy(dtype='float64'), equal_nan=True)
+
+
+def test_cohort_retention_without_returns():
+    users = handmade_users().assign(shift_booked_time_2=pd.NaT)
+    assert cohort_retention(users).empty
+
+
+@pytest.mark.parametrize('horizon', [0, 30, 90])
+def test_survival_curve_matches_loop(tables, horizon):
+    users = tables[0]
+    fixture_days = users.loc[users['shift_booked_time_1'].notna(), 'min_return_days'].to_numpy()
+    # Не вернувшиеся, дробные дни, возврат за горизонтом и "раньше 1-й брони"
+    handmade_days = np.array([np.nan, 0, 0.5, 1, 29.9, 30, 31, 200, -2, np.nan])
+    for days in (fixture_days, handmade_days):
+        expected = loop_survival(days, horizon)
+        pd.testing.assert_frame_equal(survival_curve(days, horizon), expected, check_dtype=False)
+
+        # Корзины, которые SQL-бэкенд считает сам: 0 - до дня 0, d + 1 - день d, horizon + 2 - позже
+        returned = days[~np.isnan(days)]
+        buckets = np.zeros(horizon + 3, dtype='int64')
+        for value in returned:
+            buckets[min(max(int(np.ceil(value)), -1), horizon + 1) + 1] += 1
+        pd.testing.assert_frame_equal(survival_from_buckets(buckets, len(days), horizon), expected, check_dtype=False)
+
+
+def test_survival_curve_without_users():
+    curve = survival_curve(np.array([]), 5)
+    assert list(curve['retention_percent']) == [0.0] * 6
+
+
+# --- Переходы между сменами: сверка с циклом по пользователям ---
+
+def loop_transitions(shifts, max_slot, gap_bins):
+    """Счётчики shift_transitions, посчитанные по каждому пользователю отдельно."""
+    steps, paths, gaps = {}, {}, {}
+    for _, user in shifts.groupby('user_id'):
+        slots = {
+            int(row.shift_number): (int(row.job_done > 0), row.shift_booked_time) for row in user.itertuples()
+        }
+        code = sum((done + 1) * 3 ** (number - 1) for number, (done, _) in slots.items())
+        paths[code] = paths.get(code, 0) + 1
+        for number, (done, booked) in slots.items():
+            if number >= max_slot:
+                continue
+            following = slots.get(number + 1)
+            key = (number, done, following[0] if following else 2)
+            steps[key] = steps.get(key, 0) + 1
+            if following is not None:
+                days = (following[1] - booked) / pd.Timedelta(days=1)
+                if days >= 0:
+                    gaps.setdefault((number, done), []).append(days)
+
+    steps = pd.DataFrame(
+        [(step, done, following, steps.get((step, done, following), 0))
+         for step in range(1, max_slot) for done in (0, 1) for following in (0, 1, 2)],
+        columns=['step', 'done', 'next', 'count']
+    )
+    paths = pd.DataFrame(sorted(paths.items()), columns=['code', 'users'])
+    summary = pd.DataFrame([
+        (step, done, len(days), np.mean(days), *np.quantile(days, [0.25, 0.5, 0.75]))
+        for (step, done), days in sorted(gaps.items())
+    ], columns=['step', 'done', 'count', 'mean', 'p25', 'median', 'p75'])
+    histogram = []
+    for (step, done), days in sorted(gaps.items()):
+        buckets = pd.cut(days, gap_bins, right=False, labels=False)
+        for bucket, count in sorted(pd.Series(buckets).dropna().astype(int).value_counts().items()):
+            histogram.append((step, done, bucket, count))
+    histogram = pd.DataFrame(histogram, columns=['step', 'done', 'bucket', 'count'])
+    return steps, paths, summary, histogram
+
+
+def handmade_shifts():
+    """Пять слотов: пропуск слота, дубль исхода, NaT, бронь "раньше предыдущей" и пользователь без 1-й смены."""
+    rows = [
+        (0, 1, 1, '2024-01-01'), (0, 2, 0, '2024-01-01 12:00'), (0, 3, 1, '2024-01-09'), (0, 4, 1, '2024-03-20'),
+        (0, 5, 0, '2024-03-21'),
+        (1, 1, 0, '2024-01-05'), (1, 3, 1, '2024-01-06'),
+        (2, 1, 1, '2024-02-01'), (2, 2, 1, None), (2, 3, 0, '2024-02-10'),
+        (3, 1, 1, '2024-02-01'), (3, 2, 0, '2024-01-20'),
+        (4, 2, 1, '2024-02-01'), (4, 3, 1, '2024-02-02'),
+        (5, 1, 1, '2024-04-01'),
+    ]
+    shifts = pd.DataFrame(rows, columns=['user_id', 'shift_number', 'job_done', 'shift_booked_time'])
+    shifts['shift_booked_time'] = pd.to_datetime(shifts['shift_booked_time'], format='ISO8601')
+    # Порядок строк не важен - перемешиваем
+    return shifts.sample(frac=1, random_state=0).astype({'job_done': 'uint8', 'shift_number': 'uint8'})
+
+
+@pytest.mark.parametrize('source', ['fixture', 'handmade'])
+def test_shift_transitions_match_loop(tables, source):
+    # Из фикстуры - первые 500 пользователей: цикл по пользователям медленный
+    shifts = tables[1].query('user_id < 500') if source == 'fixture' else handmade_shifts()
+    max_slot = int(shifts['shift_number'].max())
+    actual = shift_transitions(shifts, max_slot, NEXT_BOOKING_BINS)
+    expected = loop_transitions(shifts, max_slot, NEXT_BOOKING_BINS)
+    for name, expected_part, actual_part in zip(['steps', 'paths', 'gap_summary', 'gap_histogram'], expected, actual):
+        pd.testing.assert_frame_equal(
+            actual_part.reset_index(drop=True), expected_part, check_dtype=False, obj=name
+        )
+
+
+# --- Флаги: сверка компактной таблицы сочетаний с группировками по пользователям ---
+
+def flag_codes(users, flag_cols):
+    """Значения флагов как в flag_combinations: 0 - нет, 1 - да, 2 - пропуск или другое."""
+    return pd.DataFrame({
+        col: np.select([users[col] == 0, users[col] == 1], [0, 1], 2) for col in flag_cols
+    }, index=users.index)
+
+
+@pytest.fixture(scope='module')
+def flag_users(tables):
+    users = tables[0].copy()
+    # Значение, которое не 0 и не 1, считается пропуском
+    users.loc[users.index[:5], 'opened_push_flg'] = 7
+    return users
+
+
+def test_flag_combinations_match_groupby(flag_users):
+    flag_cols = sorted(INTERACTION_FLAGS)
+    combinations = flag_combinations(flag_users, flag_cols)
+    fr = flag_users['user_avg_fr']
+    expected = pd.concat([flag_codes(flag_users, flag_cols), fr.rename('fr')], axis=1).groupby(flag_cols)['fr'].agg(
+        size='size', n='count', sum='sum', sumsq=lambda values: (values ** 2).sum()
+    ).reset_index()
+    pd.testing.assert_frame_equal(combinations, expected, check_dtype=False)
+    assert combinations['size'].sum() == len(flag_users)
+
+
+def test_fill_rate_by_flags_matches_melt(flag_users):
+    combinations = flag_combinations(flag_users, sorted(PROFILE_FLAGS))
+    actual = fill_rate_by_flags(combinations, PROFILE_FLAGS)
+
+    melted = flag_users.melt(id_vars=['user_id', 'user_avg_fr'], value_vars=list(PROFILE_FLAGS))
+    expected = melted.groupby(['variable', 'value'])['user_avg_fr'].agg(
+        fill_rate='mean', count='size', std='std'
+    ).reset_index()
+    expected['variable'] = expected['variable'].map(PROFILE_FLAGS)
+    expected['value'] = expected['value'].map({0.0: 'Нет', 1.0: 'Да'})
+    expected = expected.dropna(subset=['value']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_dtype=False)
+
+
+def test_flag_interactions_match_masks(flag_users):
+    flags = {col: INTERACTION_FLAGS[col] for col in sorted(INTERACTION_FLAGS)[:4]}
+    interactions = flag_interactions(flag_combinations(flag_users, sorted(flags)), flags)
+    labels = {label: col for col, label in flags.items()}
+    assert len(interactions) == 6
+    for row in interactions.itertuples():
+        a, b = flag_users[labels[row.flag_a]], flag_users[labels[row.flag_b]]
+        cell = lambda value_a, value_b: flag_users.loc[(a == value_a) & (b == value_b), 'user_avg_fr'].mean()
+        assert row.count_both == ((a == 1) & (b == 1)).sum()
+        np.testing.assert_allclose(
+            [row.fr_both, row.fr_a_only, row.fr_b_only, row.fr_neither], [cell(1, 1), cell(1, 0), cell(0, 1), cell(0, 0)],
+            rtol=1e-6  # user_avg_fr - float32
+        )
+        assert row.interaction == pytest.approx(row.fr_both - row.fr_a_only - row.fr_b_only + row.fr_neither)
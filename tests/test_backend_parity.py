@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sql_engine
+from benchmarks.generate_data import generate_csv
+from benchmarks.run_benchmarks import random_specs
+from engine import AnalyticsEngine
+from ingest import load_sources
+
+if sql_engine.duckdb is None:
+    pytest.skip("duckdb не установлен", allow_module_level=True)
+
+# Пользователей в синтетической выгрузке и случайных наборов фильтров сверх стандартного и пустого
+USERS = 3_000
+RANDOM_SPECS = 6
+RETENTION_HORIZONS = (30, 90)
+
+
+@pytest.fixture(scope='module')
+def engines(tmp_path_factory):
+    """Движки pandas и DuckDB на одной синтетической выгрузке."""
+    directory = tmp_path_factory.mktemp('parity')
+    path = str(generate_csv(directory / 'users.csv', USERS, seed=7))
+    df_users, df_shifts, _ = load_sources([path])
+    pandas_engine = AnalyticsEngine.from_tables(df_users, df_shifts, 'parity')
+    sql = sql_engine.open_dataset([path], 'parity', db_dir=directory / 'duckdb')
+    return pandas_engine, sql
+
+
+def _plain_labels(df):
+    """Категории и object-значения - строками: бэкенды возвращают метки разных типов."""
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) or df[col].dtype == object:
+            df[col] = df[col].astype(str)
+    for axis in ('index', 'columns'):
+        labels = getattr(df, axis)
+        if isinstance(labels, pd.CategoricalIndex) or labels.dtype == object:
+            setattr(df, axis, labels.astype(str))
+    return df
+
+
+def assert_same(name, expected, actual):
+    if isinstance(expected, pd.DataFrame):
+        expected, actual = _plain_labels(expected), _plain_labels(actual)
+        if name != 'fr_demo_pivot':
+            # У сводной таблицы индекс - метки возраста, у остальных - номер строки
+            expected, actual = expected.reset_index(drop=True), actual.reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            expected, actual, check_dtype=False, check_index_type=False, check_column_type=False,
+            check_names=False, rtol=1e-6
+        )
+    elif isinstance(expected, dict):
+        # Данные гистограммы и ящика с усами распределения
+        np.testing.assert_allclose(expected['edges'], actual['edges'])
+        assert list(expected['groups']) == list(actual['groups'])
+        for group, stats in expected['groups'].items():
+            other = actual['groups'][group]
+            np.testing.assert_array_equal(stats['counts'], other['counts'])
+            for key in ('q1', 'median', 'q3', 'lowerfence', 'upperfence', 'mean'):
+                assert np.isclose(stats['box'][key], other['box'][key]), (group, key)
+            np.testing.assert_allclose(np.sort(stats['box']['outliers']), np.sort(other['box']['outliers']))
+    else:
+        np.testing.assert_allclose(np.asarray(expected, dtype=float), np.asarray(actual, dtype=float))
+
+
+def test_default_spec_matches(engines):
+    pandas_engine, sql = engines
+    assert pandas_engine.default_spec() == sql.default_spec()
+
+
+@pytest.mark.parametrize('spec_index', range(2 + RANDOM_SPECS))
+def test_compute_all_matches(engines, spec_index):
+    pandas_engine, sql = engines
+    spec = ([pandas_engine.default_spec(), {}] + random_specs(pandas_engine, RANDOM_SPECS, seed=1))[spec_index]
+    expected_view, actual_view = pandas_engine.view(spec), sql.view(spec)
+    assert expected_view.state_key == actual_view.state_key
+    assert expected_view.empty == actual_view.empty
+    if expected_view.empty:
+        return
+
+    expected = expected_view.compute_all(RETENTION_HORIZONS)
+    actual = actual_view.compute_all(RETENTION_HORIZONS)
+    assert list(expected) == list(actual)
+    for key, value in expected.items():
+        assert_same(key[1], value, actual[key])
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_data import AGES, generate_chunk, generate_csv
+from benchmarks.run_benchmarks import bench_dataset, random_specs
+from engine import AnalyticsEngine
+from ingest import load_csv, shift_slots
+
+
+def test_generated_csv_is_deterministic(tmp_path):
+    first = generate_csv(tmp_path / 'a.csv', 1_500, seed=5, chunk_size=600)
+    second = generate_csv(tmp_path / 'b.csv', 1_500, seed=5, chunk_size=600)
+    other = generate_csv(tmp_path / 'c.csv', 1_500, seed=6, chunk_size=600)
+    assert first.read_bytes() == second.read_bytes()
+    assert first.read_bytes() != other.read_bytes()
+    assert len(pd.read_csv(first)) == 1_500
+
+
+def test_generated_data_fits_the_pipeline(tmp_path):
+    chunk = generate_chunk(3_000, np.random.default_rng(0))
+    assert shift_slots(chunk.columns) == [1, 2, 3]
+    assert set(chunk['age'].dropna()) <= set(AGES) and chunk['age'].isna().any()
+
+    path = generate_csv(tmp_path / 'users.csv', 3_000, seed=0)
+    with open(path, 'rb') as file_obj:
+        df_users, df_shifts, _ = load_csv(file_obj)
+    assert len(df_users) == 3_000 and len(df_shifts) > len(df_users) / 2
+    assert 0 < df_shifts['job_done'].mean() < 1
+    # Смена k+1 бронируется не раньше смены k
+    gaps = df_users['delta_1_2'].dropna()
+    assert len(gaps) and (gaps >= 0).all()
+
+
+def test_random_specs_are_seeded(tables):
+    df_users, df_shifts = tables
+    engine = AnalyticsEngine.from_tables(df_users, df_shifts, 'bench-test')
+    specs = random_specs(engine, 3, seed=1)
+    assert specs == random_specs(engine, 3, seed=1)
+    for spec in specs:
+        low, high = spec['dates']
+        assert low <= high and all(values for values in spec['users'].values())
+
+
+def test_bench_dataset_times_every_stage(tmp_path):
+    path = generate_csv(tmp_path / 'users.csv', 2_000, seed=1)
+    shifts, results = bench_dataset(path, trace_memory=False, filter_specs=2)
+    stages = [row['stage'] for row in results]
+    assert shifts > 0 and len(stages) == len(set(stages))
+    assert {'load_csv', 'filter_index_build', 'aggregates_default_cold', 'aggregates_default_warm'} <= set(stages)
+    assert all(row['seconds'] >= 0 and row['peak_mb'] is None for row in results)
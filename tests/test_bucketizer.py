@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bucketizer import NO_BUCKET, Bucketizer, bin_labels, bucket_codes, parse_bins
+from engine import ACTIVITY_BINS, DURATION_BINS
+
+ALL_BINS = {'duration': DURATION_BINS, **{col: bins for col, (bins, _) in ACTIVITY_BINS.items()}}
+
+
+def cut_codes(values, bins):
+    """Коды корзин pd.cut(right=False), NO_BUCKET для NaN."""
+    codes = pd.cut(pd.Series(values, dtype='float64'), bins, right=False, labels=False)
+    return codes.fillna(NO_BUCKET).astype('uint8').to_numpy()
+
+
+@pytest.mark.parametrize('name', list(ALL_BINS))
+def test_codes_match_pd_cut(name):
+    bins = ALL_BINS[name]
+    finite = [b for b in bins if np.isfinite(b)]
+    # Точно на границах, рядом с ними, за пределами, пропуски и бесконечности
+    values = np.concatenate([
+        finite, np.nextafter(finite, -np.inf), np.nextafter(finite, np.inf),
+        [-100, -1, 0, 0.5, 3.2, 23.99, 24, 1e9, np.nan, -np.inf, np.inf],
+        np.random.default_rng(0).uniform(-5, 80, 500),
+    ])
+    codes = bucket_codes(values, bins)
+    assert codes.dtype == np.uint8
+    np.testing.assert_array_equal(codes, cut_codes(values, bins))
+    assert codes[np.isnan(values)].tolist() == [NO_BUCKET]
+
+
+def test_moments_match_groupby(tables):
+    df_users, df_shifts = tables
+    bucketizer = Bucketizer({'users': df_users, 'shifts': df_shifts})
+    mask = (df_shifts['task_group'] == 'Склад').to_numpy()
+    size, n, total, _ = bucketizer.moments('shifts', 'duration', DURATION_BINS, 'job_done', mask)
+
+    shifts = df_shifts[mask]
+    expected = shifts.groupby(pd.cut(shifts['duration'], DURATION_BINS, right=False), observed=False)['job_done'].agg(
+        ['size', 'count', 'sum']
+    )
+    np.testing.assert_array_equal(size, expected['size'])
+    np.testing.assert_array_equal(n, expected['count'])
+    np.testing.assert_allclose(total, expected['sum'])
+
+    # Коды считаются один раз на (таблица, колонка, границы)
+    assert bucketizer.codes('shifts', 'duration', DURATION_BINS) is bucketizer.codes('shifts', 'duration', DURATION_BINS)
+
+
+def test_code_sets_are_bounded(tables):
+    df_users, _ = tables
+    bucketizer = Bucketizer({'users': df_users}, max_code_sets=2)
+    first = bucketizer.codes('users', 'serp_frequency', [0, 1, 2])
+    bucketizer.codes('users', 'serp_frequency', [0, 5, 10])
+    bucketizer.codes('users', 'serp_frequency', [0, 10, 20])
+    assert bucketizer.codes('users', 'serp_frequency', [0, 1, 2]) is not first
+
+
+def test_labels_and_parsing():
+    assert bin_labels(ACTIVITY_BINS['serp_frequency'][0]) == ['<1', '1-4', '5-9', '10-19', '20+']
+    assert bin_labels([0, 1, 5, np.inf]) == ['0', '1-4', '5+']
+    assert bin_labels([0, 0.5, 1.5]) == ['0-0.5', '0.5-1.5']
+    assert parse_bins('0, 1; 5 inf') == [0.0, 1.0, 5.0, np.inf]
+    for text in ['1', '0, a', '0, 5, 5', 'nan, 1', ', '.join(map(str, range(300)))]:
+        with pytest.raises(ValueError):
+            parse_bins(text)
@@ -0,0 +1,77 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from catalog import CATALOG_VERSION, DatasetCatalog, build_catalog, column_summary
+from engine import FILTER_VALUE_COLS, AnalyticsEngine
+
+
+@pytest.fixture(scope='module')
+def engines(tables, tmp_path_factory):
+    """Движок с каталогом, прочитанным из файла, и движок без каталога (значения из индекса)."""
+    df_users, df_shifts = tables
+    path = tmp_path_factory.mktemp('catalog') / 'catalog.json'
+    build_catalog(df_users, df_shifts, max_values=5, keep_values=FILTER_VALUE_COLS).write(path)
+    catalog = DatasetCatalog.read(path)
+    return (
+        AnalyticsEngine.from_tables(df_users, df_shifts, 'catalog-test', catalog=catalog),
+        AnalyticsEngine.from_tables(df_users, df_shifts, 'catalog-test'),
+    )
+
+
+def test_persisted_catalog_matches_the_index(engines):
+    with_catalog, without = engines
+    assert with_catalog.catalog is not None
+    for section in ('users', 'shifts'):
+        assert with_catalog.filter_values(section) == without.filter_values(section)
+    assert with_catalog.range_bounds() == without.range_bounds()
+    assert with_catalog.date_bounds() == without.date_bounds()
+    assert with_catalog.default_spec() == without.default_spec()
+
+
+def test_keep_values_overrides_the_limit(tables, engines):
+    df_users, _ = tables
+    catalog = engines[0].catalog
+    # region - больше 5 значений, но колонка фильтра: значения хранятся
+    assert catalog.tables['users']['region']['distinct'] > 5 and 'values' in catalog.tables['users']['region']
+    assert 'values' not in catalog.tables['users']['quantity_responses']
+    assert catalog.rows('users') == len(df_users)
+    summary = catalog.summary()
+    assert set(summary['table']) == {'users', 'shifts'}
+    assert len(summary) == len(catalog.columns('users')) + len(catalog.columns('shifts'))
+
+
+def test_column_summary():
+    series = pd.Series([3.0, np.nan, 1.0, 3.0])
+    summary = column_summary(series)
+    assert summary['nulls'] == 1 and summary['null_ratio'] == 0.25
+    assert (summary['min'], summary['max'], summary['distinct']) == (1.0, 3.0, 2)
+    assert summary['values'] == [[1.0, 1], [3.0, 2]]
+    assert 'values' not in column_summary(series, max_values=1)
+
+    categories = column_summary(pd.Series(pd.Categorical(['b', 'a', 'b'], categories=['b', 'a', 'c'])))
+    # Порядок категорий, без неиспользуемых
+    assert categories['values'] == [['b', 2], ['a', 1]] and categories['min'] is None
+
+    dates = column_summary(pd.Series(pd.to_datetime(['2024-01-03', None, '2024-01-01'])))
+    assert (dates['min'][:10], dates['max'][:10], dates['distinct']) == ('2024-01-01', '2024-01-03', 2)
+    assert 'values' not in dates
+
+
+def test_stale_or_broken_catalog_is_ignored(tables, tmp_path):
+    df_users, df_shifts = tables
+    data = build_catalog(df_users, df_shifts).to_dict()
+    assert DatasetCatalog.from_dict(data) is not None
+    assert DatasetCatalog.from_dict({**data, 'version': CATALOG_VERSION - 1}) is None
+    assert DatasetCatalog.from_dict(None) is None
+
+    path = tmp_path / 'catalog.json'
+    path.write_text('{"version"', encoding='utf-8')
+    assert DatasetCatalog.read(path) is None
+    assert DatasetCatalog.read(tmp_path / 'missing.json') is None
+    # Запись атомарна: временных файлов не остаётся
+    DatasetCatalog.from_dict(data).write(path)
+    assert json.loads(path.read_text(encoding='utf-8'))['version'] == CATALOG_VERSION
+    assert [p.name for p in tmp_path.iterdir()] == ['catalog.json']
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from chart_data import DEFAULT_MAX_OUTLIERS, coarsen, distribution_figure, distribution_stats, fit_payload
+
+
+@pytest.fixture(scope='module')
+def stats():
+    rng = np.random.default_rng(3)
+    values = np.concatenate([rng.lognormal(2, 1, 50_000), [np.nan] * 100])
+    groups = rng.integers(0, 2, values.size)
+    return values, groups, distribution_stats(values, groups)
+
+
+def test_stats_summarise_each_group(stats):
+    values, groups, result = stats
+    assert list(result['groups']) == ['0', '1']
+    valid = ~np.isnan(values)
+    for label, group in result['groups'].items():
+        group_values = values[valid & (groups == int(label))]
+        np.testing.assert_array_equal(group['counts'], np.histogram(group_values, bins=result['edges'])[0])
+        box = group['box']
+        np.testing.assert_allclose([box['q1'], box['median'], box['q3']], np.percentile(group_values, [25, 50, 75]))
+        assert box['outliers'].size == DEFAULT_MAX_OUTLIERS
+        assert np.all(np.diff(box['outliers']) >= 0)
+
+
+def test_coarsen_keeps_totals(stats):
+    _, _, result = stats
+    coarse = coarsen(result, 4, max_outliers=10)
+    assert len(coarse['edges']) - 1 == -(-(len(result['edges']) - 1) // 4)
+    assert coarse['edges'][0] == result['edges'][0] and coarse['edges'][-1] == result['edges'][-1]
+    for label, group in coarse['groups'].items():
+        assert group['counts'].sum() == result['groups'][label]['counts'].sum()
+        assert group['box']['outliers'].size == 10
+
+
+@pytest.mark.parametrize('budget', [8 * 1024, 16 * 1024])
+def test_fit_payload_respects_budget(stats, budget):
+    _, _, result = stats
+    build = lambda reduced: distribution_figure(reduced, 'x', 'title')
+    full_size = len(build(result).to_json())
+    assert full_size > budget
+
+    fig, payload = fit_payload(result, build, budget)
+    assert payload == len(fig.to_json()) <= budget
+    # Столбцы гистограммы всё ещё покрывают все наблюдения
+    bars = [trace for trace in fig.data if trace.type == 'bar']
+    assert sum(np.sum(bar.y) for bar in bars) == sum(group['counts'].sum() for group in result['groups'].values())
+
+
+def test_fit_payload_stops_at_coarsest(stats):
+    _, _, result = stats
+    fig, payload = fit_payload(result, lambda reduced: distribution_figure(reduced, 'x', 'title'), budget=1)
+    assert payload > 1 and len(fig.data) > 0
+
+
+def test_empty_values():
+    result = distribution_stats(np.array([np.nan]), np.array([1]))
+    assert result['edges'].size == 0 and result['groups'] == {}
@@ -0,0 +1,105 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import fill_rate_by, fill_rate_by_shift_number, weekly_fill_rate
+from cube import FillRateCube
+from engine import SHIFT_FILTER_COLS, USER_FILTER_COLS, USER_RANGE_COLS, AnalyticsEngine
+from filter_index import FilterIndex
+
+# Измерения пользователя куба: на маленькой выгрузке build_cube отказался бы от куба
+CUBE_USER_DIMS = ['gender', 'age', 'platform']
+
+
+@pytest.fixture(scope='module')
+def cube(tables):
+    df_users, df_shifts = tables
+    return FillRateCube(df_users, df_shifts, user_dims=CUBE_USER_DIMS)
+
+
+@pytest.fixture(scope='module')
+def engine(tables, cube):
+    df_users, df_shifts = tables
+    filter_index = FilterIndex(df_users, df_shifts, USER_FILTER_COLS, SHIFT_FILTER_COLS, USER_RANGE_COLS)
+    return AnalyticsEngine(df_users, df_shifts, 'cube-test', filter_index, cube=cube)
+
+
+def raw_shifts(df_users, df_shifts, spec):
+    """Смены под спецификацию фильтров - исходной цепочкой isin/between."""
+    users = df_users
+    for col, values in spec['users'].items():
+        users = users[users[col].isin(values)]
+    for col, (low, high) in spec['user_ranges'].items():
+        users = users[users[col].between(low, high)]
+    shifts = df_shifts[df_shifts['user_id'].isin(users['user_id'])]
+    if spec['dates'] is not None:
+        days = shifts['shift_start_time'].dt.date
+        shifts = shifts[(days >= spec['dates'][0]) & (days <= spec['dates'][1])]
+    for col, values in spec['shifts'].items():
+        shifts = shifts[shifts[col].isin(values)]
+    return shifts
+
+
+def make_spec(users=None, user_ranges=None, dates=None, shifts=None):
+    return {'users': users or {}, 'user_ranges': user_ranges or {}, 'dates': dates, 'shifts': shifts or {}}
+
+
+# Даты - с понедельника по воскресенье
+COVERED = {
+    'none': make_spec(),
+    'user_dims': make_spec(users={'gender': ['F'], 'age': ['25-34', '35-44']}),
+    'shift_dims': make_spec(shifts={'task_group': ['Склад', 'Промо']}, users={'platform': ['android']}),
+    'weeks': make_spec(dates=(date(2024, 2, 5), date(2024, 4, 28)), users={'gender': ['M']}),
+    'full_range': make_spec(user_ranges={'quantity_responses': (-1, 10**6)}),
+}
+UNCOVERED = {
+    'mid_week': make_spec(dates=(date(2024, 2, 7), date(2024, 4, 28))),
+    'narrow_range': make_spec(user_ranges={'quantity_responses': (2, 10)}),
+    'not_a_dimension': make_spec(users={'region': ['Москва', 'Новосибирск']}),
+}
+
+
+def assert_frames(expected, actual):
+    pd.testing.assert_frame_equal(
+        expected.reset_index(drop=True), actual.reset_index(drop=True),
+        check_dtype=False, check_categorical=False, rtol=1e-9
+    )
+
+
+def assert_matches_raw(view, shifts):
+    assert view.totals()[0] == len(shifts) and view.totals()[1] == shifts['job_done'].sum()
+    assert_frames(fill_rate_by_shift_number(shifts), view.fill_rate_by_shift_number())
+    assert_frames(weekly_fill_rate(shifts), view.weekly_fill_rate())
+    for column in ['shift_region', 'task_group', 'task_type']:
+        expected, actual = fill_rate_by(shifts, column), view.shift_fill_rate_by(column)
+        assert list(expected[column].astype(str)) == list(actual[column].astype(str))
+        np.testing.assert_allclose(actual['fill_rate'], expected['fill_rate'])
+        np.testing.assert_array_equal(actual['count'], expected['count'])
+
+
+@pytest.mark.parametrize('name', list(COVERED))
+def test_cube_slice_equals_groupby(tables, cube, engine, name):
+    df_users, df_shifts = tables
+    spec = COVERED[name]
+    assert cube.covers(spec['user_ranges'], spec['dates'], {**spec['users'], **spec['shifts']})
+    view = engine.view(spec)
+    assert view.use_cube
+    assert_matches_raw(view, raw_shifts(df_users, df_shifts, spec))
+
+
+@pytest.mark.parametrize('name', list(UNCOVERED))
+def test_uncovered_spec_falls_back_to_shifts(tables, cube, engine, name):
+    df_users, df_shifts = tables
+    spec = UNCOVERED[name]
+    assert not cube.covers(spec['user_ranges'], spec['dates'], {**spec['users'], **spec['shifts']})
+    view = engine.view(spec)
+    assert not view.use_cube
+    assert_matches_raw(view, raw_shifts(df_users, df_shifts, spec))
+
+
+def test_cube_is_smaller_and_complete(tables, cube):
+    _, df_shifts = tables
+    assert len(cube) < len(df_shifts)
+    assert cube.booked.sum() == len(df_shifts) and cube.done.sum() == df_shifts['job_done'].sum()
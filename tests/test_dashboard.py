@@ -0,0 +1,109 @@
+from concurrent.futures import Future
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import warmup
+from benchmarks.generate_data import generate_csv
+from engine import AnalyticsEngine
+from ingest import load_csv
+
+DASHBOARD = str(Path(__file__).resolve().parents[1] / 'dashboard.py')
+OVERVIEW_TAB = "📈 Обзор (Health Check)"
+RETENTION_TAB = "🔄 Удержание и Когорты"
+
+
+@pytest.fixture(scope='module')
+def csv_path(tmp_path_factory, raw_users):
+    path = tmp_path_factory.mktemp('dashboard') / 'users.csv'
+    raw_users.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def app(csv_path):
+    """Дашборд на локальном файле (поле шаблона партиций), без фонового предрасчёта."""
+    at = AppTest.from_file(DASHBOARD, default_timeout=300)
+    at.session_state['partition_pattern'] = str(csv_path)
+    at.session_state['background_warmup'] = False
+    return at
+
+
+def run(at):
+    at.run()
+    assert not at.exception, [exception.message for exception in at.exception]
+    return at
+
+
+def aggregates(at):
+    """{агрегат: кэш} последнего перезапуска по трассировке панели производительности."""
+    spans = at.session_state['perf_traces'][-1].spans
+    return {span['name'].split()[0]: span.get('cache') for span in spans if span['category'] == 'aggregate'}
+
+
+def test_lazy_tabs_compute_only_the_open_tab(app):
+    run(app)
+    assert app.session_state['active_tab'] == OVERVIEW_TAB
+    overview = aggregates(app)
+    assert 'totals' in overview and 'cohort_pivot' not in overview and 'fr_by_duration' not in overview
+
+    app.session_state['active_tab'] = RETENTION_TAB
+    retention = aggregates(run(app))
+    assert 'cohort_pivot' in retention and 'totals' not in retention
+
+    # Возврат на вкладку при тех же фильтрах - всё из кэша агрегатов
+    app.session_state['active_tab'] = OVERVIEW_TAB
+    assert set(aggregates(run(app)).values()) == {'hit'}
+
+
+def test_hidden_tab_keeps_its_slider(app):
+    run(app)
+    app.slider(key='regions_slider').set_value(7)
+    run(app)
+    app.session_state['active_tab'] = RETENTION_TAB
+    run(app)
+    app.session_state['active_tab'] = OVERVIEW_TAB
+    run(app)
+    assert app.slider(key='regions_slider').value == 7
+
+
+def test_eager_mode_computes_every_tab(app):
+    run(app)
+    app.toggle(key='lazy_tabs').set_value(False)
+    computed = aggregates(run(app))
+    assert {'totals', 'fr_by_duration', 'fr_by_flags', 'cohort_pivot', 'survival_curve'} <= set(computed)
+
+
+def test_preview_falls_back_when_the_sample_misses_the_filter(tmp_path, monkeypatch):
+    # Выборка 10 000 из 12 000 пользователей; точный пересчёт "не успевает"
+    path = generate_csv(tmp_path / 'users.csv', 12_000, seed=3)
+    with open(path, 'rb') as file_obj:
+        df_users, df_shifts, _ = load_csv(file_obj)
+    sample = AnalyticsEngine.from_tables(df_users, df_shifts, 'preview').sample(10_000)
+    monkeypatch.setattr(warmup.AggregateWarmer, 'refine', lambda self, engine, spec, *args: Future())
+
+    # Сочетание значений, которое есть у пользователей вне выборки и нет ни у кого в ней
+    cols = ['region', 'gender', 'age', 'income']
+    combination = lambda users: pd.MultiIndex.from_frame(users[cols].astype(object))
+    rest = df_users[~df_users['user_id'].isin(sample.df_users['user_id']) & df_users[cols].notna().all(axis=1)]
+    missing = rest[~combination(rest).isin(combination(sample.df_users))]
+    assert len(missing)
+    values = missing.iloc[0][cols]
+
+    at = AppTest.from_file(DASHBOARD, default_timeout=300)
+    at.session_state['partition_pattern'] = str(path)
+    at.session_state['background_warmup'] = False
+    at.session_state['approximate_mode'] = True
+    at.session_state['sample_size'] = 10_000
+    run(at)
+    assert any("Предпросмотр по выборке" in info.value for info in at.info)
+    for col in cols:
+        next(widget for widget in at.sidebar.multiselect if widget.label.endswith(f'({col})')).set_value([values[col]])
+        run(at)
+
+    assert not at.warning, [warning.value for warning in at.warning]
+    assert not any("Предпросмотр по выборке" in info.value for info in at.info)
+    booked = dict((metric.label, metric.value) for metric in at.metric)['Всего забронировано смен']
+    assert int(booked.replace(',', '')) > 0
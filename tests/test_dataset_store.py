@@ -0,0 +1,117 @@
+import os
+
+import pandas as pd
+import pytest
+
+from dataset_store import DatasetRegistry, DatasetStore
+
+pytest.importorskip('pyarrow')
+
+
+def test_put_get_round_trip(tmp_path, tables):
+    df_users, df_shifts = tables
+    store = DatasetStore(tmp_path)
+    assert store.get('k') is None
+    store.put('k', df_users, df_shifts, {'source_name': 'x.csv'})
+
+    users, shifts, meta = store.get('k')
+    pd.testing.assert_frame_equal(users, df_users.reset_index(drop=True))
+    pd.testing.assert_frame_equal(shifts, df_shifts)
+    assert meta == {'source_name': 'x.csv'}
+
+
+def test_evict_least_recently_used(tmp_path, tables):
+    df_users, df_shifts = tables
+    store = DatasetStore(tmp_path)
+    for i, key in enumerate(['a', 'b', 'c']):
+        store.put(key, df_users, df_shifts)
+        os.utime(tmp_path / key / 'meta.json', (1_000 + i, 1_000 + i))
+    # Обращение к самой старой записи делает её самой свежей
+    assert store.get('a') is not None
+
+    entry_bytes = sum(f.stat().st_size for f in (tmp_path / 'a').iterdir())
+    store.max_bytes = 2 * entry_bytes
+    store.evict()
+    assert store.get('b') is None
+    assert store.get('a') is not None and store.get('c') is not None
+
+
+def test_broken_entry_is_a_miss(tmp_path, tables):
+    store = DatasetStore(tmp_path)
+    store.put('k', *tables)
+    (tmp_path / 'k' / 'shifts.arrow').write_bytes(b'not arrow')
+    assert store.get('k') is None
+    assert not (tmp_path / 'k').exists()
+
+
+def test_get_survives_concurrent_eviction(tmp_path, tables, monkeypatch):
+    store = DatasetStore(tmp_path)
+    store.put('k', *tables)
+
+    def evicted(path, *args, **kwargs):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'utime', evicted)
+    assert store.get('k') is not None
+
+
+class CountingStore(DatasetStore):
+    def __init__(self, root):
+        super().__init__(root)
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return super().get(key)
+
+
+def test_registry_shares_one_load(tmp_path, tables):
+    df_users, df_shifts = tables
+    store = CountingStore(tmp_path)
+    registry = DatasetRegistry(store, is_session_alive=lambda session_id: True)
+    loads = []
+
+    def load():
+        # Как загрузчик дашборда: обработать и сохранить в хранилище
+        loads.append(1)
+        store.put('k', df_users, df_shifts, {})
+        return df_users, df_shifts, {'from_cache': False}
+
+    (users, shifts, _), known = registry.acquire('s1', 'k', load)
+    assert not known and store.reads == 1
+    # Таблицы записи - прочитанные из хранилища, а не переданные загрузчиком
+    assert users is not df_users
+    pd.testing.assert_frame_equal(shifts, df_shifts)
+
+    entry, known = registry.acquire('s2', 'k', load)
+    assert known and entry[0] is users and len(loads) == 1
+    assert registry.stats()['refs'] == {'k': 2}
+
+
+def test_registry_does_not_reread_stored_frames(tmp_path, tables):
+    df_users, df_shifts = tables
+    store = CountingStore(tmp_path)
+    store.put('k', df_users, df_shifts, {})
+    stored_users, stored_shifts, meta = store.get('k')
+    store.reads = 0
+
+    registry = DatasetRegistry(store)
+    (users, shifts, _), _ = registry.acquire('s1', 'k', lambda: (stored_users, stored_shifts, {**meta, 'from_cache': True}))
+    assert users is stored_users and shifts is stored_shifts and store.reads == 0
+
+
+def test_registry_evicts_unused_entries(tables):
+    df_users, df_shifts = tables
+    alive = {'s1', 's2'}
+    registry = DatasetRegistry(is_session_alive=lambda session_id: session_id in alive)
+    for session_id, key in [('s1', 'a'), ('s2', 'a'), ('s2', 'b')]:
+        registry.acquire(session_id, key, lambda: (df_users, df_shifts, {}))
+    assert registry.acquire('s1', 'none', lambda: None) == (None, False)
+
+    # s2 ушла с b на a: b больше никому не нужен
+    registry.retain('s2', ['a'])
+    assert registry.stats()['entries'] == 1 and registry.stats()['refs'] == {'a': 2}
+    registry.release('s1')
+    assert registry.stats()['refs'] == {'a': 1}
+    # Закрытая сессия без явного release вытесняется при проверке
+    alive.discard('s2')
+    assert registry.evict() == 1 and registry.stats()['entries'] == 0
@@ -0,0 +1,119 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.generate_data import generate_chunk
+from cube import FillRateCube
+from engine import SHIFT_FILTER_COLS, USER_FILTER_COLS, USER_RANGE_COLS
+from filter_index import FilterIndex
+from ingest import apply_delta, process_frame
+
+CUBE_USER_DIMS = ['gender', 'age', 'platform']
+UPDATED_USERS = 150
+NEW_USERS = 100
+
+
+def comparable(df, order):
+    """Таблица с общими типами (категории - object, числа - float64) в порядке order."""
+    df = df.sort_values(order, ignore_index=True)
+    out = {}
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        elif values.dtype.kind in 'iuf':
+            values = values.astype('float64')
+        elif values.dtype.kind == 'M':
+            values = values.astype('datetime64[ns]')
+        out[col] = values
+    return pd.DataFrame(out)
+
+
+@pytest.fixture(scope='module')
+def delta_case(raw_users):
+    base = raw_users.copy()
+    base.insert(0, 'ext_id', np.arange(len(base)) + 5000)
+    # Изменившиеся пользователи: другой исход 1-й смены и 2-я смена на 9 дней позже
+    replaced = np.random.default_rng(1).choice(len(base), UPDATED_USERS, replace=False)
+    updated = base.iloc[replaced].copy()
+    updated['job_done_1'] = 1 - updated['job_done_1'].fillna(0)
+    updated['shift_start_time_2'] = updated['shift_start_time_2'] + pd.Timedelta(days=9)
+    new = generate_chunk(NEW_USERS, np.random.default_rng(12))
+    new.insert(0, 'ext_id', np.arange(NEW_USERS) + 10**6)
+    delta = pd.concat([updated, new], ignore_index=True)
+
+    users, shifts, _ = process_frame(base.copy())
+    merged = base.copy()
+    merged.iloc[replaced] = updated.to_numpy()
+    merged = pd.concat([merged, new], ignore_index=True)
+    return users, shifts, delta, merged
+
+
+@pytest.fixture(scope='module')
+def applied(delta_case):
+    users, shifts, delta, _ = delta_case
+    return apply_delta(users, shifts, delta, key='ext_id')
+
+
+def test_delta_equals_full_reprocess(delta_case, applied):
+    users, _, _, merged = delta_case
+    delta_users, delta_shifts, memory, changes = applied
+    assert changes['updated_users'] == UPDATED_USERS and changes['new_users'] == NEW_USERS
+    # Новые пользователи получают следующие user_id, обновлённые сохраняют свои
+    assert sorted(changes['user_ids'])[-NEW_USERS:] == list(range(len(users), len(users) + NEW_USERS))
+
+    full_users, full_shifts, _ = process_frame(merged.copy())
+    pd.testing.assert_frame_equal(
+        comparable(delta_users, ['user_id']), comparable(full_users, ['user_id'])[delta_users.columns], check_dtype=False
+    )
+    order = ['user_id', 'shift_number']
+    pd.testing.assert_frame_equal(
+        comparable(delta_shifts, order), comparable(full_shifts, order)[delta_shifts.columns], check_dtype=False
+    )
+    assert memory['users']['before'] > 0 and changes['weeks']
+
+
+def test_user_id_is_not_a_key(delta_case):
+    users, shifts, delta, _ = delta_case
+    with pytest.raises(ValueError):
+        apply_delta(users, shifts, delta.assign(user_id=1), key='user_id')
+
+
+def test_updated_filter_index_equals_rebuilt(delta_case, applied):
+    users, shifts, _, _ = delta_case
+    delta_users, delta_shifts, _, changes = applied
+    index = FilterIndex(users, shifts, USER_FILTER_COLS, SHIFT_FILTER_COLS, USER_RANGE_COLS)
+    updated = index.updated(delta_users, delta_shifts, changes['user_ids'])
+    fresh = FilterIndex(delta_users, delta_shifts, USER_FILTER_COLS, SHIFT_FILTER_COLS, USER_RANGE_COLS)
+
+    specs = [
+        dict(user_filters={}),
+        dict(user_filters={'gender': ['F'], 'age': ['18-24', '25-34', '35-44', '45-54']}),
+        dict(user_filters={'success_verification_gu_flg': [1.0]}, user_ranges={'quantity_responses': (2, 10)}),
+        dict(user_filters={'platform': ['ios']}, date_range=(date(2024, 2, 1), date(2024, 5, 15)),
+             shift_filters={'task_group': ['Склад', 'Промо']}),
+    ]
+    for spec in specs:
+        for actual, expected in zip(updated.apply(**spec), fresh.apply(**spec)):
+            np.testing.assert_array_equal(actual, expected)
+    assert updated.date_bounds == fresh.date_bounds
+
+
+def test_updated_cube_equals_rebuilt(delta_case, applied):
+    users, shifts, _, _ = delta_case
+    delta_users, delta_shifts, _, changes = applied
+    cube = FillRateCube(users, shifts, user_dims=CUBE_USER_DIMS)
+    updated = cube.updated(delta_users, delta_shifts, changes['weeks'], changes['undated'])
+    fresh = FillRateCube(delta_users, delta_shifts, user_dims=CUBE_USER_DIMS)
+
+    for filters in [{}, {'gender': ['M']}, {'shift_region': list(fresh.dims['shift_region'].values[:3])}]:
+        actual, expected = updated.slice(filters), fresh.slice(filters)
+        assert actual.totals() == expected.totals()
+        for column in ['shift_region', 'task_group', 'age']:
+            pd.testing.assert_frame_equal(
+                actual.fill_rate_by(column).astype({column: object}), expected.fill_rate_by(column).astype({column: object})
+            )
+        pd.testing.assert_frame_equal(actual.weekly_fill_rate(), expected.weekly_fill_rate())
+        pd.testing.assert_frame_equal(actual.fill_rate_by_shift_number(), expected.fill_rate_by_shift_number())
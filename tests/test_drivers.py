@@ -0,0 +1,123 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import drivers
+from drivers import DriverModels, MISSING_LABEL, OTHER_LABEL, encode_factor, fit_logistic, train_driver_model
+from engine import DRIVER_FACTORS, AnalyticsEngine
+
+ROWS = 20_000
+
+
+def planted_frame(seed=0):
+    """Смены с заложенным эффектом: сильный фактор, слабый фактор и чистый шум."""
+    rng = np.random.default_rng(seed)
+    strong = rng.integers(0, 3, ROWS)
+    weak = rng.integers(0, 2, ROWS)
+    noise = rng.normal(size=ROWS)
+    logit = -0.2 + np.array([-1.2, 0.0, 1.2])[strong] + np.array([0.0, 0.4])[weak]
+    return pd.DataFrame({
+        'job_done': (rng.random(ROWS) < 1 / (1 + np.exp(-logit))).astype('float64'),
+        'strong': pd.Categorical(np.array(['low', 'mid', 'high'])[strong], categories=['low', 'mid', 'high']),
+        'weak': weak,
+        'noise': noise,
+    })
+
+
+def test_encode_factor_levels():
+    codes, labels = encode_factor(pd.Series(np.arange(100, dtype='float64')), max_bins=4)
+    assert len(labels) == 4 and np.bincount(codes).tolist() == [25, 25, 25, 25]
+
+    codes, labels = encode_factor(pd.Series([1.0, 2.0, np.nan, 2.0]))
+    assert labels == ['1', '2', MISSING_LABEL] and codes.tolist() == [0, 1, 2, 1]
+
+    series = pd.Series(['a'] * 5 + ['b'] * 4 + ['c'] * 2 + ['d'])
+    codes, labels = encode_factor(series, max_levels=3)
+    assert labels == ['a', 'b', OTHER_LABEL]
+    assert codes.tolist() == [0] * 5 + [1] * 4 + [2] * 3
+
+
+def test_fit_logistic_recovers_planted_effect():
+    frame = planted_frame()
+    strong, strong_labels = encode_factor(frame['strong'])
+    weak, _ = encode_factor(frame['weak'])
+    assert strong_labels == ['low', 'mid', 'high']
+    intercept, (strong_coefs, weak_coefs) = fit_logistic(
+        np.column_stack([strong, weak]), [3, 2], frame['job_done'].to_numpy()
+    )
+    # Уровни без опорного определены с точностью до сдвига: сравниваем разности
+    assert strong_coefs[0] < strong_coefs[1] < strong_coefs[2]
+    np.testing.assert_allclose(strong_coefs[2] - strong_coefs[0], 2.4, atol=0.2)
+    np.testing.assert_allclose(weak_coefs[1] - weak_coefs[0], 0.4, atol=0.1)
+
+
+def test_noise_column_ranks_last():
+    factors = {'noise': 'Шум', 'weak': 'Слабый', 'strong': 'Сильный'}
+    result = train_driver_model(planted_frame(), factors, seed=1)
+    importance = result['importance']
+    assert importance['factor'].tolist() == ['strong', 'weak', 'noise']
+    assert importance['importance'].iloc[-1] < 0.002 < importance['importance'].iloc[0]
+    np.testing.assert_allclose(importance['share'].sum(), 1.0)
+
+    dependence = result['partial_dependence']
+    strong = dependence[dependence['factor'] == 'strong'].sort_values('order')
+    assert strong['level'].tolist() == ['low', 'mid', 'high']
+    assert strong['fill_rate'].is_monotonic_increasing and strong['observed_fr'].is_monotonic_increasing
+    assert result['metrics']['auc'] > 0.6 and result['metrics']['log_loss'] < result['metrics']['null_log_loss']
+
+
+def test_model_needs_both_outcomes():
+    frame = planted_frame().head(200).assign(job_done=1.0)
+    with pytest.raises(ValueError):
+        train_driver_model(frame, {'strong': 'Сильный'})
+
+
+@pytest.fixture
+def view(tables):
+    df_users, df_shifts = tables
+    return AnalyticsEngine.from_tables(df_users, df_shifts, 'drivers-test').view({})
+
+
+def _submitted(calls):
+    def submit(name, max_workers, fn, *args):
+        calls.append(args)
+        future = Future()
+        future.set_result({'metrics': {'auc': 0.5}})
+        return future
+    return submit
+
+
+def test_broken_pool_job_is_resubmitted(view, monkeypatch):
+    calls = []
+    monkeypatch.setattr(drivers, 'submit_to_pool', _submitted(calls))
+    models = DriverModels()
+    key = (view.state_key, 'drivers', drivers.MODEL_VERSION, tuple(DRIVER_FACTORS), 500, 0)
+    broken = Future()
+    broken.set_exception(BrokenProcessPool())
+    models._jobs[key] = broken
+
+    result, future = models.result(view, DRIVER_FACTORS, max_rows=500)
+    assert len(calls) == 1 and len(calls[0][0]) == 500
+    assert future is None and result == {'metrics': {'auc': 0.5}}
+    assert view.engine.cache.get(key) == result and key not in models._jobs
+
+    # Дальше результат берётся из кэша без новых задач
+    assert models.result(view, DRIVER_FACTORS, max_rows=500) == (result, None)
+    assert len(calls) == 1
+
+
+def test_failed_job_is_returned_not_cached(view, monkeypatch):
+    calls = []
+    monkeypatch.setattr(drivers, 'submit_to_pool', _submitted(calls))
+    models = DriverModels()
+    key = (view.state_key, 'drivers', drivers.MODEL_VERSION, tuple(DRIVER_FACTORS), 500, 0)
+    failed = Future()
+    failed.set_exception(ValueError("мало данных"))
+    models._jobs[key] = failed
+
+    result, future = models.result(view, DRIVER_FACTORS, max_rows=500)
+    assert result is None and future is failed and not calls
+    assert view.engine.cache.get(key) is None
@@ -0,0 +1,97 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine import SHIFT_FILTER_COLS, USER_FILTER_COLS, USER_RANGE_COLS
+from filter_index import FilterIndex
+
+
+def pandas_masks(df_users, df_shifts, user_filters, user_ranges=None, date_range=None, shift_filters=None):
+    """Исходная цепочка isin/between дашборда - масками вместо вырезок."""
+    user_mask = np.ones(len(df_users), dtype=bool)
+    for col, values in user_filters.items():
+        user_mask &= df_users[col].isin(values).to_numpy()
+    for col, (low, high) in (user_ranges or {}).items():
+        user_mask &= ((df_users[col] >= low) & (df_users[col] <= high)).to_numpy()
+
+    shift_mask = df_shifts['user_id'].isin(df_users.loc[user_mask, 'user_id']).to_numpy().copy()
+    if date_range is not None:
+        start_date, end_date = date_range
+        days = df_shifts['shift_start_time'].dt.date
+        shift_mask &= ((days >= start_date) & (days <= end_date)).fillna(False).to_numpy(dtype=bool)
+    for col, values in (shift_filters or {}).items():
+        shift_mask &= df_shifts[col].isin(values).to_numpy()
+
+    # Финальная синхронизация: пользователи, у которых остались смены
+    user_mask &= df_users['user_id'].isin(df_shifts.loc[shift_mask, 'user_id']).to_numpy()
+    return user_mask, shift_mask
+
+
+@pytest.fixture(scope='module')
+def index(tables):
+    df_users, df_shifts = tables
+    return FilterIndex(df_users, df_shifts, USER_FILTER_COLS, SHIFT_FILTER_COLS, USER_RANGE_COLS)
+
+
+def present(series):
+    return list(series.dropna().unique())
+
+
+SPECS = {
+    # Все встречающиеся значения: пользователи с пропуском всё равно не проходят, как у isin
+    'all_values': lambda u, s: dict(user_filters={col: present(u[col]) for col in ['gender', 'age', 'income']}),
+    'category_subset': lambda u, s: dict(user_filters={'region': present(u['region'])[:3], 'platform': ['ios']}),
+    # Выбрано больше половины значений - маска строится вычитанием невыбранных
+    'most_values': lambda u, s: dict(user_filters={'age': ['18-24', '25-34', '35-44', '45-54']}),
+    'numeric_flag': lambda u, s: dict(user_filters={'success_verification_gu_flg': [1.0], 'cv_podrabotka_flg': [0.0]}),
+    'unknown_value': lambda u, s: dict(user_filters={'gender': ['M', 'нет такого']}),
+    'nothing_selected': lambda u, s: dict(user_filters={'income': []}),
+    'range': lambda u, s: dict(user_filters={}, user_ranges={'quantity_responses': (2, 10)}),
+    'dates': lambda u, s: dict(user_filters={}, date_range=(date(2024, 2, 1), date(2024, 2, 20))),
+    'shift_filters': lambda u, s: dict(
+        user_filters={}, shift_filters={'shift_region': present(s['shift_region'])[:5], 'task_group': ['Склад', 'Промо']}
+    ),
+    'combined': lambda u, s: dict(
+        user_filters={'gender': ['F'], 'age': ['25-34', '35-44']}, user_ranges={'quantity_responses': (0, 15)},
+        date_range=(date(2024, 1, 10), date(2024, 4, 1)), shift_filters={'task_group': ['Склад', 'Доставка']}
+    ),
+}
+
+
+@pytest.mark.parametrize('name', list(SPECS))
+def test_apply_matches_pandas(tables, index, name):
+    df_users, df_shifts = tables
+    spec = SPECS[name](df_users, df_shifts)
+    user_mask, shift_mask = index.apply(**spec)
+    expected_users, expected_shifts = pandas_masks(df_users, df_shifts, **spec)
+
+    np.testing.assert_array_equal(shift_mask, expected_shifts)
+    np.testing.assert_array_equal(user_mask, expected_users)
+    if name != 'nothing_selected':
+        assert 0 < user_mask.sum() <= len(df_users)
+    # Синхронизация: каждая оставшаяся смена - у оставшегося пользователя и наоборот
+    kept_users = set(df_users.loc[user_mask, 'user_id'])
+    assert set(df_shifts.loc[shift_mask, 'user_id']) == kept_users
+
+
+def test_nan_rows_fail_value_filters(tables, index):
+    df_users, _ = tables
+    missing = df_users['gender'].isna().to_numpy()
+    assert missing.any()
+    mask = index.user_mask({'gender': present(df_users['gender'])})
+    assert not mask[missing].any() and mask[~missing].all()
+
+
+def test_bounds_and_vocabulary(tables, index):
+    df_users, df_shifts = tables
+    assert index.user_bitmaps['gender'].has_nulls and not index.user_bitmaps['platform'].has_nulls
+    assert sorted(index.user_bitmaps['region'].present) == sorted(present(df_users['region']))
+    low, high = index.date_bounds
+    assert low == df_shifts['shift_start_time'].min().date() and high == df_shifts['shift_start_time'].max().date()
+    # Смены без даты старта не попадают ни в какой диапазон дат
+    undated = df_shifts['shift_start_time'].isna().to_numpy()
+    assert undated.any()
+    _, shift_mask = index.apply({}, date_range=(low, high))
+    assert not shift_mask[undated].any()
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingest import apply_schema, expand_partitions, iter_csv_chunks, load_csv, load_partitions, unify_categories
+
+
+@pytest.fixture(scope='module')
+def csv_path(tmp_path_factory, raw_users):
+    path = tmp_path_factory.mktemp('ingest') / 'users.csv'
+    raw_users.to_csv(path, index=False)
+    return path
+
+
+def test_csv_chunks_cover_the_file(csv_path):
+    expected = pd.read_csv(csv_path)
+    with open(csv_path, 'rb') as file_obj:
+        chunks = list(iter_csv_chunks(file_obj, chunksize=300))
+
+    users = pd.concat([users for users, *_ in chunks], ignore_index=True)
+    assert len(chunks) == -(-len(expected) // 300)
+    # user_id - сквозной номер строки файла, прочитанная доля растёт до 1
+    np.testing.assert_array_equal(users['user_id'], np.arange(len(expected)))
+    assert [fraction for *_, fraction, _ in chunks] == sorted(fraction for *_, fraction, _ in chunks)
+    assert chunks[-1][3] == 1.0 and chunks[-1][4] == len(expected)
+    for col in ['gender', 'region', 'quantity_responses']:
+        pd.testing.assert_series_equal(users[col].astype(object), expected[col].astype(object), check_dtype=False)
+
+
+def test_chunked_load_equals_whole_file(csv_path):
+    with open(csv_path, 'rb') as file_obj:
+        whole_users, whole_shifts, _ = load_csv(file_obj)
+    progress = []
+    with open(csv_path, 'rb') as file_obj:
+        users, shifts, _ = load_csv(file_obj, chunksize=300, on_progress=lambda fraction, text: progress.append(fraction))
+
+    pd.testing.assert_frame_equal(users, whole_users)
+    # Смены частей идут часть за частью, а не слот за слотом - сравниваем в одном порядке
+    order = ['shift_number', 'user_id']
+    pd.testing.assert_frame_equal(
+        shifts.sort_values(order, ignore_index=True), whole_shifts.sort_values(order, ignore_index=True)
+    )
+    assert progress[-1] == 1.0
+
+
+def test_partitions_equal_whole_file(csv_path, tmp_path):
+    with open(csv_path, 'rb') as file_obj:
+        whole_users, whole_shifts, _ = load_csv(file_obj)
+    # Три партиции разного размера, одна - Parquet
+    raw = pd.read_csv(csv_path)
+    bounds = [0, 500, 1300, len(raw)]
+    for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        part = raw.iloc[start:end]
+        if i == 1:
+            part.to_parquet(tmp_path / f'part-{i}.parquet', index=False)
+        else:
+            part.to_csv(tmp_path / f'part-{i}.csv', index=False)
+    sources = expand_partitions(tmp_path)
+    assert [path.name for path in sources] == ['part-0.csv', 'part-1.parquet', 'part-2.csv']
+
+    users, shifts, memory = load_partitions(sources, max_workers=2)
+    # user_id сдвинут на число пользователей предыдущих партиций - как номер строки целого файла
+    pd.testing.assert_frame_equal(users, whole_users)
+    order = ['shift_number', 'user_id']
+    pd.testing.assert_frame_equal(
+        shifts.sort_values(order, ignore_index=True), whole_shifts.sort_values(order, ignore_index=True)
+    )
+    assert memory['users']['after'] > 0
+
+
+def test_apply_schema_compact_types():
+    df = pd.DataFrame({
+        'region': ['Москва', None, 'Казань'],
+        'opened_push_flg': [1.0, 0.0, 1.0],
+        'cv_free_grafik_flg': [1.0, np.nan, 0.0],
+        'quantity_responses': [0.0, 3.0, 70_000.0],
+        'serp_frequency': [1.0, np.nan, 2.0],
+        'duration_1': [8.0, 4.5, np.nan],
+        'note': ['a', 'b', 'c'],
+    })
+    original = df.copy()
+    apply_schema(df)
+
+    assert isinstance(df['region'].dtype, pd.CategoricalDtype)
+    assert df['opened_push_flg'].dtype == 'uint8'
+    # Целые колонки с пропусками - float32, пропуск сохраняется
+    assert df['cv_free_grafik_flg'].dtype == 'float32' and df['cv_free_grafik_flg'].isna().sum() == 1
+    assert df['quantity_responses'].dtype == 'uint32'
+    assert df['serp_frequency'].dtype == 'float32'
+    assert df['duration_1'].dtype == 'float32'
+    assert df['note'].dtype == original['note'].dtype
+    for col in original.columns:
+        pd.testing.assert_series_equal(df[col].astype(object), original[col].astype(object), check_dtype=False)
+
+
+def test_processed_tables_share_categories(tables):
+    df_users, df_shifts = tables
+    assert df_users['user_id'].dtype.kind == 'u' and df_shifts['job_done'].dtype == 'uint8'
+    for col in ['region', 'platform', 'age', 'income']:
+        assert df_users[col].dtype == df_shifts[col].dtype
+    # Смены всех слотов склеены в одну категориальную колонку с отсортированным словарём
+    assert isinstance(df_shifts['shift_region'].dtype, pd.CategoricalDtype)
+    assert df_shifts['shift_region'].cat.categories.is_monotonic_increasing
+
+
+def test_unify_categories():
+    first = pd.DataFrame({'task_group_1': pd.Categorical(['Склад', 'Промо'])})
+    second = pd.DataFrame({'task_group': pd.Categorical(['Офис'])})
+    unify_categories([first, second])
+    assert first['task_group_1'].dtype == second['task_group'].dtype
+    assert list(pd.concat([first['task_group_1'], second['task_group']]).astype(str)) == ['Склад', 'Промо', 'Офис']
@@ -0,0 +1,76 @@
+import json
+import threading
+
+import pytest
+
+import perf
+from engine import AnalyticsEngine
+
+
+@pytest.fixture
+def history():
+    history = []
+    yield history
+    # Трассировщик не должен пережить тест в этом потоке
+    perf._active.set(None)
+
+
+def test_nested_spans(history):
+    tracer = perf.start_rerun(history, 'rerun')
+    with perf.span("Загрузка", 'pipeline'):
+        with perf.span("Чтение", rows=10):
+            perf.annotate(cache='miss')
+        with perf.span("Обработка"):
+            pass
+    tracer.finish()
+
+    names = [(span['name'], span['depth']) for span in tracer.spans]
+    assert names == [("Загрузка", 0), ("Чтение", 1), ("Обработка", 1)]
+    outer, inner, _ = tracer.spans
+    assert inner['rows'] == 10 and inner['cache'] == 'miss' and 'cache' not in outer
+    assert outer['ms'] >= inner['ms'] >= 0 and tracer.total_ms >= outer['ms']
+    assert list(tracer.table()['Этап']) == ["Загрузка", "\u2003Чтение", "\u2003Обработка"]
+    assert json.loads(perf.export_json(history))[0]['spans'][1]['name'] == "Чтение"
+
+
+def test_span_closes_on_error(history):
+    tracer = perf.start_rerun(history)
+    with pytest.raises(ValueError):
+        with perf.span("Сбой"):
+            raise ValueError
+    with perf.span("После"):
+        pass
+    assert tracer.spans[0]['ms'] is not None and tracer.spans[1]['depth'] == 0
+    # Скрипт прерван до finish - время по последнему этапу
+    assert tracer.total_ms > 0
+
+
+def test_no_tracer_is_a_no_op():
+    assert perf.current() is None
+    with perf.span("Без трассировщика") as record:
+        perf.annotate(cache='hit')
+    assert record == {}
+
+
+def test_history_is_bounded_and_per_thread(history):
+    for i in range(5):
+        perf.start_rerun(history, str(i), max_history=3)
+    assert [tracer.label for tracer in history] == ['2', '3', '4']
+
+    # Другой поток (другая сессия Streamlit) не видит трассировщик этого
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(perf.current()))
+    thread.start()
+    thread.join()
+    assert seen == [None] and perf.current() is history[-1]
+
+
+def test_aggregates_report_cache_hits(tables, history):
+    df_users, df_shifts = tables
+    engine = AnalyticsEngine.from_tables(df_users, df_shifts, 'perf-test')
+    tracer = perf.start_rerun(history)
+    engine.view(engine.default_spec()).totals()
+    engine.view(engine.default_spec()).totals()
+    caches = [span['cache'] for span in tracer.spans if span['category'] == 'aggregate']
+    assert caches == ['miss', 'hit']
+    assert any(span['category'] == 'filter' for span in tracer.spans)
@@ -0,0 +1,86 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import report
+from aggregates import AggregateCache
+from engine import MANIFEST_NAME, AnalyticsEngine, preload_reports, read_report, write_report
+
+HORIZONS = (30, 90)
+
+
+@pytest.fixture(scope='module')
+def computed(tables, tmp_path_factory):
+    df_users, df_shifts = tables
+    engine = AnalyticsEngine.from_tables(df_users, df_shifts, 'report-test')
+    view = engine.view(engine.default_spec())
+    results = view.compute_all(HORIZONS)
+    report_dir = write_report(view, results, tmp_path_factory.mktemp('reports'))
+    return view, results, report_dir
+
+
+def assert_same_value(expected, actual):
+    if isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(
+            actual, expected, check_dtype=False, check_index_type=False, check_column_type=False,
+            check_categorical=False
+        )
+    elif isinstance(expected, dict):
+        np.testing.assert_allclose(actual['edges'], expected['edges'])
+        assert list(actual['groups']) == list(expected['groups'])
+        for label, group in expected['groups'].items():
+            np.testing.assert_array_equal(actual['groups'][label]['counts'], group['counts'])
+    else:
+        assert list(np.ravel(actual)) == list(np.ravel(expected))
+
+
+def test_write_read_round_trip(computed):
+    view, results, report_dir = computed
+    manifest, loaded = read_report(report_dir)
+    assert manifest['dataset_key'] == 'report-test' and manifest['state_key'] == view.state_key
+    assert list(loaded) == list(results)
+    for key, value in results.items():
+        assert_same_value(value, loaded[key])
+
+
+def test_preload_serves_cache_hits(tables, computed):
+    df_users, df_shifts = tables
+    _, results, report_dir = computed
+    cache = AggregateCache()
+    assert preload_reports(report_dir.parent, 'report-test', cache) == 1
+    assert preload_reports(report_dir.parent, 'other-dataset', AggregateCache()) == 0
+
+    engine = AnalyticsEngine.from_tables(df_users, df_shifts, 'report-test', cache=cache)
+    served = engine.view(engine.default_spec()).compute_all(HORIZONS)
+    assert cache.stats()['misses'] == 0
+    for key, value in results.items():
+        assert_same_value(value, served[key])
+
+
+def test_broken_report_is_skipped(computed, tmp_path):
+    _, _, report_dir = computed
+    broken = tmp_path / 'broken'
+    broken.mkdir()
+    (broken / MANIFEST_NAME).write_text('{', encoding='utf-8')
+    manifest = json.loads((report_dir / MANIFEST_NAME).read_text(encoding='utf-8'))
+    stale = tmp_path / 'stale'
+    stale.mkdir()
+    (stale / MANIFEST_NAME).write_text(json.dumps({**manifest, 'report_version': 1}), encoding='utf-8')
+    assert preload_reports(tmp_path, 'report-test', AggregateCache()) == 0
+
+
+def test_cli_writes_a_report_per_spec(raw_users, tmp_path, capsys):
+    csv_path = tmp_path / 'users.csv'
+    raw_users.to_csv(csv_path, index=False)
+    specs = tmp_path / 'specs.json'
+    specs.write_text(json.dumps([{}, {'users': {'gender': ['F']}}, {'users': {'gender': []}}]), encoding='utf-8')
+
+    report.main([str(csv_path), '--filters', str(specs), '--out', str(tmp_path / 'out'), '--no-store', '--horizon', '30'])
+    written = capsys.readouterr().out.split()
+    # Пустая выборка пропускается
+    assert len(written) == 2
+    for report_dir in written:
+        _, results = read_report(report_dir)
+        assert ('survival_curve', 30) in {(key[1], *key[2:]) for key in results}
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sampling import estimate_totals, stratified_sample, stratum_codes
+
+SAMPLE_SIZE = 600
+
+
+def test_sample_is_stratified_and_keeps_whole_users(tables):
+    df_users, df_shifts = tables
+    users, shifts, fraction = stratified_sample(df_users, df_shifts, SAMPLE_SIZE, seed=1)
+    assert fraction == len(users) / len(df_users)
+    # У пользователя выборки - все его смены
+    expected = df_shifts[df_shifts['user_id'].isin(users['user_id'])].reset_index(drop=True)
+    pd.testing.assert_frame_equal(shifts, expected)
+
+    # Каждая страта представлена той же долей (с округлением, но хотя бы одним пользователем)
+    codes = pd.Series(stratum_codes(df_users, df_shifts), index=df_users['user_id'])
+    population = codes.value_counts()
+    taken = codes[users['user_id']].value_counts().reindex(population.index, fill_value=0)
+    expected_taken = np.maximum(1, np.rint(population * SAMPLE_SIZE / len(df_users)))
+    np.testing.assert_array_equal(taken, expected_taken)
+
+    again = stratified_sample(df_users, df_shifts, SAMPLE_SIZE, seed=1)[0]
+    assert again['user_id'].tolist() == users['user_id'].tolist()
+    assert stratified_sample(df_users, df_shifts, len(df_users))[2] == 1.0
+
+
+def test_stratum_of_user_without_shifts(tables):
+    df_users, df_shifts = tables
+    without = df_shifts[df_shifts['user_id'] != df_users['user_id'].iloc[0]]
+    codes = stratum_codes(df_users, without)
+    same_region = (df_users['region'] == df_users['region'].iloc[0]).to_numpy()
+    # Пользователь без смен - отдельное значение группы заданий первой смены
+    assert codes[0] not in set(codes[1:][same_region[1:]])
+
+
+def test_exact_estimates_have_no_error(tables):
+    _, df_shifts = tables
+    totals = estimate_totals(df_shifts, 2_000, 1.0)
+    assert totals['booked'] == totals['booked_low'] == totals['booked_high'] == len(df_shifts)
+    assert totals['done'] == df_shifts['job_done'].sum()
+    assert totals['fill_rate_low'] == totals['fill_rate'] == totals['fill_rate_high']
+
+
+def test_sample_intervals_cover_the_truth(tables):
+    df_users, df_shifts = tables
+    truth = {'booked': len(df_shifts), 'done': df_shifts['job_done'].sum(), 'fill_rate': df_shifts['job_done'].mean()}
+    covered = {name: 0 for name in truth}
+    seeds = range(20)
+    for seed in seeds:
+        users, shifts, fraction = stratified_sample(df_users, df_shifts, SAMPLE_SIZE, seed=seed)
+        estimate = estimate_totals(shifts, len(users), fraction)
+        for name, value in truth.items():
+            assert estimate[f'{name}_low'] <= estimate[name] <= estimate[f'{name}_high']
+            covered[name] += estimate[f'{name}_low'] <= value <= estimate[f'{name}_high']
+    # 95% интервалы (консервативные при стратификации) накрывают истину почти всегда
+    assert all(count >= 17 for count in covered.values()), covered
+
+
+def test_sample_engine_shares_the_cache(tables):
+    from engine import AnalyticsEngine
+
+    df_users, df_shifts = tables
+    engine = AnalyticsEngine.from_tables(df_users, df_shifts, 'sampling-test')
+    sample = engine.sample(SAMPLE_SIZE)
+    assert sample.approximate and not engine.approximate and sample.cache is engine.cache
+    assert sample.dataset_key != engine.dataset_key
+    assert engine.sample(len(df_users)) is engine
+    exact = engine.view(engine.default_spec()).total_estimates()
+    approximate = sample.view(sample.default_spec()).total_estimates()
+    assert approximate['booked_low'] <= exact['booked'] <= approximate['booked_high']
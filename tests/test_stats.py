@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from stats import bootstrap_interval, holm_adjust, wilson_interval, z_value
+
+
+def test_wilson_known_values():
+    # 5 из 10, 0 из 10, 10 из 10 при 95% (z = 1.96): справочные значения интервала Уилсона
+    low, high = wilson_interval([5, 0, 10], [10, 10, 10])
+    np.testing.assert_allclose(low, [0.236593, 0.0, 0.722467], atol=1e-6)
+    np.testing.assert_allclose(high, [0.763407, 0.277533, 1.0], atol=1e-6)
+
+
+def test_wilson_bounds_and_empty_groups():
+    low, high = wilson_interval([0, 3, 0], [20, 3, 0], confidence=0.9)
+    assert low[0] == pytest.approx(0.0, abs=1e-12) and high[1] == pytest.approx(1.0, abs=1e-12)
+    assert 0 < high[0] < 1 and 0 < low[1] < 1
+    assert np.isnan(low[2]) and np.isnan(high[2])
+    # Интервал сужается с ростом уверенности вниз и числа наблюдений вверх
+    assert high[0] < wilson_interval(0, 20, confidence=0.99)[1]
+    assert np.diff(wilson_interval([10, 100], [20, 200])[1])[0] < 0
+    assert z_value(0.95) == pytest.approx(1.959964, abs=1e-6)
+
+
+def test_holm_hand_computed():
+    # Отсортированные p: 0.005*4 = 0.02, 0.01*3 = 0.03, 0.03*2 = 0.06, 0.04*1 = 0.04 -> не меньше предыдущего
+    adjusted = holm_adjust([0.01, np.nan, 0.04, 0.03, 0.005])
+    np.testing.assert_allclose(adjusted, [0.03, np.nan, 0.06, 0.06, 0.02])
+    np.testing.assert_allclose(holm_adjust([0.6, 0.5]), [1.0, 1.0])
+    assert holm_adjust([]).size == 0
+
+
+@pytest.fixture(scope='module')
+def groups():
+    return np.array([30, 450, 0, 7]), np.array([100, 500, 0, 7])
+
+
+def test_bootstrap_is_seeded_and_brackets_estimate(groups):
+    successes, trials = groups
+    low, high = bootstrap_interval(successes, trials, resamples=1500, seed=3)
+    again = bootstrap_interval(successes, trials, resamples=1500, seed=3)
+    np.testing.assert_array_equal(low, again[0])
+    np.testing.assert_array_equal(high, again[1])
+
+    estimate = successes[[0, 1, 3]] / trials[[0, 1, 3]]
+    assert np.all(low[[0, 1, 3]] <= estimate) and np.all(estimate <= high[[0, 1, 3]])
+    assert low[0] < estimate[0] < high[0]
+    # Группа без бронирований - NaN, доля 1 - вырожденный интервал
+    assert np.isnan(low[2]) and np.isnan(high[2]) and low[3] == high[3] == 1.0
+    # На больших группах бутстрэп близок к интервалу Уилсона
+    wilson_low, wilson_high = wilson_interval(successes[1], trials[1])
+    assert low[1] == pytest.approx(wilson_low, abs=0.01) and high[1] == pytest.approx(wilson_high, abs=0.01)
+
+
+def test_bootstrap_independent_of_workers(groups):
+    successes, trials = groups
+    serial = bootstrap_interval(successes, trials, resamples=1200, seed=5, workers=1)
+    parallel = bootstrap_interval(successes, trials, resamples=1200, seed=5, workers=2)
+    np.testing.assert_array_equal(serial[0], parallel[0])
+    np.testing.assert_array_equal(serial[1], parallel[1])
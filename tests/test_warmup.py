@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+import warmup
+from aggregates import AggregateCache
+from engine import AnalyticsEngine
+from warmup import AggregateWarmer, likely_specs
+
+
+@pytest.fixture(scope='module')
+def engine(tables):
+    df_users, df_shifts = tables
+    return AnalyticsEngine.from_tables(df_users, df_shifts, 'warmup-test')
+
+
+def engine_for(tables, key, cache=None):
+    df_users, df_shifts = tables
+    return AnalyticsEngine.from_tables(df_users, df_shifts, key, cache=cache)
+
+
+def test_likely_specs_cycle_through_filters(engine):
+    default = engine.default_spec()
+    specs = likely_specs(engine, max_specs=12)
+    assert len(specs) == 12
+    changed = []
+    for spec in specs:
+        diff = [
+            (section, col) for section in ('users', 'shifts')
+            for col in default[section] if spec[section][col] != default[section][col]
+        ]
+        assert len(diff) == 1 and len(spec[diff[0][0]][diff[0][1]]) == 1
+        changed.append(diff[0])
+    # Значения берутся по кругу: первые состояния - разные фильтры
+    assert len(set(changed[:4])) == 4
+
+
+def test_warm_fills_the_cache_once(tables):
+    cache = AggregateCache()
+    engine = engine_for(tables, 'warm-once', cache)
+    warmer = AggregateWarmer(max_workers=2)
+    job = warmer.warm(engine, max_specs=3)
+    assert warmer.warm(engine, max_specs=3) is job and job.total == 4
+    for future in job.futures:
+        future.result(timeout=60)
+    assert job.finished and not job.errors
+
+    misses = cache.stats()['misses']
+    engine.view(engine.default_spec()).compute_all()
+    assert cache.stats()['misses'] == misses
+
+
+def test_warm_jobs_are_bounded(tables, monkeypatch):
+    monkeypatch.setattr(warmup, 'MAX_WARMUP_JOBS', 2)
+    release = threading.Event()
+    monkeypatch.setattr(warmup, '_warm_spec', lambda *args: release.wait(30))
+    warmer = AggregateWarmer(max_workers=1)
+    jobs = [warmer.warm(engine_for(tables, f'bounded-{i}'), max_specs=0) for i in range(3)]
+    # Повторный запрос освежает прогрев: вытесняется самый давний
+    assert warmer.warm(engine_for(tables, 'bounded-1'), max_specs=0) is jobs[1]
+    warmer.warm(engine_for(tables, 'bounded-3'), max_specs=0)
+    assert list(warmer._jobs) == ['bounded-1', 'bounded-3']
+    # Не начатые задачи вытесненных прогревов отменены, ошибками они не считаются
+    assert jobs[2].futures[0].cancelled() and jobs[2].finished and jobs[2].errors == []
+    release.set()
+    jobs[0].futures[0].result(timeout=30)
+
+
+def test_refine_reuses_the_future(engine):
+    warmer = AggregateWarmer(max_workers=1)
+    spec = engine.default_spec()
+    future = warmer.refine(engine, spec)
+    assert warmer.refine(engine, spec) is future
+    future.result(timeout=60)
+    assert warmer.refine(engine, spec) is future
@@ -0,0 +1,127 @@
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aggregates import filter_state_key
+from engine import DEFAULT_RETENTION_HORIZON
+
+# Потоков фонового прогрева (FR_DASHBOARD_WARM_WORKERS); по умолчанию одно ядро остаётся интерфейсу
+DEFAULT_WORKERS = int(os.environ.get('FR_DASHBOARD_WARM_WORKERS', max(1, min(2, (os.cpu_count() or 1) - 1))))
+# Сколько вероятных состояний фильтров прогревается на датасет
+DEFAULT_MAX_SPECS = int(os.environ.get('FR_DASHBOARD_WARM_SPECS', 40))
+# Сколько задач точного пересчёта (предпросмотр по выборке) помнить во всех сессиях
+MAX_REFINEMENTS = 64
+# Сколько прогревов датасетов помнить (старые - по давности запроса)
+MAX_WARMUP_JOBS = 16
+
+
+def likely_specs(engine, max_specs=DEFAULT_MAX_SPECS):
+    """Вероятные следующие состояния фильтров: в одном фильтре выбрано одно значение.
+
+    Значения берутся по кругу из всех фильтров пользователей и смен, поэтому при лимите
+    max_specs каждый фильтр получает хотя бы несколько состояний.
+    """
+    default = engine.default_spec()
+    candidates = [
+        [(section, col, value) for value in values]
+        for section in ('users', 'shifts') for col, values in default[section].items() if len(values) > 1
+    ]
+    specs = []
+    for section, col, value in itertools.chain.from_iterable(
+        itertools.zip_longest(*candidates, fillvalue=(None, None, None))
+    ):
+        if len(specs) >= max_specs:
+            break
+        if section is not None:
+            specs.append({**default, section: {**default[section], col: [value]}})
+    return specs
+
+
+class WarmupJob:
+    """Прогрев одного датасета: задачи пула по состояниям фильтров и их прогресс."""
+
+    def __init__(self, dataset_key, futures):
+        self.dataset_key = dataset_key
+        self.futures = futures
+
+    @property
+    def total(self):
+        return len(self.futures)
+
+    @property
+    def completed(self):
+        return sum(future.done() for future in self.futures)
+
+    @property
+    def finished(self):
+        return self.completed == self.total
+
+    @property
+    def errors(self):
+        return [
+            future.exception() for future in self.futures
+            if future.done() and not future.cancelled() and future.exception() is not None
+        ]
+
+
+class AggregateWarmer:
+    """Фоновый пул потоков, заранее считающий агрегаты вкладок в общий кэш движка.
+
+    После загрузки датасета сначала прогреваются агрегаты всех вкладок без фильтров
+    (когорты, кривая удержания, флаги, бакеты, полные таблицы для Топ-N), затем -
+    вероятные следующие состояния фильтров. Если интерфейс запрашивает агрегат, который
+    сейчас считается в фоне, он ждёт готовый результат, а не считает его повторно.
+
+    Точный пересчёт текущего состояния фильтров для предпросмотра по выборке (refine) идёт
+    в отдельном потоке, чтобы не ждать в очереди за прогревом.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fr-warmup')
+        self._refine_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fr-refine')
+        self._jobs = OrderedDict()
+        self._refinements = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm(self, engine, max_specs=DEFAULT_MAX_SPECS, retention_horizons=(DEFAULT_RETENTION_HORIZON,)):
+        """Запускает прогрев датасета engine (один раз на dataset_key) и возвращает его WarmupJob.
+
+        Помнится не больше MAX_WARMUP_JOBS прогревов; у вытесненного ещё не начатые задачи отменяются.
+        """
+        with self._lock:
+            job = self._jobs.get(engine.dataset_key)
+            if job is None:
+                specs = [engine.default_spec(), *likely_specs(engine, max_specs)]
+                futures = [self._pool.submit(_warm_spec, engine, spec, retention_horizons) for spec in specs]
+                job = self._jobs[engine.dataset_key] = WarmupJob(engine.dataset_key, futures)
+            self._jobs.move_to_end(engine.dataset_key)
+            while len(self._jobs) > MAX_WARMUP_JOBS:
+                _, evicted = self._jobs.popitem(last=False)
+                for future in evicted.futures:
+                    future.cancel()
+            return job
+
+    def refine(self, engine, filter_spec, retention_horizons=(DEFAULT_RETENTION_HORIZON,)):
+        """Future точного расчёта всех вкладок для filter_spec (одна задача на состояние фильтров).
+
+        Результаты попадают в кэш движка; future.done() означает, что точный view готов.
+        """
+        key = filter_state_key(engine.dataset_key, engine.normalize_spec(filter_spec))
+        with self._lock:
+            future = self._refinements.get(key)
+            if future is None or (future.done() and future.exception() is not None):
+                future = self._refine_pool.submit(_warm_spec, engine, filter_spec, retention_horizons)
+            self._refinements[key] = future
+            self._refinements.move_to_end(key)
+            while len(self._refinements) > MAX_REFINEMENTS:
+                self._refinements.popitem(last=False)
+            return future
+
+
+def _warm_spec(engine, filter_spec, retention_horizons):
+    # Результаты остаются только в кэше движка: задача пула не держит ссылок на таблицы
+    view = engine.view(filter_spec)
+    if not view.empty:
+        view.compute_all(retention_horizons)